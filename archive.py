@@ -0,0 +1,182 @@
+"""
+Cold archive of expired tender embeddings
+When the daily cleanup removes the embeddings of expired tenders, it first
+copies them here as quantized codes (ARCHIVE_FORMAT, int8 by default, a
+quarter of the float32 size). The hot vector index and pgvector queries never
+see these rows. Searches with include_archive also rank the archive through
+a separate in-process index of the codes. Only processes that serve such
+searches load that index, and it only holds the active version's rows.
+"""
+import os
+import time
+import logging
+import threading
+import numpy as np
+import sqlalchemy as sa
+from app import db
+from models import Tender, TenderEmbedding, ArchivedEmbedding, EMBEDDING_DIMENSIONS
+import quantization
+import embedding_versions
+import search_filters
+from vector_index import normalize_vector, REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_EXPIRED_EMBEDDINGS = os.environ.get("ARCHIVE_EXPIRED_EMBEDDINGS", "true").lower() == "true"
+ARCHIVE_FORMAT = os.environ.get("ARCHIVE_FORMAT", "int8")
+# Candidates ranked per result when filters are checked against the tenders table
+ARCHIVE_FILTER_OVERFETCH = 10
+
+
+def _version_match(version_id):
+    if version_id is None:
+        return ArchivedEmbedding.version_id.is_(None)
+    return ArchivedEmbedding.version_id == version_id
+
+
+def archive_embeddings(tender_ids):
+    """Copy the embeddings of tenders about to be deleted into the archive. The caller commits.
+
+    Returns:
+        int: Number of rows archived
+    """
+    if not ARCHIVE_EXPIRED_EMBEDDINGS or not tender_ids:
+        return 0
+
+    rows = db.session.query(
+        TenderEmbedding.tender_id, TenderEmbedding.version_id, TenderEmbedding.embedding
+    ).filter(TenderEmbedding.tender_id.in_(tender_ids)).all()
+    archived = set(db.session.query(ArchivedEmbedding.tender_id, ArchivedEmbedding.version_id).filter(
+        ArchivedEmbedding.tender_id.in_(tender_ids)
+    ).all())
+
+    values = []
+    for tender_id, version_id, vector in rows:
+        if (tender_id, version_id) in archived or vector is None:
+            continue
+        blob = quantization.encode_compact(vector, ARCHIVE_FORMAT)
+        if blob is None:
+            continue
+        values.append({
+            'tender_id': tender_id,
+            'version_id': version_id,
+            'embedding_compact': blob,
+            'compact_format': ARCHIVE_FORMAT
+        })
+
+    if values:
+        db.session.execute(sa.insert(ArchivedEmbedding), values)
+    return len(values)
+
+
+class ArchiveIndex:
+    """Quantized archive codes of the active version, loaded on first use"""
+
+    def __init__(self, compact_format=ARCHIVE_FORMAT, dimensions=EMBEDDING_DIMENSIONS):
+        self.compact_format = compact_format
+        self.dimensions = dimensions
+        self._code_dtype, self._code_width = quantization.code_layout(compact_format, dimensions)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._codes = np.empty((0, self._code_width), dtype=self._code_dtype)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._tender_ids = np.empty(0, dtype=object)
+        self._max_id = 0
+        self._version_id = None
+        self._last_refresh = None
+
+    def __len__(self):
+        return len(self._tender_ids)
+
+    @property
+    def nbytes(self):
+        return self._codes.nbytes
+
+    def refresh(self):
+        """Load archive rows added since the last refresh
+
+        Returns:
+            int: Number of rows added
+        """
+        with self._lock:
+            version_id = embedding_versions.active_version_id()
+            if version_id != self._version_id:
+                self._reset()
+                self._version_id = version_id
+
+            rows = db.session.query(
+                ArchivedEmbedding.id, ArchivedEmbedding.tender_id,
+                ArchivedEmbedding.embedding_compact, ArchivedEmbedding.compact_format
+            ).filter(ArchivedEmbedding.id > self._max_id).filter(
+                _version_match(version_id)
+            ).order_by(ArchivedEmbedding.id).all()
+
+            codes, scales, tender_ids = [], [], []
+            for row_id, tender_id, blob, blob_format in rows:
+                self._max_id = max(self._max_id, row_id)
+                decoded = quantization.decode_compact(blob, blob_format, self.dimensions) \
+                    if blob_format == self.compact_format else None
+                if decoded is None:
+                    continue
+                codes.append(decoded[0])
+                scales.append(decoded[1])
+                tender_ids.append(tender_id)
+
+            if codes:
+                # New arrays, so a search running on the previous ones is not affected
+                self._codes = np.concatenate([self._codes, np.stack(codes)])
+                self._scales = np.concatenate([self._scales, np.asarray(scales, dtype=np.float32)])
+                self._tender_ids = np.concatenate([self._tender_ids, np.asarray(tender_ids, dtype=object)])
+                logger.info(f"Archive index loaded {len(codes)} embeddings ({len(self)} total, {self.nbytes} bytes)")
+            self._last_refresh = time.monotonic()
+            return len(codes)
+
+    def refresh_if_stale(self, max_age=REFRESH_INTERVAL):
+        if (self._last_refresh is None or time.monotonic() - self._last_refresh > max_age
+                or embedding_versions.active_version_id() != self._version_id):
+            self.refresh()
+
+    def search(self, query_vector, limit=10, filters=None):
+        """Rank archived tenders by approximate similarity to the query
+
+        Filters are checked against the tenders table for the best
+        ARCHIVE_FILTER_OVERFETCH * limit candidates, so a very narrow filter
+        can return fewer than limit results.
+
+        Returns:
+            list: (tender_id, similarity) tuples sorted by similarity
+        """
+        self.refresh_if_stale()
+        codes, scales, tender_ids = self._codes, self._scales, self._tender_ids
+        query = normalize_vector(query_vector)
+        if query is None or len(tender_ids) == 0 or limit <= 0:
+            return []
+
+        filtered = not search_filters.is_empty(filters)
+        k = min(limit * ARCHIVE_FILTER_OVERFETCH if filtered else limit, len(tender_ids))
+        scores = quantization.score_codes(self.compact_format, codes[:len(tender_ids)], scales[:len(tender_ids)],
+                                          query, self.dimensions)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        ranked = [(tender_ids[i], float(scores[i])) for i in top]
+
+        if filtered:
+            passing = {row[0] for row in search_filters.apply_filters(
+                db.session.query(Tender.tender_id).filter(Tender.tender_id.in_([t for t, _ in ranked])), filters
+            ).all()}
+            ranked = [item for item in ranked if item[0] in passing]
+        return ranked[:limit]
+
+
+def merge_ranked(hot, archived, limit):
+    """Merge hot and archive rankings by similarity, keeping the hot entry of a tender in both"""
+    hot_ids = {tender_id for tender_id, _ in hot}
+    merged = list(hot) + [item for item in archived if item[0] not in hot_ids]
+    merged.sort(key=lambda item: item[1], reverse=True)
+    return merged[:limit]
+
+
+# Loaded by the first search that includes the archive
+archive_index = ArchiveIndex()
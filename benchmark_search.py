@@ -0,0 +1,563 @@
+"""
+Recall and latency benchmark of the vector search backends
+Runs every backend on the same embeddings and queries and compares each result
+list with the exact top k from a brute-force float32 scan. Embeddings are
+either synthetic, drawn around random cluster centres like real tender
+embeddings, or loaded from a .npy matrix or an embedding snapshot directory.
+Each query is a perturbed copy of a random row, so it has close neighbours.
+
+In-process backends score with the same quantization primitives as the vector
+index. Two-stage backends re-rank their candidates from the float32 matrix in
+memory, so their latency excludes the database fetch of the full vectors. The
+pgvector backends (exact scan, HNSW and IVFFlat with ef_search and probes
+sweeps) need PostgreSQL. They load the vectors into a separate
+benchmark_vectors table, which is dropped at the end, and never touch
+tender_embeddings.
+
+Results are printed as JSON, one entry per backend and setting, with recall@k,
+p50/p95/p99 latency in milliseconds, build time and memory: the size of the
+backend's own structures (codes, centroids, index or table), not counting the
+float32 vectors that two-stage and topic backends read as well.
+A float32 matrix of 1M x 1536 takes 6 GB, so large runs need that much RAM.
+
+Usage:
+    python benchmark_search.py --rows 100000 --queries 500 --output benchmark.json
+    python benchmark_search.py --load snapshots/2025-05-01 --backends memory,int8,hnsw --pgvector
+"""
+import os
+import io
+import sys
+import json
+import time
+import struct
+import logging
+import argparse
+import platform
+import numpy as np
+import sqlalchemy as sa
+from app import app, db
+from models import EMBEDDING_DIMENSIONS, COARSE_EMBEDDING_DIMENSIONS
+import quantization
+import pgvector_indexes
+import topics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROWS = 10000
+DEFAULT_QUERIES = 200
+DEFAULT_K = 10
+DEFAULT_SEED = 7
+# Rows per synthetic cluster
+ROWS_PER_CLUSTER = 200
+# Norm of the noise added to a unit cluster centre, about 0.6 cosine to the centre
+CLUSTER_SPREAD = 1.3
+# Norm of the noise added to a row to make a query
+QUERY_NOISE = 0.5
+# Rows generated, scanned or copied per chunk
+CHUNK_ROWS = 20000
+# Queries run before timing, so caches and lazy allocations do not count
+WARMUP_QUERIES = 5
+
+IN_PROCESS_BACKENDS = ("memory", "float16", "int8", "binary", "coarse", "topics")
+PGVECTOR_BACKENDS = ("exact", "hnsw", "ivfflat")
+BENCHMARK_TABLE = "benchmark_vectors"
+# Matrix of an embedding snapshot directory, see embedding_snapshot.MATRIX_FILE; not imported
+# because that module needs the OpenAI client, which the benchmark does not
+SNAPSHOT_MATRIX_FILE = 'embeddings.npy'
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def synthetic_embeddings(rows, dimensions=EMBEDDING_DIMENSIONS, clusters=None, spread=CLUSTER_SPREAD,
+                         seed=DEFAULT_SEED, path=None):
+    """Normalized float32 vectors scattered around random cluster centres
+
+    Args:
+        rows (int): Number of vectors
+        dimensions (int, optional): Vector size
+        clusters (int, optional): Number of centres. Defaults to rows / ROWS_PER_CLUSTER.
+        spread (float, optional): Norm of the noise added to a centre
+        seed (int, optional): Random seed
+        path (str, optional): Write the matrix to this .npy file instead of memory
+
+    Returns:
+        np.ndarray: Matrix of shape (rows, dimensions)
+    """
+    rng = np.random.default_rng(seed)
+    clusters = clusters or max(1, rows // ROWS_PER_CLUSTER)
+    centres = _normalize_rows(rng.standard_normal((clusters, dimensions), dtype=np.float32))
+    sigma = np.float32(spread / np.sqrt(dimensions))
+
+    if path:
+        matrix = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(rows, dimensions))
+    else:
+        matrix = np.empty((rows, dimensions), dtype=np.float32)
+    for start in range(0, rows, CHUNK_ROWS):
+        size = min(CHUNK_ROWS, rows - start)
+        labels = rng.integers(clusters, size=size)
+        noise = rng.standard_normal((size, dimensions), dtype=np.float32) * sigma
+        matrix[start:start + size] = _normalize_rows(centres[labels] + noise)
+    if path:
+        matrix.flush()
+    return matrix
+
+
+def load_embeddings(path, rows=None):
+    """Load a .npy matrix or the matrix of an embedding snapshot, normalized into memory"""
+    if os.path.isdir(path):
+        path = os.path.join(path, SNAPSHOT_MATRIX_FILE)
+    source = np.load(path, mmap_mode='r')
+    if source.ndim != 2:
+        raise ValueError(f"{path} does not hold a matrix")
+    rows = min(rows or len(source), len(source))
+
+    matrix = np.empty((rows, source.shape[1]), dtype=np.float32)
+    for start in range(0, rows, CHUNK_ROWS):
+        matrix[start:start + CHUNK_ROWS] = _normalize_rows(
+            np.asarray(source[start:min(start + CHUNK_ROWS, rows)], dtype=np.float32)
+        )
+    return matrix
+
+
+def make_queries(matrix, count, noise=QUERY_NOISE, seed=DEFAULT_SEED):
+    """Perturbed copies of random rows, normalized"""
+    rng = np.random.default_rng(seed + 1)
+    picks = rng.choice(len(matrix), size=min(count, len(matrix)), replace=False)
+    sigma = np.float32(noise / np.sqrt(matrix.shape[1]))
+    noisy = matrix[np.sort(picks)] + rng.standard_normal((len(picks), matrix.shape[1]), dtype=np.float32) * sigma
+    return _normalize_rows(noisy).astype(np.float32)
+
+
+def _top(scores, k):
+    """Positions of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def exact_neighbours(matrix, queries, k):
+    """Ground truth: the k most similar rows of every query by a float32 scan
+
+    Returns:
+        np.ndarray: Row positions of shape (queries, k), best first
+    """
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(matrix), CHUNK_ROWS):
+        scores = queries @ matrix[start:start + CHUNK_ROWS].T
+        keep = min(k, scores.shape[1])
+        top = np.argpartition(-scores, keep - 1, axis=1)[:, :keep]
+        best_rows = np.concatenate([best_rows, top + start], axis=1)
+        best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        # Keep only the running top k so memory does not grow with the rows
+        order = np.argsort(-best_scores, axis=1)[:, :k]
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+    return best_rows
+
+
+def _rerank(matrix, candidates, query, k):
+    """Exact top k among first-stage candidates"""
+    return candidates[_top(matrix[candidates] @ query, k)]
+
+
+def build_in_process(name, matrix, rerank_candidates, topic_clusters):
+    """Build an in-process backend
+
+    Returns:
+        tuple: (search function taking (query, k, setting), memory in bytes, settings to sweep)
+    """
+    dimensions = matrix.shape[1]
+
+    if name == "memory":
+        def search(query, k, setting):
+            return _top(quantization.score_codes(None, matrix, None, query, dimensions), k)
+        return search, matrix.nbytes, [None]
+
+    if name in quantization.COMPACT_FORMATS:
+        codes, scales = quantization.encode_rows(matrix, name)
+
+        def search(query, k, setting):
+            scores = quantization.score_codes(name, codes, scales, query, dimensions)
+            if not setting:
+                return _top(scores, k)
+            return _rerank(matrix, _top(scores, max(k, setting)), query, k)
+        nbytes = codes.nbytes + (scales.nbytes if name == "int8" else 0)
+        return search, nbytes, rerank_candidates
+
+    if name == "coarse":
+        coarse_dimensions = min(COARSE_EMBEDDING_DIMENSIONS, dimensions)
+        coarse = _normalize_rows(matrix[:, :coarse_dimensions]).astype(np.float32)
+
+        def search(query, k, setting):
+            scores = quantization.score_codes(None, coarse, None,
+                                              _normalize_rows(query[np.newaxis, :coarse_dimensions])[0],
+                                              coarse_dimensions)
+            if not setting:
+                return _top(scores, k)
+            return _rerank(matrix, _top(scores, max(k, setting)), query, k)
+        return search, coarse.nbytes, rerank_candidates
+
+    if name == "topics":
+        clusters = min(topic_clusters, len(matrix))
+        centroids = topics.mini_batch_kmeans(matrix, clusters)
+        positions, _ = topics.assign_nearest(matrix, centroids)
+        # Rows sorted by topic, so the rows of the probed topics are contiguous slices
+        order = np.argsort(positions, kind='stable')
+        bounds = np.searchsorted(positions[order], np.arange(clusters + 1))
+
+        def search(query, k, setting):
+            probed = _top(centroids @ query, setting)
+            rows = np.concatenate([order[bounds[t]:bounds[t + 1]] for t in probed])
+            return rows[_top(matrix[rows] @ query, k)]
+        nbytes = centroids.nbytes + order.nbytes + bounds.nbytes
+        probes = sorted({p for p in (1, 2, topics.TOPIC_PREFILTER_PROBES, 8) if p <= clusters})
+        return search, nbytes, probes
+
+    raise ValueError(f"Unknown in-process backend: {name}")
+
+
+def measure(search, queries, truth, k, setting):
+    """Recall@k and latency percentiles of one backend setting over all queries"""
+    for query in queries[:WARMUP_QUERIES]:
+        search(query, k, setting)
+
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        found = search(query, k, setting)
+        latencies.append((time.perf_counter() - started) * 1000)
+        hits += len(set(np.asarray(found[:k]).tolist()) & set(expected.tolist()))
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'recall_at_k': round(hits / (k * len(queries)), 4),
+        'latency_ms': {
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+            'mean': round(float(np.mean(latencies)), 3)
+        },
+        'qps': round(len(latencies) / (sum(latencies) / 1000), 1) if sum(latencies) else None
+    }
+
+
+def _setting_params(name, setting):
+    if setting is None:
+        return {}
+    if name == "topics":
+        return {'probes': setting}
+    if name == "hnsw":
+        return {'ef_search': setting}
+    if name == "ivfflat":
+        return {'probes': setting}
+    return {'rerank_candidates': setting}
+
+
+def run_in_process(names, matrix, queries, truth, k, rerank_candidates, topic_clusters):
+    results = []
+    for name in names:
+        logger.info(f"Building in-process backend {name}")
+        started = time.perf_counter()
+        search, nbytes, settings = build_in_process(name, matrix, rerank_candidates, topic_clusters)
+        build_seconds = time.perf_counter() - started
+
+        for setting in settings:
+            logger.info(f"Measuring {name} {_setting_params(name, setting)}")
+            results.append({
+                'backend': name,
+                'engine': 'in-process',
+                'params': _setting_params(name, setting),
+                **measure(search, queries, truth, k, setting),
+                'build_seconds': round(build_seconds, 3),
+                'memory_bytes': int(nbytes)
+            })
+    return results
+
+
+def _copy_stream(matrix, start):
+    """Binary COPY stream of (id, embedding) rows, encoded with numpy instead of per value"""
+    rows, dimensions = matrix.shape
+    record = np.dtype([
+        ('fields', '>i2'), ('id_size', '>i4'), ('id', '>i4'),
+        ('vector_size', '>i4'), ('dimensions', '>u2'), ('unused', '>u2'), ('values', '>f4', (dimensions,))
+    ])
+    records = np.empty(rows, dtype=record)
+    records['fields'] = 2
+    records['id_size'] = 4
+    records['id'] = np.arange(start, start + rows)
+    records['vector_size'] = 4 + 4 * dimensions
+    records['dimensions'] = dimensions
+    records['unused'] = 0
+    records['values'] = matrix
+    return io.BytesIO(_COPY_HEADER + records.tobytes() + _COPY_TRAILER)
+
+
+def load_benchmark_table(matrix):
+    """Create benchmark_vectors and copy the matrix into it, row position as id"""
+    with db.engine.begin() as conn:
+        conn.execute(sa.text(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}"))
+        conn.execute(sa.text(
+            f"CREATE TABLE {BENCHMARK_TABLE} (id integer PRIMARY KEY, embedding vector({matrix.shape[1]}))"
+        ))
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        for start in range(0, len(matrix), CHUNK_ROWS):
+            cursor.copy_expert(
+                f"COPY {BENCHMARK_TABLE} (id, embedding) FROM STDIN WITH (FORMAT binary)",
+                _copy_stream(matrix[start:start + CHUNK_ROWS], start)
+            )
+            logger.info(f"Copied {min(start + CHUNK_ROWS, len(matrix))}/{len(matrix)} vectors")
+        cursor.execute(f"ANALYZE {BENCHMARK_TABLE}")
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def _relation_size(conn, relation):
+    return conn.execute(sa.text("SELECT pg_total_relation_size(CAST(:name AS regclass))"),
+                        {"name": relation}).scalar()
+
+
+def _pg_search(conn):
+    """Search function over benchmark_vectors; the knob of each setting is set on the connection beforehand"""
+    statement = sa.text(
+        f"SELECT id FROM {BENCHMARK_TABLE} ORDER BY embedding <=> CAST(:query AS vector) LIMIT :k"
+    )
+
+    def search(query, k, setting):
+        return np.asarray(conn.execute(statement, {"query": query, "k": k}).scalars().all())
+    return search
+
+
+def run_pgvector(names, matrix, queries, truth, k, ef_search_values, probes_values, lists,
+                 maintenance_work_mem=None):
+    """Exact scan and ANN indexes on a copy of the vectors in PostgreSQL"""
+    # Query literals are formatted before timing, like the bound parameter of a real search
+    literals = ['[' + ','.join(f"{x:.8g}" for x in query) + ']' for query in queries]
+    lists = lists or max(pgvector_indexes.MIN_IVFFLAT_LISTS, len(matrix) // 1000)
+    build_params = {
+        'hnsw': {'m': pgvector_indexes.DEFAULT_HNSW_M, 'ef_construction': pgvector_indexes.DEFAULT_HNSW_EF_CONSTRUCTION},
+        'ivfflat': {'lists': lists}
+    }
+    results = []
+
+    logger.info(f"Copying {len(matrix)} vectors into {BENCHMARK_TABLE}")
+    started = time.perf_counter()
+    load_benchmark_table(matrix)
+    load_seconds = time.perf_counter() - started
+
+    try:
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            table_bytes = _relation_size(conn, BENCHMARK_TABLE)
+            if maintenance_work_mem:
+                conn.execute(sa.text("SELECT set_config('maintenance_work_mem', :value, false)"),
+                             {"value": str(maintenance_work_mem)})
+
+            if "exact" in names:
+                logger.info("Measuring pgvector exact scan")
+                results.append({
+                    'backend': 'exact',
+                    'engine': 'pgvector',
+                    'params': {},
+                    **measure(_pg_search(conn), literals, truth, k, None),
+                    'build_seconds': round(load_seconds, 3),
+                    'memory_bytes': int(table_bytes)
+                })
+
+            for method, knob, settings in (("hnsw", "hnsw.ef_search", ef_search_values),
+                                           ("ivfflat", "ivfflat.probes", probes_values)):
+                if method not in names:
+                    continue
+                index_name = f"{BENCHMARK_TABLE}_{method}_idx"
+                create_sql = pgvector_indexes.build_index_sql(index_name, method, lists=lists, table=BENCHMARK_TABLE)
+                logger.info(f"Building {create_sql}")
+                started = time.perf_counter()
+                conn.execute(sa.text(create_sql))
+                build_seconds = time.perf_counter() - started
+                index_bytes = _relation_size(conn, index_name)
+
+                search = _pg_search(conn)
+                for setting in settings:
+                    conn.execute(sa.text(f"SET {knob} = {int(setting)}"))
+                    logger.info(f"Measuring pgvector {method} {_setting_params(method, setting)}")
+                    results.append({
+                        'backend': method,
+                        'engine': 'pgvector',
+                        'params': {**_setting_params(method, setting), **build_params[method]},
+                        **measure(search, literals, truth, k, setting),
+                        'build_seconds': round(build_seconds, 3),
+                        'memory_bytes': int(index_bytes)
+                    })
+                conn.execute(sa.text(f"RESET {knob}"))
+                conn.execute(sa.text(f"DROP INDEX IF EXISTS {index_name}"))
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(sa.text(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}"))
+    return results
+
+
+def peak_memory_bytes():
+    """Peak resident memory of this process, None where the platform does not report it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_benchmark(rows=DEFAULT_ROWS, queries=DEFAULT_QUERIES, k=DEFAULT_K, dimensions=EMBEDDING_DIMENSIONS,
+                  backends=IN_PROCESS_BACKENDS, load=None, save=None, seed=DEFAULT_SEED, spread=CLUSTER_SPREAD,
+                  rerank_candidates=(0, quantization.RERANK_CANDIDATES), topic_clusters=topics.TOPIC_CLUSTERS,
+                  pgvector=False, ef_search_values=(40, 100, 200), probes_values=(1, 10, 32), lists=None,
+                  maintenance_work_mem=None):
+    """Run the selected backends on one dataset and query set
+
+    Args:
+        rows (int, optional): Synthetic vectors to generate, or the most to load
+        queries (int, optional): Number of queries
+        k (int, optional): Results per query
+        backends (tuple, optional): Backend names, see IN_PROCESS_BACKENDS and PGVECTOR_BACKENDS
+        load (str, optional): .npy matrix or snapshot directory to use instead of synthetic vectors
+        save (str, optional): Keep the synthetic matrix in this .npy file for later runs
+        spread (float, optional): Noise around the synthetic cluster centres; higher is harder to search
+        pgvector (bool, optional): Also run the pgvector backends. Defaults to False.
+
+    Returns:
+        dict: Dataset description, ground-truth time and one result per backend setting
+    """
+    started = time.perf_counter()
+    if load:
+        matrix = load_embeddings(load, rows)
+        source = load
+    else:
+        matrix = synthetic_embeddings(rows, dimensions, spread=spread, seed=seed, path=save)
+        source = 'synthetic'
+    query_matrix = make_queries(matrix, queries, seed=seed)
+    logger.info(f"Prepared {len(matrix)} vectors of {matrix.shape[1]} dimensions and {len(query_matrix)} queries "
+                f"in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    truth = exact_neighbours(matrix, query_matrix, k)
+    truth_seconds = time.perf_counter() - started
+    logger.info(f"Computed exact top {k} in {truth_seconds:.1f}s")
+
+    results = run_in_process([b for b in backends if b in IN_PROCESS_BACKENDS], matrix, query_matrix, truth, k,
+                             list(rerank_candidates), topic_clusters)
+
+    pg_backends = [b for b in backends if b in PGVECTOR_BACKENDS]
+    if pgvector and pg_backends:
+        if pgvector_indexes.is_postgresql():
+            results += run_pgvector(pg_backends, matrix, query_matrix, truth, k, list(ef_search_values),
+                                    list(probes_values), lists, maintenance_work_mem)
+        else:
+            logger.warning("pgvector backends require PostgreSQL with pgvector, skipping")
+
+    return {
+        'dataset': {
+            'source': source,
+            'rows': int(len(matrix)),
+            'dimensions': int(matrix.shape[1]),
+            'queries': int(len(query_matrix)),
+            'k': k,
+            'seed': seed,
+            'spread': None if load else spread
+        },
+        'ground_truth_seconds': round(truth_seconds, 3),
+        'results': results,
+        'peak_memory_bytes': peak_memory_bytes(),
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()
+        }
+    }
+
+
+def _int_list(value):
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark recall and latency of the vector search backends')
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS,
+                        help=f'Synthetic vectors to generate, or the most to load (default: {DEFAULT_ROWS})')
+    parser.add_argument('--queries', type=int, default=DEFAULT_QUERIES,
+                        help=f'Number of queries (default: {DEFAULT_QUERIES})')
+    parser.add_argument('--k', type=int, default=DEFAULT_K, help=f'Results per query (default: {DEFAULT_K})')
+    parser.add_argument('--dimensions', type=int, default=EMBEDDING_DIMENSIONS,
+                        help=f'Size of synthetic vectors (default: {EMBEDDING_DIMENSIONS})')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='Random seed')
+    parser.add_argument('--spread', type=float, default=CLUSTER_SPREAD,
+                        help=f'Noise around synthetic cluster centres, higher is harder (default: {CLUSTER_SPREAD})')
+    parser.add_argument('--load', default=None, help='.npy matrix or embedding snapshot directory to benchmark')
+    parser.add_argument('--save', default=None, help='Write the synthetic matrix to this .npy file')
+    parser.add_argument('--backends', default=','.join(IN_PROCESS_BACKENDS + PGVECTOR_BACKENDS),
+                        help='Comma-separated backends: ' + ', '.join(IN_PROCESS_BACKENDS + PGVECTOR_BACKENDS))
+    parser.add_argument('--rerank-candidates', type=_int_list, default=[0, quantization.RERANK_CANDIDATES],
+                        help='Re-ranked candidates of the compact and coarse backends, 0 for none '
+                             f'(default: 0,{quantization.RERANK_CANDIDATES})')
+    parser.add_argument('--topic-clusters', type=int, default=topics.TOPIC_CLUSTERS,
+                        help=f'Clusters of the topics backend (default: {topics.TOPIC_CLUSTERS})')
+    parser.add_argument('--pgvector', action='store_true',
+                        help='Also run the exact, hnsw and ivfflat backends in PostgreSQL')
+    parser.add_argument('--ef-search', type=_int_list, default=[40, 100, 200],
+                        help='HNSW ef_search values (default: 40,100,200)')
+    parser.add_argument('--probes', type=_int_list, default=[1, 10, 32],
+                        help='IVFFlat probes values (default: 1,10,32)')
+    parser.add_argument('--lists', type=int, default=None, help='IVFFlat list count (default: rows / 1000)')
+    parser.add_argument('--maintenance-work-mem', default=None,
+                        help='Memory available to the index builds, e.g. 2GB')
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file instead of stdout')
+
+    args = parser.parse_args()
+    backends = tuple(name.strip() for name in args.backends.split(',') if name.strip())
+    unknown = set(backends) - set(IN_PROCESS_BACKENDS + PGVECTOR_BACKENDS)
+    if unknown:
+        parser.error(f"Unknown backends: {', '.join(sorted(unknown))}")
+
+    with app.app_context():
+        report = run_benchmark(
+            rows=args.rows,
+            queries=args.queries,
+            k=args.k,
+            dimensions=args.dimensions,
+            backends=backends,
+            load=args.load,
+            save=args.save,
+            seed=args.seed,
+            spread=args.spread,
+            rerank_candidates=args.rerank_candidates,
+            topic_clusters=args.topic_clusters,
+            pgvector=args.pgvector,
+            ef_search_values=args.ef_search,
+            probes_values=args.probes,
+            lists=args.lists,
+            maintenance_work_mem=args.maintenance_work_mem
+        )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        logger.info(f"Wrote benchmark report to {args.output}")
+    else:
+        print(output)
@@ -0,0 +1,291 @@
+"""
+Near-duplicate tender detection with locality-sensitive hashing
+Each embedded tender gets a random-hyperplane signature, split into bands that
+are stored as buckets, plus a bucket for its normalized title. A new tender is
+only compared with the tenders sharing one of its buckets, so clustering does
+not need pairwise comparisons. Bands are wide enough that unrelated tenders
+rarely share one even though tender embeddings are strongly correlated, and at
+most MAX_CANDIDATES candidates are checked per tender. Each cluster is named
+after its newest member.
+"""
+import os
+import hashlib
+import datetime
+import logging
+import numpy as np
+from app import app, db
+from models import Tender, TenderEmbedding, TenderSignature, DuplicateBucket, EMBEDDING_DIMENSIONS
+from utils import get_saudi_now
+from lexical_search import normalize_text
+import embedding_versions
+
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity for two tenders to be considered the same tender
+DUPLICATE_THRESHOLD = float(os.environ.get("DUPLICATE_THRESHOLD", 0.97))
+# 24 bands of 20 bits: a pair at cosine 0.97 shares a band with probability 0.994,
+# a typical unrelated pair at cosine 0.5 with probability 0.007
+BAND_BITS = 20
+BANDS = 24
+SIGNATURE_BITS = BAND_BITS * BANDS
+# Band number of the normalized-title bucket
+TITLE_BAND = BANDS
+# Fixed seed so every process computes the same signatures
+LSH_SEED = 20240501
+# Candidates checked per tender, those sharing the title or the most bands first
+MAX_CANDIDATES = 100
+# Extra results ranked before collapsing so that the limit can still be filled
+COLLAPSE_OVERFETCH = 3
+BACKFILL_BATCH_SIZE = 500
+
+_hyperplanes = np.random.default_rng(LSH_SEED).standard_normal(
+    (SIGNATURE_BITS, EMBEDDING_DIMENSIONS)
+).astype(np.float32)
+# Value of each bit within its band, most significant first
+_band_weights = 1 << np.arange(BAND_BITS - 1, -1, -1, dtype=np.int64)
+
+
+def signature_bits(vector):
+    """Random-hyperplane signature bits of a vector"""
+    return (_hyperplanes @ np.asarray(vector, dtype=np.float32)) > 0
+
+
+def band_values(bits):
+    """Split signature bits into BANDS integer band values"""
+    return [int(value) for value in bits.reshape(BANDS, BAND_BITS) @ _band_weights]
+
+
+def compute_signature(vector):
+    """Random-hyperplane signature of a vector as a list of BANDS band values"""
+    return band_values(signature_bits(vector))
+
+
+def title_hash(tender):
+    """Hash of the normalized title and organization, or None without a title"""
+    title = normalize_text(tender.tender_title)
+    if not title:
+        return None
+    key = f"{normalize_text(tender.organization)}|{title}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def bucket_keys(bands, title_key):
+    """(band, bucket) pairs under which a tender is stored"""
+    keys = [(band, f"{value:0{BAND_BITS // 4}x}") for band, value in enumerate(bands)]
+    if title_key:
+        keys.append((TITLE_BAND, title_key))
+    return keys
+
+
+def _candidate_ids(keys, tender_id, limit=MAX_CANDIDATES):
+    """Ids of other open tenders sharing at least one bucket, at most limit of them
+
+    Tenders with the same title come first, then those sharing the most bands,
+    which are the most similar. Buckets of expired tenders are skipped, so they
+    do not take the places of open candidates before the cleanup removes them.
+    """
+    condition = db.or_(*[
+        (DuplicateBucket.band == band) & (DuplicateBucket.bucket == bucket)
+        for band, bucket in keys
+    ])
+    shared_title = db.func.max(db.case((DuplicateBucket.band == TITLE_BAND, 1), else_=0))
+    shared_bands = db.func.count(DuplicateBucket.id)
+    now = get_saudi_now()
+    rows = db.session.query(DuplicateBucket.tender_id).join(
+        Tender, Tender.tender_id == DuplicateBucket.tender_id
+    ).filter(condition).filter(
+        DuplicateBucket.tender_id != tender_id
+    ).filter(
+        (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    ).group_by(DuplicateBucket.tender_id).order_by(
+        shared_title.desc(), shared_bands.desc()
+    ).limit(limit).all()
+    return {row[0] for row in rows}
+
+
+def assign_cluster(tender, vector):
+    """Store the signature and buckets of a tender and place it in a duplicate cluster
+
+    Candidates from shared buckets are confirmed by an identical normalized title
+    or by cosine similarity of at least DUPLICATE_THRESHOLD. All clusters the
+    tender matches are merged and renamed after it. The caller commits.
+
+    Returns:
+        bool: Whether the tender joined an existing cluster, or None for a zero vector
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0 or not np.isfinite(norm):
+        return None
+    vector = vector / norm
+
+    bits = signature_bits(vector)
+    bands = band_values(bits)
+    title_key = title_hash(tender)
+    keys = bucket_keys(bands, title_key)
+    candidate_ids = _candidate_ids(keys, tender.tender_id)
+
+    matched_clusters = set()
+    if candidate_ids:
+        rows = db.session.query(TenderSignature, TenderEmbedding).join(
+            TenderEmbedding, TenderEmbedding.tender_id == TenderSignature.tender_id
+        ).filter(TenderSignature.tender_id.in_(candidate_ids)).filter(embedding_versions.active_filter()).all()
+        for signature, embedding_row in rows:
+            if title_key and signature.title_hash == title_key:
+                matched_clusters.add(signature.cluster_id)
+                continue
+            other = np.asarray(embedding_row.embedding, dtype=np.float32)
+            other_norm = np.linalg.norm(other)
+            if other_norm and float(vector @ other) / other_norm >= DUPLICATE_THRESHOLD:
+                matched_clusters.add(signature.cluster_id)
+
+    # Re-embedding replaces the tender's previous entries
+    DuplicateBucket.query.filter_by(tender_id=tender.tender_id).delete(synchronize_session=False)
+    signature = TenderSignature.query.filter_by(tender_id=tender.tender_id).first()
+    if signature is None:
+        signature = TenderSignature(tender_id=tender.tender_id)
+        db.session.add(signature)
+    signature.signature = np.packbits(bits).tobytes().hex()
+    signature.title_hash = title_key
+    signature.cluster_id = tender.tender_id
+
+    if matched_clusters:
+        TenderSignature.query.filter(
+            TenderSignature.cluster_id.in_(matched_clusters)
+        ).update({TenderSignature.cluster_id: tender.tender_id}, synchronize_session=False)
+
+    db.session.add_all([
+        DuplicateBucket(band=band, bucket=bucket, tender_id=tender.tender_id)
+        for band, bucket in keys
+    ])
+    # Make this tender visible to the next one in the same batch
+    db.session.flush()
+    return bool(matched_clusters)
+
+
+def assign_clusters(tenders, vectors):
+    """Cluster newly embedded tenders, oldest publication first, and commit
+
+    Returns:
+        int: Number of tenders that joined an existing cluster
+    """
+    # Clusters are renamed after each joining tender, so the newest one ends up naming it
+    pairs = sorted(zip(tenders, vectors), key=lambda pair: pair[0].publication_date or datetime.datetime.min)
+    joined = sum(1 for tender, vector in pairs if assign_cluster(tender, vector))
+    db.session.commit()
+
+    if joined:
+        logger.info(f"{joined} new tenders matched existing duplicate clusters")
+    return joined
+
+
+def remove_tenders(tender_ids):
+    """Delete the signatures and buckets of tenders whose embeddings are removed. The caller commits.
+
+    Returns:
+        int: Number of buckets deleted
+    """
+    removed = DuplicateBucket.query.filter(
+        DuplicateBucket.tender_id.in_(tender_ids)
+    ).delete(synchronize_session=False)
+    TenderSignature.query.filter(
+        TenderSignature.tender_id.in_(tender_ids)
+    ).delete(synchronize_session=False)
+    return removed
+
+
+def cluster_ids(tender_ids):
+    """Map tender ids to their cluster ids; unclustered tenders map to themselves"""
+    tender_ids = list(tender_ids)
+    clusters = dict(db.session.query(TenderSignature.tender_id, TenderSignature.cluster_id).filter(
+        TenderSignature.tender_id.in_(tender_ids)
+    ).all()) if tender_ids else {}
+    return {tender_id: clusters.get(tender_id, tender_id) for tender_id in tender_ids}
+
+
+def collapse_ranked(ranked, limit=None):
+    """Keep only the best-ranked tender of each duplicate cluster
+
+    Args:
+        ranked (list): (tender_id, score) tuples in ranking order
+        limit (int, optional): Maximum number of results to keep
+
+    Returns:
+        list: The collapsed ranking
+    """
+    clusters = cluster_ids(tender_id for tender_id, _ in ranked)
+    seen = set()
+    collapsed = []
+    for tender_id, score in ranked:
+        cluster = clusters[tender_id]
+        if cluster in seen:
+            continue
+        seen.add(cluster)
+        collapsed.append((tender_id, score))
+        if limit is not None and len(collapsed) >= limit:
+            break
+    return collapsed
+
+
+def collapse_query(query):
+    """Restrict a Tender query to the newest tender of each duplicate cluster"""
+    return query.outerjoin(
+        TenderSignature, TenderSignature.tender_id == Tender.tender_id
+    ).filter(
+        (TenderSignature.id.is_(None)) | (TenderSignature.cluster_id == Tender.tender_id)
+    )
+
+
+def backfill_clusters(batch_size=BACKFILL_BATCH_SIZE):
+    """Cluster every embedded tender that has no signature yet
+
+    Returns:
+        int: Number of tenders clustered
+    """
+    count = 0
+    last_id = 0
+    while True:
+        # Paged by id because zero vectors never get a signature
+        rows = db.session.query(Tender, TenderEmbedding).join(
+            TenderEmbedding, embedding_versions.active_embedding_join()
+        ).outerjoin(
+            TenderSignature, TenderSignature.tender_id == Tender.tender_id
+        ).filter(
+            TenderSignature.id.is_(None)
+        ).filter(
+            Tender.id > last_id
+        ).order_by(Tender.id).limit(batch_size).all()
+
+        if not rows:
+            break
+
+        last_id = rows[-1][0].id
+        assign_clusters([tender for tender, _ in rows], [row.embedding for _, row in rows])
+        count += len(rows)
+        logger.info(f"Clustered {count} tenders")
+
+        if len(rows) < batch_size:
+            break
+
+    return count
+
+
+def rebuild_clusters():
+    """Drop every signature and bucket and cluster all embedded tenders again
+
+    Needed whenever signatures stop being comparable, after a model change or a
+    change of the band layout.
+
+    Returns:
+        int: Number of tenders clustered
+    """
+    DuplicateBucket.query.delete(synchronize_session=False)
+    TenderSignature.query.delete(synchronize_session=False)
+    db.session.commit()
+    return backfill_clusters()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        backfill_clusters()
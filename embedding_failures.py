@@ -0,0 +1,188 @@
+"""
+Outbox for tenders whose embedding could not be created
+Provider errors, empty texts and unusable vectors (zero, non-finite or of the
+wrong size) are recorded here instead of being stored as zero vectors. Failed
+tenders are skipped until their backoff expires and then retried by the next
+batch; after EMBEDDING_MAX_ATTEMPTS they are parked until their text changes.
+"""
+import os
+import datetime
+import logging
+import numpy as np
+from app import app, db
+from models import Tender, TenderEmbedding, EmbeddingFailure, EMBEDDING_DIMENSIONS
+from utils import get_saudi_now
+
+logger = logging.getLogger(__name__)
+
+# Delay before the first retry, doubled after every further failure
+RETRY_BASE_SECONDS = int(os.environ.get("EMBEDDING_RETRY_BASE_SECONDS", 300))
+RETRY_MAX_SECONDS = int(os.environ.get("EMBEDDING_RETRY_MAX_SECONDS", 6 * 3600))
+EMBEDDING_MAX_ATTEMPTS = int(os.environ.get("EMBEDDING_MAX_ATTEMPTS", 8))
+PURGE_BATCH_SIZE = 500
+
+
+def is_valid_vector(vector, dimensions):
+    """Whether a vector can be stored and searched: right size, finite and not all zeros"""
+    if vector is None:
+        return False
+    vector = np.asarray(vector, dtype=np.float32)
+    if vector.shape != (dimensions,):
+        return False
+    norm = np.linalg.norm(vector)
+    return bool(norm > 0 and np.isfinite(norm))
+
+
+def _version_match(version_id):
+    if version_id is None:
+        return EmbeddingFailure.version_id.is_(None)
+    return EmbeddingFailure.version_id == version_id
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt after `attempts` failures"""
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+
+def backoff_filter(version_id, now=None):
+    """Filter on Tender excluding tenders that are waiting for a retry or parked"""
+    now = now or get_saudi_now()
+    waiting = db.session.query(EmbeddingFailure.id).filter(
+        EmbeddingFailure.tender_id == Tender.tender_id
+    ).filter(_version_match(version_id)).filter(
+        (EmbeddingFailure.next_attempt_at > now) | (EmbeddingFailure.attempts >= EMBEDDING_MAX_ATTEMPTS)
+    )
+    return ~waiting.exists()
+
+
+def seconds_until_retry(version_id):
+    """Seconds until the next failed tender of a version is due for a retry, None if none is waiting"""
+    next_attempt_at = db.session.query(db.func.min(EmbeddingFailure.next_attempt_at)).filter(
+        _version_match(version_id)
+    ).filter(EmbeddingFailure.attempts < EMBEDDING_MAX_ATTEMPTS).scalar()
+    if next_attempt_at is None:
+        return None
+    # Stored as wall-clock Saudi time without an offset
+    return max((next_attempt_at.replace(tzinfo=None) - get_saudi_now().replace(tzinfo=None)).total_seconds(), 0)
+
+
+def failed_filter(version_id):
+    """Filter on Tender selecting tenders with a failed attempt in a version
+
+    A tender that still has an embedding in the version is one whose new text
+    failed to embed; its previous embedding serves until the retry succeeds.
+    """
+    return db.session.query(EmbeddingFailure.id).filter(
+        EmbeddingFailure.tender_id == Tender.tender_id
+    ).filter(_version_match(version_id)).exists()
+
+
+def parked_filter(version_id):
+    """Filter on Tender selecting tenders that exhausted their attempts"""
+    return db.session.query(EmbeddingFailure.id).filter(
+        EmbeddingFailure.tender_id == Tender.tender_id
+    ).filter(_version_match(version_id)).filter(
+        EmbeddingFailure.attempts >= EMBEDDING_MAX_ATTEMPTS
+    ).exists()
+
+
+def record_failures(tender_ids, version_id, error):
+    """Count a failed attempt for each tender and schedule its retry. The caller commits.
+
+    Returns:
+        int: Number of tenders recorded
+    """
+    tender_ids = list(dict.fromkeys(tender_ids))
+    if not tender_ids:
+        return 0
+
+    now = get_saudi_now()
+    existing = {
+        failure.tender_id: failure
+        for failure in EmbeddingFailure.query.filter(
+            EmbeddingFailure.tender_id.in_(tender_ids)
+        ).filter(_version_match(version_id)).all()
+    }
+
+    error = str(error)[:1000]
+    for tender_id in tender_ids:
+        failure = existing.get(tender_id)
+        if failure is None:
+            failure = EmbeddingFailure(tender_id=tender_id, version_id=version_id, attempts=0, first_failed_at=now)
+            db.session.add(failure)
+        failure.attempts += 1
+        failure.last_error = error
+        failure.last_failed_at = now
+        failure.next_attempt_at = now + datetime.timedelta(seconds=retry_delay(failure.attempts))
+
+    logger.warning(f"Embedding failed for {len(tender_ids)} tenders: {error}")
+    return len(tender_ids)
+
+
+def clear_failures(tender_ids, version_id=None, all_versions=False):
+    """Forget the failures of tenders that were embedded or whose text changed. The caller commits."""
+    tender_ids = list(tender_ids)
+    if not tender_ids:
+        return 0
+    query = EmbeddingFailure.query.filter(EmbeddingFailure.tender_id.in_(tender_ids))
+    if not all_versions:
+        query = query.filter(_version_match(version_id))
+    return query.delete(synchronize_session=False)
+
+
+def failure_stats(version_id):
+    """Failure counts of one embedding version for the stats endpoint"""
+    now = get_saudi_now()
+    base = EmbeddingFailure.query.filter(_version_match(version_id))
+    return {
+        'failed_tenders': base.count(),
+        'retry_pending': base.filter(
+            EmbeddingFailure.attempts < EMBEDDING_MAX_ATTEMPTS,
+            EmbeddingFailure.next_attempt_at > now
+        ).count(),
+        'retry_due': base.filter(
+            EmbeddingFailure.attempts < EMBEDDING_MAX_ATTEMPTS,
+            (EmbeddingFailure.next_attempt_at.is_(None)) | (EmbeddingFailure.next_attempt_at <= now)
+        ).count(),
+        'parked': base.filter(EmbeddingFailure.attempts >= EMBEDDING_MAX_ATTEMPTS).count(),
+        'total_attempts': db.session.query(
+            db.func.coalesce(db.func.sum(EmbeddingFailure.attempts), 0)
+        ).filter(_version_match(version_id)).scalar()
+    }
+
+
+def purge_invalid_embeddings(batch_size=PURGE_BATCH_SIZE):
+    """Delete stored zero or malformed vectors so their tenders are embedded again
+
+    Returns:
+        int: Number of embeddings removed
+    """
+    removed = 0
+    last_id = 0
+    while True:
+        rows = TenderEmbedding.query.filter(
+            TenderEmbedding.id > last_id
+        ).order_by(TenderEmbedding.id).limit(batch_size).all()
+        if not rows:
+            break
+
+        last_id = rows[-1].id
+        invalid = [
+            row.id for row in rows
+            if not is_valid_vector(row.embedding, EMBEDDING_DIMENSIONS)
+        ]
+        if invalid:
+            TenderEmbedding.query.filter(TenderEmbedding.id.in_(invalid)).delete(synchronize_session=False)
+            db.session.commit()
+            removed += len(invalid)
+        # Rows stay in the session otherwise
+        db.session.expunge_all()
+
+    logger.info(f"Removed {removed} invalid embeddings")
+    return removed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        purge_invalid_embeddings()
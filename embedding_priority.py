@@ -0,0 +1,121 @@
+"""
+Priority ordering for the embedding backlog
+Scheduled runs only embed a few batches, so tenders without an embedding are
+ranked before the budget is spent. The score is a weighted sum of
+  recency      - 1 when just published, halving every PRIORITY_RECENCY_HALF_LIFE_DAYS
+  deadline     - 1 when the submission deadline is now, halving every
+                 PRIORITY_DEADLINE_HALF_LIFE_DAYS further away
+  subscription - 1 when a saved search with filters is waiting for the
+                 tender's organization, type or city
+Tenders with no publication date or deadline score 0 on that part.
+"""
+import os
+import logging
+import numpy as np
+from models import Tender, SearchSubscription
+from utils import get_saudi_now
+from vector_index import to_saudi_timestamp
+import subscriptions
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_RECENCY_WEIGHT = float(os.environ.get("PRIORITY_RECENCY_WEIGHT", 1.0))
+PRIORITY_DEADLINE_WEIGHT = float(os.environ.get("PRIORITY_DEADLINE_WEIGHT", 0.5))
+PRIORITY_SUBSCRIPTION_WEIGHT = float(os.environ.get("PRIORITY_SUBSCRIPTION_WEIGHT", 1.0))
+PRIORITY_RECENCY_HALF_LIFE_DAYS = float(os.environ.get("PRIORITY_RECENCY_HALF_LIFE_DAYS", 3))
+PRIORITY_DEADLINE_HALF_LIFE_DAYS = float(os.environ.get("PRIORITY_DEADLINE_HALF_LIFE_DAYS", 7))
+
+_DAY_SECONDS = 86400.0
+# Tenders loaded per IN (...) query
+LOAD_CHUNK_ROWS = 500
+
+
+def _decay(seconds, half_life_days):
+    """0.5 ** (days / half_life), with NaN (unknown) mapped to 0"""
+    days = np.maximum(seconds, 0.0) / _DAY_SECONDS
+    return np.nan_to_num(np.power(0.5, days / half_life_days), nan=0.0)
+
+
+def waiting_subscriptions(rows):
+    """Whether an active saved search with at least one filter would accept each tender
+
+    Args:
+        rows (list): (organization, tender_type, city) tuples
+
+    Returns:
+        numpy.ndarray: Boolean flag per row
+    """
+    waiting = np.zeros(len(rows), dtype=bool)
+    saved = SearchSubscription.query.filter_by(active=True).with_entities(
+        *[getattr(SearchSubscription, field) for field in subscriptions.FILTER_FIELDS]
+    ).all()
+    # Unfiltered saved searches wait for every tender, so they do not change the order
+    saved = [filters for filters in saved if any(filters)]
+    if not saved or not rows:
+        return waiting
+
+    values = np.array(rows, dtype=object).reshape(len(rows), len(subscriptions.FILTER_FIELDS))
+    for filters in saved:
+        accepted = np.ones(len(rows), dtype=bool)
+        for column, value in enumerate(filters):
+            if value is not None:
+                accepted &= values[:, column] == value
+        waiting |= accepted
+    return waiting
+
+
+def backlog_scores(rows, now=None):
+    """Priority score per backlog tender
+
+    Args:
+        rows (list): (publication_date, submission_deadline, organization, tender_type, city) tuples
+        now (datetime, optional): Reference time. Defaults to the current Saudi time.
+
+    Returns:
+        numpy.ndarray: Scores, higher is embedded first
+    """
+    now_ts = to_saudi_timestamp(now or get_saudi_now(), 0.0)
+    published = np.array([to_saudi_timestamp(row[0], np.nan) for row in rows], dtype=np.float64)
+    deadlines = np.array([to_saudi_timestamp(row[1], np.nan) for row in rows], dtype=np.float64)
+
+    scores = PRIORITY_RECENCY_WEIGHT * _decay(now_ts - published, PRIORITY_RECENCY_HALF_LIFE_DAYS)
+    scores += PRIORITY_DEADLINE_WEIGHT * _decay(deadlines - now_ts, PRIORITY_DEADLINE_HALF_LIFE_DAYS)
+    if PRIORITY_SUBSCRIPTION_WEIGHT:
+        scores += PRIORITY_SUBSCRIPTION_WEIGHT * waiting_subscriptions([row[2:] for row in rows])
+    return scores
+
+
+def select_backlog(query, limit=None):
+    """Load the highest-priority tenders of a backlog query
+
+    Only the columns needed for scoring are read for the whole backlog; the
+    selected tenders are then loaded in priority order.
+
+    Args:
+        query: Query of Tender rows that still need an embedding
+        limit (int, optional): Number of tenders to return. Defaults to None (all).
+
+    Returns:
+        list: Tender objects, highest priority first
+    """
+    rows = query.with_entities(
+        Tender.id, Tender.publication_date, Tender.submission_deadline,
+        Tender.organization, Tender.tender_type, Tender.city
+    ).all()
+    if not rows:
+        return []
+
+    scores = backlog_scores([row[1:] for row in rows])
+    # Stable sort keeps database order among equal scores
+    order = np.argsort(-scores, kind='stable')
+    if limit:
+        order = order[:limit]
+
+    ids = [rows[i][0] for i in order]
+    tenders = {}
+    for start in range(0, len(ids), LOAD_CHUNK_ROWS):
+        tenders.update(
+            (tender.id, tender)
+            for tender in Tender.query.filter(Tender.id.in_(ids[start:start + LOAD_CHUNK_ROWS])).all()
+        )
+    return [tenders[tender_id] for tender_id in ids if tender_id in tenders]
@@ -0,0 +1,126 @@
+"""
+Event-driven embedding of newly scraped tenders
+The scraper publishes the IDs of new tenders, and of updated tenders whose
+embedding text changed, to an in-process queue. A background thread collects
+them into micro-batches and embeds a batch once it holds EMBED_QUEUE_FLUSH_SIZE
+tenders or EMBED_QUEUE_FLUSH_SECONDS after its first tender arrived, so new
+tenders become searchable within about a minute while provider calls stay
+batched. The scheduled embeddings job still picks up anything the queue missed,
+e.g. tenders published before a restart.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+from app import db
+from utils import get_saudi_now
+import embeddings
+
+logger = logging.getLogger(__name__)
+
+EVENT_EMBEDDINGS = os.environ.get("EVENT_EMBEDDINGS", "true").lower() == "true"
+# Flush once this many tenders are waiting, one provider call per batch
+EMBED_QUEUE_FLUSH_SIZE = int(os.environ.get("EMBED_QUEUE_FLUSH_SIZE", embeddings.MAX_BATCH_SIZE))
+# Flush at the latest this many seconds after the first tender of a batch arrived
+EMBED_QUEUE_FLUSH_SECONDS = float(os.environ.get("EMBED_QUEUE_FLUSH_SECONDS", 10))
+
+
+class EmbeddingQueue:
+    """Queue of tender IDs consumed by a micro-batching embedder thread"""
+
+    def __init__(self, flush_size=EMBED_QUEUE_FLUSH_SIZE, flush_seconds=EMBED_QUEUE_FLUSH_SECONDS):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._queue = queue.Queue()
+        self._thread = None
+        self.embedded = 0
+        self.batches = 0
+        self.last_flush = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def pending(self):
+        """Number of tender IDs waiting to be embedded"""
+        return self._queue.qsize()
+
+    def publish(self, tender_ids, changed=False):
+        """Queue tenders for embedding
+
+        Args:
+            tender_ids (list): IDs of committed tenders
+            changed (bool, optional): The tenders already had an embedding whose text changed
+        """
+        # Without a consumer, the scheduled job embeds them instead
+        if not self.running:
+            return
+        for tender_id in tender_ids:
+            self._queue.put((tender_id, changed))
+
+    def start(self, app):
+        """Start the embedder thread once per process"""
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, args=(app,), name='embedding-queue', daemon=True)
+        self._thread.start()
+        logger.info(f"Embedding queue started, flushing every {self.flush_size} tenders or {self.flush_seconds}s")
+
+    def _collect(self):
+        """Block for the first tender, then gather more until the batch is full or times out
+
+        Returns:
+            dict: tender_id -> whether its previous embedding has to be replaced
+        """
+        tender_id, changed = self._queue.get()
+        batch = {tender_id: changed}
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                tender_id, changed = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch[tender_id] = batch.get(tender_id, False) or changed
+        return batch
+
+    def _run(self, app):
+        while True:
+            batch = self._collect()
+            with app.app_context():
+                self.flush(batch)
+
+    def flush(self, batch):
+        """Embed one micro-batch, replacing the stale embeddings of changed tenders
+
+        Returns:
+            int: Number of tenders embedded
+        """
+        try:
+            changed = [tender_id for tender_id, is_changed in batch.items() if is_changed]
+            count = embeddings.batch_embed_tenders(tender_ids=list(batch), changed_ids=changed)
+            self.embedded += count
+            self.batches += 1
+            self.last_flush = get_saudi_now()
+            logger.info(f"Embedding queue embedded {count} of {len(batch)} tenders, {self.pending()} waiting")
+            return count
+        except Exception as e:
+            logger.error(f"Error embedding queued tenders: {str(e)}")
+            db.session.rollback()
+            return 0
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'pending': self.pending(),
+            'batches': self.batches,
+            'embedded': self.embedded,
+            'last_flush': self.last_flush.isoformat() if self.last_flush else None
+        }
+
+
+# Shared by the scraper and the embedder thread of this process
+embedding_queue = EmbeddingQueue()
@@ -0,0 +1,226 @@
+"""
+Export and import of embedding snapshots
+A snapshot is a directory holding the active version's vectors as one float32
+embeddings.npy matrix, tender_ids.json with the tender ID and a hash of the
+embedded text for each matrix row, and meta.json with the model, dimensions
+and text template. Importing writes the rows back with the bulk embedding
+writer, so a new node or a restored database is ready to search without
+embedding every tender through the provider again. Rows whose tender is
+missing, already embedded, or whose text changed since the export are skipped.
+
+Usage:
+    python embedding_snapshot.py export snapshots/2025-05-01
+    python embedding_snapshot.py import snapshots/2025-05-01
+"""
+import os
+import json
+import hashlib
+import logging
+import argparse
+import numpy as np
+from app import app, db
+from models import Tender, TenderEmbedding, EmbeddingVersion, EMBEDDING_DIMENSIONS
+from utils import get_saudi_now
+import embeddings
+import embedding_versions
+import embedding_writer
+import embedding_failures
+import duplicates
+import neighbors
+import topics
+from response_cache import bump_data_version
+from vector_index import vector_index
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+SNAPSHOT_FORMAT = 1
+
+MATRIX_FILE = 'embeddings.npy'
+IDS_FILE = 'tender_ids.json'
+META_FILE = 'meta.json'
+
+
+def text_hash(tender, template):
+    """Short hash of the text a tender is embedded from, to detect edits after the export"""
+    text = embedding_versions.tender_text(tender, template)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def export_snapshot(path, batch_size=DEFAULT_BATCH_SIZE):
+    """Write the active version's embeddings to a snapshot directory
+
+    Args:
+        path (str): Snapshot directory, created if needed
+        batch_size (int, optional): Rows read per query
+
+    Returns:
+        int: Number of embeddings exported
+    """
+    version = embeddings.active_version()
+    query = db.session.query(TenderEmbedding, Tender).join(
+        Tender, embedding_versions.embedding_join(version.id)
+    )
+    total = query.count()
+
+    os.makedirs(path, exist_ok=True)
+    matrix_path = os.path.join(path, MATRIX_FILE)
+    # Written in place so the whole matrix is never held in memory
+    matrix = np.lib.format.open_memmap(matrix_path, mode='w+', dtype=np.float32, shape=(total, version.dimensions))
+
+    tender_ids = []
+    text_hashes = []
+    last_id = 0
+    while len(tender_ids) < total:
+        rows = query.filter(TenderEmbedding.id > last_id).order_by(TenderEmbedding.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1][0].id
+
+        for row, tender in rows:
+            if len(tender_ids) == total or not embedding_failures.is_valid_vector(row.embedding, version.dimensions):
+                continue
+            matrix[len(tender_ids)] = np.asarray(row.embedding, dtype=np.float32)
+            tender_ids.append(tender.tender_id)
+            text_hashes.append(text_hash(tender, version.template))
+        # Rows stay in the session otherwise
+        db.session.expunge_all()
+        logger.info(f"Exported {len(tender_ids)}/{total} embeddings")
+
+    matrix.flush()
+    del matrix
+    if len(tender_ids) < total:
+        # Invalid rows were skipped, so the matrix is shorter than allocated
+        trimmed_path = os.path.join(path, 'embeddings.trimmed.npy')
+        np.save(trimmed_path, np.load(matrix_path, mmap_mode='r')[:len(tender_ids)])
+        os.replace(trimmed_path, matrix_path)
+
+    with open(os.path.join(path, IDS_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'tender_ids': tender_ids, 'text_hashes': text_hashes}, f, ensure_ascii=False)
+    with open(os.path.join(path, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'format': SNAPSHOT_FORMAT,
+            'model': version.model,
+            'dimensions': version.dimensions,
+            'template': version.template,
+            'count': len(tender_ids),
+            'exported_at': get_saudi_now().isoformat()
+        }, f, indent=2)
+
+    logger.info(f"Exported {len(tender_ids)} embeddings of {version.model} ({version.template}) to {path}")
+    return len(tender_ids)
+
+
+def load_snapshot(path):
+    """Read a snapshot's metadata, IDs and text hashes, and map its matrix
+
+    Raises:
+        ValueError: If the files do not form a snapshot this database can hold
+    """
+    with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+    with open(os.path.join(path, IDS_FILE), encoding='utf-8') as f:
+        ids = json.load(f)
+    matrix = np.load(os.path.join(path, MATRIX_FILE), mmap_mode='r')
+
+    if meta.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format {meta.get('format')}")
+    if meta['dimensions'] != EMBEDDING_DIMENSIONS:
+        raise ValueError(f"The embedding column holds {EMBEDDING_DIMENSIONS} dimensions, the snapshot has {meta['dimensions']}")
+    if matrix.shape != (len(ids['tender_ids']), meta['dimensions']) or len(ids['text_hashes']) != len(ids['tender_ids']):
+        raise ValueError("Snapshot matrix and ID list do not match")
+    return meta, ids['tender_ids'], ids['text_hashes'], matrix
+
+
+def snapshot_version(meta):
+    """Version the snapshot is imported into
+
+    On a database without embeddings yet it becomes the active version. Otherwise
+    a snapshot of another model or template fills a building version that can be
+    activated once it covers every open tender.
+    """
+    active = EmbeddingVersion.query.filter_by(status=embedding_versions.VERSION_ACTIVE).first()
+    if active is None:
+        version = embedding_versions.ensure_initial_version(meta['model'], meta['dimensions'], meta['template'])
+    else:
+        version = embedding_versions.get_or_create_version(meta['model'], meta['dimensions'], meta['template'])
+    return embedding_versions.VersionInfo(version.id, version.model, version.dimensions, version.template)
+
+
+def import_snapshot(path, batch_size=DEFAULT_BATCH_SIZE, check_text=True):
+    """Bulk insert the embeddings of a snapshot
+
+    Args:
+        path (str): Snapshot directory
+        batch_size (int, optional): Rows inserted per transaction
+        check_text (bool, optional): Skip tenders whose text changed since the export. Defaults to True.
+
+    Returns:
+        int: Number of embeddings inserted
+    """
+    meta, tender_ids, text_hashes, matrix = load_snapshot(path)
+    version = snapshot_version(meta)
+    logger.info(f"Importing {len(tender_ids)} embeddings into version {version.id} ({version.model}, {version.template})")
+
+    inserted = 0
+    skipped = 0
+    for start in range(0, len(tender_ids), batch_size):
+        chunk = tender_ids[start:start + batch_size]
+        tenders = {t.tender_id: t for t in Tender.query.filter(Tender.tender_id.in_(chunk)).all()}
+        existing = {row[0] for row in db.session.query(TenderEmbedding.tender_id).filter(
+            TenderEmbedding.tender_id.in_(chunk)
+        ).filter(embedding_versions.version_filter(version.id)).all()}
+
+        rows = []
+        for offset, tender_id in enumerate(chunk):
+            tender = tenders.get(tender_id)
+            if tender is None or tender_id in existing:
+                continue
+            if check_text and text_hash(tender, version.template) != text_hashes[start + offset]:
+                continue
+            rows.append(embedding_writer.embedding_row(tender_id, matrix[start + offset].tolist(), version.id))
+
+        try:
+            count = embedding_writer.write_embeddings(rows)
+            embedding_failures.clear_failures([row['tender_id'] for row in rows], version.id)
+            db.session.commit()
+        except Exception as e:
+            logger.error(f"Error importing embeddings: {str(e)}")
+            db.session.rollback()
+            raise
+
+        inserted += count
+        skipped += len(chunk) - count
+        db.session.expunge_all()
+        logger.info(f"Imported {inserted}/{len(tender_ids)} embeddings")
+
+    logger.info(f"Imported {inserted} embeddings, skipped {skipped} missing, existing or changed tenders")
+
+    if inserted and version.id == embedding_versions.active_version_id():
+        vector_index.refresh_if_loaded()
+        bump_data_version()
+        # Clusters, neighbour lists and topics are derived from the active version's vectors
+        duplicates.backfill_clusters()
+        if neighbors.PRECOMPUTE_NEIGHBORS:
+            neighbors.refresh_all_neighbors()
+        topics.recompute_topics()
+    return inserted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export or import embedding snapshots')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('path', help='Snapshot directory')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Rows per query or transaction (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--skip-text-check', action='store_true',
+                        help='Import vectors even for tenders whose text changed since the export')
+
+    args = parser.parse_args()
+    with app.app_context():
+        if args.command == 'export':
+            export_snapshot(args.path, args.batch_size)
+        else:
+            import_snapshot(args.path, args.batch_size, check_text=not args.skip_text_check)
@@ -0,0 +1,280 @@
+"""
+Versioned embeddings
+Each embedding row belongs to a version keyed by (model, dimensions, text
+template). Search and new embeddings use the single active version; a new
+version is built in the background next to it (see regenerate_all_embeddings.py),
+becomes active in one UPDATE once it covers every open tender, and the retired
+version's rows are deleted afterwards in batches.
+
+Rows written before versioning have no version_id and are served while no
+version is active; migrate_embedding_versions.py assigns them to the first version.
+"""
+import time
+import datetime
+import logging
+import threading
+from collections import namedtuple
+import sqlalchemy as sa
+from app import db
+from models import (Tender, TenderEmbedding, EmbeddingVersion, EmbeddingFailure, ArchivedEmbedding,
+                    SearchSubscription, EMBEDDING_DIMENSIONS)
+from utils import get_saudi_now
+import embedding_failures
+from response_cache import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+VERSION_BUILDING = 'building'
+VERSION_ACTIVE = 'active'
+VERSION_RETIRED = 'retired'
+
+# How long a process keeps using its cached active version before re-reading it
+ACTIVE_CACHE_SECONDS = 30
+# Retired rows are kept at least this long so processes with a stale cache can finish
+RETIRED_GRACE_SECONDS = 300
+GC_BATCH_SIZE = 1000
+
+VersionInfo = namedtuple('VersionInfo', ['id', 'model', 'dimensions', 'template'])
+
+
+def detailed_text(tender):
+    """Title, organization and activities plus the tender type and city"""
+    parts = [tender.get_text_for_embedding(), tender.tender_type or "", tender.city or ""]
+    return " ".join(part for part in parts if part)
+
+
+# Text templates a version can embed, by name
+TEXT_TEMPLATES = {
+    'title_org_activities': lambda tender: tender.get_text_for_embedding(),
+    'detailed': detailed_text,
+}
+DEFAULT_TEMPLATE = 'title_org_activities'
+
+_active = None
+_active_loaded_at = None
+_active_lock = threading.Lock()
+
+
+def tender_text(tender, template=DEFAULT_TEMPLATE):
+    """Text of a tender rendered with a version's template"""
+    return TEXT_TEMPLATES.get(template, TEXT_TEMPLATES[DEFAULT_TEMPLATE])(tender)
+
+
+def _version_info(version):
+    return VersionInfo(version.id, version.model, version.dimensions, version.template)
+
+
+def get_active_version(max_age=ACTIVE_CACHE_SECONDS):
+    """The active version, cached for max_age seconds, or None before versioning is set up"""
+    global _active, _active_loaded_at
+    with _active_lock:
+        if _active_loaded_at is None or time.monotonic() - _active_loaded_at > max_age:
+            version = EmbeddingVersion.query.filter_by(status=VERSION_ACTIVE).first()
+            _active = _version_info(version) if version else None
+            _active_loaded_at = time.monotonic()
+        return _active
+
+
+def active_version_id():
+    """ID of the active version, None while only unversioned rows exist"""
+    version = get_active_version()
+    return version.id if version else None
+
+
+def invalidate_active_version():
+    """Re-read the active version on the next call"""
+    global _active_loaded_at
+    with _active_lock:
+        _active_loaded_at = None
+
+
+def version_filter(version_id):
+    """Filter on TenderEmbedding selecting the rows of one version"""
+    if version_id is None:
+        return TenderEmbedding.version_id.is_(None)
+    return TenderEmbedding.version_id == version_id
+
+
+def active_filter():
+    """Filter on TenderEmbedding selecting the rows of the active version"""
+    return version_filter(active_version_id())
+
+
+def embedding_join(version_id):
+    """Join condition from Tender to its TenderEmbedding in one version"""
+    return (Tender.tender_id == TenderEmbedding.tender_id) & version_filter(version_id)
+
+
+def active_embedding_join():
+    """Join condition from Tender to its TenderEmbedding in the active version"""
+    return embedding_join(active_version_id())
+
+
+def get_or_create_version(model, dimensions, template):
+    """Find or register a version, restarting the build of a retired one
+
+    Raises:
+        ValueError: For unknown templates or dimensions the embedding column cannot hold
+    """
+    if template not in TEXT_TEMPLATES:
+        raise ValueError(f"Unknown text template {template}, expected one of {', '.join(TEXT_TEMPLATES)}")
+    if dimensions != EMBEDDING_DIMENSIONS:
+        raise ValueError(f"The embedding column holds {EMBEDDING_DIMENSIONS} dimensions, got {dimensions}")
+
+    version = EmbeddingVersion.query.filter_by(model=model, dimensions=dimensions, template=template).first()
+    if version is None:
+        version = EmbeddingVersion(model=model, dimensions=dimensions, template=template, status=VERSION_BUILDING)
+        db.session.add(version)
+    elif version.status == VERSION_RETIRED:
+        version.status = VERSION_BUILDING
+        version.retired_at = None
+    db.session.commit()
+    return version
+
+
+def ensure_initial_version(model, dimensions, template=DEFAULT_TEMPLATE):
+    """Make sure a version is active, adopting unversioned rows into it
+
+    Returns:
+        EmbeddingVersion: The active version
+    """
+    version = EmbeddingVersion.query.filter_by(status=VERSION_ACTIVE).first()
+    if version is None:
+        version = get_or_create_version(model, dimensions, template)
+        version.status = VERSION_ACTIVE
+        version.activated_at = get_saudi_now()
+
+    adopted = TenderEmbedding.query.filter(
+        TenderEmbedding.version_id.is_(None)
+    ).update({TenderEmbedding.version_id: version.id}, synchronize_session=False)
+    db.session.commit()
+    invalidate_active_version()
+    bump_data_version()
+
+    if adopted:
+        logger.info(f"Assigned {adopted} unversioned embeddings to version {version.id}")
+    return version
+
+
+def missing_count(version_id):
+    """Number of open tenders that have no embedding in a version
+
+    Tenders that exhausted their embedding attempts are not counted, since
+    no version can serve them.
+    """
+    now = get_saudi_now()
+    return db.session.query(Tender).outerjoin(
+        TenderEmbedding, embedding_join(version_id)
+    ).filter(
+        TenderEmbedding.id.is_(None)
+    ).filter(
+        (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    ).filter(
+        ~embedding_failures.parked_filter(version_id)
+    ).count()
+
+
+def version_stats(version):
+    """Version details with its row count and open-tender coverage"""
+    stats = version.to_dict()
+    stats['embeddings'] = TenderEmbedding.query.filter(version_filter(version.id)).count()
+    stats['missing'] = missing_count(version.id)
+    return stats
+
+
+def activate_version(version_id, subscription_embeddings=None):
+    """Make a version active and retire the previous one in a single statement
+
+    Args:
+        version_id (int): Version to activate
+        subscription_embeddings (dict, optional): Query vector of each saved search by ID,
+            embedded with this version and stored in the same transaction as the switch
+
+    Raises:
+        ValueError: If the version does not exist or does not cover every open tender yet
+    """
+    version = EmbeddingVersion.query.filter_by(id=version_id).first()
+    if version is None:
+        raise ValueError(f"Embedding version {version_id} not found")
+    if version.status == VERSION_ACTIVE:
+        return version
+
+    missing = missing_count(version_id)
+    if missing:
+        raise ValueError(f"Embedding version {version_id} is missing {missing} open tenders")
+
+    now = get_saudi_now()
+    # One UPDATE, so readers see either the old or the new active version
+    EmbeddingVersion.query.filter(
+        (EmbeddingVersion.id == version_id) | (EmbeddingVersion.status == VERSION_ACTIVE)
+    ).update({
+        EmbeddingVersion.status: db.case(
+            (EmbeddingVersion.id == version_id, VERSION_ACTIVE), else_=VERSION_RETIRED
+        ),
+        EmbeddingVersion.activated_at: db.case(
+            (EmbeddingVersion.id == version_id, now), else_=EmbeddingVersion.activated_at
+        ),
+        EmbeddingVersion.retired_at: db.case(
+            (EmbeddingVersion.id == version_id, None), else_=now
+        ),
+    }, synchronize_session=False)
+    if subscription_embeddings:
+        db.session.execute(sa.update(SearchSubscription), [
+            {'id': subscription_id, 'embedding': vector}
+            for subscription_id, vector in subscription_embeddings.items()
+        ])
+    db.session.commit()
+    invalidate_active_version()
+    bump_data_version()
+
+    logger.info(f"Activated embedding version {version_id} ({version.model}, {version.template})")
+    return version
+
+
+def retire_version(version_id):
+    """Abandon a version that is still building so its rows are collected"""
+    version = EmbeddingVersion.query.filter_by(id=version_id).first()
+    if version is None:
+        raise ValueError(f"Embedding version {version_id} not found")
+    if version.status == VERSION_ACTIVE:
+        raise ValueError("The active embedding version cannot be retired")
+    version.status = VERSION_RETIRED
+    version.retired_at = version.retired_at or get_saudi_now()
+    db.session.commit()
+    return version
+
+
+def collect_retired_versions(batch_size=GC_BATCH_SIZE, grace_seconds=RETIRED_GRACE_SECONDS):
+    """Delete the rows of retired versions in batches, then the versions themselves
+
+    Returns:
+        int: Number of embedding rows deleted
+    """
+    cutoff = get_saudi_now() - datetime.timedelta(seconds=grace_seconds)
+    versions = EmbeddingVersion.query.filter(
+        EmbeddingVersion.status == VERSION_RETIRED,
+        EmbeddingVersion.retired_at <= cutoff
+    ).all()
+
+    deleted = 0
+    for version in versions:
+        while True:
+            batch = db.session.query(TenderEmbedding.id).filter(
+                TenderEmbedding.version_id == version.id
+            ).limit(batch_size).subquery()
+            removed = TenderEmbedding.query.filter(
+                TenderEmbedding.id.in_(db.select(batch.c.id))
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += removed
+            if removed < batch_size:
+                break
+
+        EmbeddingFailure.query.filter_by(version_id=version.id).delete(synchronize_session=False)
+        # Archived codes are only comparable with queries embedded by the same version
+        ArchivedEmbedding.query.filter_by(version_id=version.id).delete(synchronize_session=False)
+        db.session.delete(version)
+        db.session.commit()
+        logger.info(f"Removed retired embedding version {version.id}")
+
+    return deleted
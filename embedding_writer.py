@@ -0,0 +1,184 @@
+"""
+Bulk writer for tender embeddings
+Rows are written per chunk inside the caller's transaction instead of one ORM
+object per row. On PostgreSQL with psycopg2 the chunk is streamed into a
+temporary staging table with COPY in binary format (pgvector's binary vector
+encoding, so 1536 floats are not formatted as text) and moved into
+tender_embeddings with one INSERT ... ON CONFLICT DO NOTHING. Other PostgreSQL
+drivers use a multi-row upsert, and SQLite an executemany insert. Tenders
+that are embedded again have their previous row deleted in the same
+transaction, so it keeps serving until a valid replacement is written.
+"""
+import io
+import struct
+import datetime
+import logging
+import numpy as np
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from models import TenderEmbedding, COARSE_EMBEDDING_DIMENSIONS
+from utils import get_saudi_now
+import quantization
+
+logger = logging.getLogger(__name__)
+
+# Columns written by the bulk writer, in COPY order
+COLUMNS = ('tender_id', 'version_id', 'embedding', 'embedding_coarse',
+           'embedding_compact', 'compact_format', 'created_at')
+STAGING_TABLE = 'tender_embeddings_stage'
+
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+_POSTGRES_EPOCH = datetime.datetime(2000, 1, 1)
+
+
+def embedding_row(tender_id, embedding_vector, version_id=None, created_at=None):
+    """Column values of one tender_embeddings row, as new_tender_embedding would build them"""
+    return {
+        'tender_id': tender_id,
+        'version_id': version_id,
+        'embedding': embedding_vector,
+        'embedding_coarse': quantization.truncate_embedding(embedding_vector, COARSE_EMBEDDING_DIMENSIONS),
+        'embedding_compact': quantization.encode_compact(embedding_vector),
+        'compact_format': quantization.COMPACT_FORMAT,
+        'created_at': created_at or get_saudi_now(),
+    }
+
+
+def _encode_vector(vector):
+    """pgvector binary format: dimensions, an unused word and big-endian float32 values"""
+    values = np.asarray(vector, dtype='>f4')
+    return struct.pack('>HH', len(values), 0) + values.tobytes()
+
+
+def _encode_timestamp(value):
+    """Binary timestamp: microseconds since 2000-01-01, stored as wall-clock time like psycopg2 does"""
+    delta = value.replace(tzinfo=None) - _POSTGRES_EPOCH
+    return struct.pack('>q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def _encode_field(column, value):
+    if value is None:
+        return struct.pack('>i', -1)
+    if column in ('embedding', 'embedding_coarse'):
+        data = _encode_vector(value)
+    elif column == 'version_id':
+        data = struct.pack('>i', value)
+    elif column == 'created_at':
+        data = _encode_timestamp(value)
+    elif column == 'embedding_compact':
+        data = bytes(value)
+    else:
+        data = str(value).encode('utf-8')
+    return struct.pack('>i', len(data)) + data
+
+
+def encode_copy_binary(rows):
+    """Serialize rows into a PostgreSQL binary COPY stream"""
+    buffer = io.BytesIO()
+    buffer.write(_COPY_HEADER)
+    field_count = struct.pack('>h', len(COLUMNS))
+    for row in rows:
+        buffer.write(field_count)
+        for column in COLUMNS:
+            buffer.write(_encode_field(column, row[column]))
+    buffer.write(_COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+def _copy_rows(connection, rows):
+    """Stream rows through COPY into the staging table and move them into tender_embeddings"""
+    cursor = connection.connection.cursor()
+    try:
+        # Temporary tables are per connection, so every pooled connection creates its own
+        cursor.execute(
+            f"CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} ("
+            f"tender_id varchar(255), version_id integer, embedding vector, "
+            f"embedding_coarse vector, embedding_compact bytea, "
+            f"compact_format varchar(16), created_at timestamp"
+            f") ON COMMIT DELETE ROWS"
+        )
+        columns = ', '.join(COLUMNS)
+        cursor.copy_expert(
+            f"COPY {STAGING_TABLE} ({columns}) FROM STDIN WITH (FORMAT binary)",
+            encode_copy_binary(rows)
+        )
+        cursor.execute(
+            f"INSERT INTO {TenderEmbedding.__tablename__} ({columns}) "
+            f"SELECT {columns} FROM {STAGING_TABLE} ON CONFLICT DO NOTHING"
+        )
+        written = cursor.rowcount
+        cursor.execute(f"TRUNCATE {STAGING_TABLE}")
+        return written
+    finally:
+        cursor.close()
+
+
+def _upsert_rows(connection, rows, dialect):
+    """Multi-row INSERT ... ON CONFLICT DO NOTHING, sent as a single statement on PostgreSQL"""
+    table = TenderEmbedding.__table__
+    if dialect == 'postgresql':
+        statement = postgresql.insert(table).values(rows).on_conflict_do_nothing()
+        return connection.execute(statement).rowcount
+    if dialect == 'sqlite':
+        statement = sqlite.insert(table).on_conflict_do_nothing()
+    else:
+        statement = table.insert()
+    # A list of parameter sets runs as executemany
+    return connection.execute(statement, rows).rowcount
+
+
+def delete_replaced(rows):
+    """Delete the existing rows of the tenders and versions of rows within the current session transaction
+
+    Called right before write_embeddings, once the new vectors were found valid.
+
+    Args:
+        rows (list): Dicts built by embedding_row
+
+    Returns:
+        int: Number of rows deleted
+    """
+    table = TenderEmbedding.__table__
+    tender_ids = {}
+    for row in rows:
+        tender_ids.setdefault(row['version_id'], []).append(row['tender_id'])
+
+    deleted = 0
+    for version_id, ids in tender_ids.items():
+        version_match = table.c.version_id.is_(None) if version_id is None else table.c.version_id == version_id
+        deleted += db.session.execute(
+            table.delete().where(table.c.tender_id.in_(ids)).where(version_match)
+        ).rowcount
+    return deleted
+
+
+def write_embeddings(rows):
+    """Insert embedding rows in bulk within the current session transaction
+
+    Rows that already exist for the same tender and version are skipped. The
+    caller commits, so each chunk is written in one transaction.
+
+    Args:
+        rows (list): Dicts built by embedding_row
+
+    Returns:
+        int: Number of rows inserted
+    """
+    if not rows:
+        return 0
+
+    connection = db.session.connection()
+    dialect = connection.dialect.name
+
+    # COPY FROM STDIN goes through psycopg2's copy_expert; other drivers take the upsert path
+    if dialect == 'postgresql' and connection.dialect.driver == 'psycopg2':
+        try:
+            # Savepoint so a failed COPY leaves the transaction usable for the fallback
+            with db.session.begin_nested():
+                return _copy_rows(connection, rows)
+        except Exception as e:
+            logger.error(f"Binary COPY of embeddings failed, using multi-row insert: {str(e)}")
+
+    return _upsert_rows(connection, rows, dialect)
@@ -3,18 +3,41 @@ Utility for creating and managing vector embeddings with OpenAI
 """
 
 import os
+import json
 import datetime
 import logging
 import numpy as np
+import sqlalchemy as sa
 from openai import OpenAI
 from app import db
-from models import Tender, TenderEmbedding
+from models import Tender, TenderEmbedding, EMBEDDING_DIMENSIONS, COARSE_EMBEDDING_DIMENSIONS
 from utils import get_saudi_now, get_saudi_time_hours_ago
+from vector_index import vector_index
+from pgvector_indexes import apply_search_params, apply_filtered_scan
+import quantization
+import subscriptions
+import duplicates
+import embedding_versions
+import embedding_writer
+import embedding_priority
+import embedding_failures
+import search_filters
+import lexical_search
+import archive
+import topics
+from response_cache import bump_data_version
+from single_flight import single_flight
+import request_timing
 
 # The newest OpenAI model is "gpt-4o" which was released May 13, 2024.
 # Do not change this unless explicitly requested by the user
 EMBEDDING_MODEL = "text-embedding-3-small"  # 1536 dimensions
 MAX_BATCH_SIZE = 50  # Process embeddings in batches
+MAX_BATCH_QUERIES = 100  # Queries accepted by one batch search request
+MAX_BATCH_LIMIT = 100  # Results per query of a batch search request
+CLEANUP_BATCH_SIZE = 500  # Tenders whose expired embeddings are deleted per transaction
+# Vector search backend: "pgvector", "memory", or "auto" (memory unless the database is PostgreSQL)
+VECTOR_SEARCH_BACKEND = os.environ.get("VECTOR_SEARCH_BACKEND", "auto")
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,48 +46,108 @@ logger = logging.getLogger(__name__)
 # Initialize OpenAI client
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
-def create_embedding(text):
-    """Create an OpenAI embedding for the given text"""
+def active_version():
+    """Model, dimensions and text template that search and new embeddings use"""
+    version = embedding_versions.get_active_version()
+    if version is None:
+        # Unversioned deployments keep using the built-in settings
+        return embedding_versions.VersionInfo(
+            None, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, embedding_versions.DEFAULT_TEMPLATE
+        )
+    return version
+
+def create_embedding(text, version=None, timeout=None):
+    """Create an OpenAI embedding for the given text
+    
+    Args:
+        text (str): Text to embed
+        version (VersionInfo, optional): Embedding version to embed with. Defaults to the active one.
+        timeout (float, optional): Seconds to wait for the provider, without retries.
+            Defaults to None (the client's timeout and retries).
+    """
+    version = version or active_version()
     if not text or len(text.strip()) == 0:
         logger.warning(f"Empty text provided for embedding")
         # Return a zero vector if text is empty
-        return np.zeros(1536).tolist()
+        return np.zeros(version.dimensions).tolist()
     
     try:
-        response = client.embeddings.create(
-            model=EMBEDDING_MODEL,
+        api = client.with_options(timeout=timeout, max_retries=0) if timeout is not None else client
+        response = api.embeddings.create(
+            model=version.model,
             input=text,
-            dimensions=1536
+            dimensions=version.dimensions
         )
         return response.data[0].embedding
     except Exception as e:
         logger.error(f"Error creating embedding: {str(e)}")
         # Return a zero vector in case of error
-        return np.zeros(1536).tolist()
+        return np.zeros(version.dimensions).tolist()
+
+def create_embeddings(texts, version=None):
+    """Create OpenAI embeddings for several texts with a single API request
+    
+    Args:
+        texts (list): Texts to embed
+        version (VersionInfo, optional): Embedding version to embed with. Defaults to the active one.
+    
+    Returns:
+        list: One embedding per text, zero vectors for empty texts or on error
+    """
+    version = version or active_version()
+    embeddings_out = [np.zeros(version.dimensions).tolist() for _ in texts]
+    positions = [i for i, text in enumerate(texts) if text and text.strip()]
+    if not positions:
+        return embeddings_out
+    
+    try:
+        response = client.embeddings.create(
+            model=version.model,
+            input=[texts[i] for i in positions],
+            dimensions=version.dimensions
+        )
+        for position, item in zip(positions, response.data):
+            embeddings_out[position] = item.embedding
+    except Exception as e:
+        logger.error(f"Error creating batch embeddings: {str(e)}")
+    
+    return embeddings_out
+
+def new_tender_embedding(tender_id, embedding_vector, version_id=None):
+    """Build a TenderEmbedding row with its coarse prefix and, when enabled, compact copy"""
+    return TenderEmbedding(**embedding_writer.embedding_row(tender_id, embedding_vector, version_id))
 
 def embed_tender(tender):
     """Create and store embedding for a single tender"""
-    text = tender.get_text_for_embedding()
+    version = active_version()
+    text = embedding_versions.tender_text(tender, version.template)
     
     try:
         # Check if embedding already exists
-        existing_embedding = TenderEmbedding.query.filter_by(tender_id=tender.tender_id).first()
+        existing_embedding = TenderEmbedding.query.filter_by(tender_id=tender.tender_id).filter(
+            embedding_versions.version_filter(version.id)
+        ).first()
         
         if existing_embedding:
             logger.info(f"Embedding already exists for tender {tender.tender_id}")
             return False
         
         # Create embedding
-        embedding_vector = create_embedding(text)
+        embedding_vector = create_embedding(text, version)
+        
+        # Zero vectors stand for empty text or a provider error and are never stored
+        if not embedding_failures.is_valid_vector(embedding_vector, version.dimensions):
+            embedding_failures.record_failures([tender.tender_id], version.id, "No usable embedding for tender text")
+            db.session.commit()
+            return False
         
         # Store embedding
-        new_embedding = TenderEmbedding(
-            tender_id=tender.tender_id,
-            embedding=embedding_vector
-        )
+        new_embedding = new_tender_embedding(tender.tender_id, embedding_vector, version.id)
         
         db.session.add(new_embedding)
+        embedding_failures.clear_failures([tender.tender_id], version.id)
         db.session.commit()
+        bump_data_version()
         
         logger.info(f"Created embedding for tender {tender.tender_id}")
         return True
@@ -74,126 +157,293 @@ def embed_tender(tender):
         db.session.rollback()
         return False
 
-def batch_embed_tenders(limit=None):
+def batch_embed_tenders(limit=None, version=None, tender_ids=None, changed_ids=None):
     """Create embeddings for all tenders that don't have them yet
     
+    Tenders whose text changed, and tenders whose new text failed to embed
+    before, are embedded again. Their previous embedding is only replaced by a
+    valid new vector, so it keeps serving search when the provider fails.
+    
     Args:
         limit (int, optional): Maximum number of tenders to process. Defaults to None (all).
+        version (VersionInfo, optional): Embedding version to fill. Defaults to the active one;
+            versions that are still being built skip the search-side updates.
+        tender_ids (list, optional): Only consider these tenders. Defaults to None (all).
+        changed_ids (list, optional): Tenders whose text changed since they were embedded.
     
     Returns:
         int: Number of tenders successfully embedded
     """
     now = get_saudi_now()
+    active = active_version()
+    version = version or active
+    serving = version.id == active.id
+    
+    needs_embedding = TenderEmbedding.id.is_(None) | embedding_failures.failed_filter(version.id)
+    if changed_ids:
+        # New text, so earlier failures no longer apply
+        embedding_failures.clear_failures(changed_ids, all_versions=True)
+        db.session.commit()
+        needs_embedding = needs_embedding | Tender.tender_id.in_(changed_ids)
     
     # Find all tenders that:
-    # 1. Don't have an embedding yet
+    # 1. Don't have an embedding in this version yet, or have a stale one
     # 2. Have a submission deadline in the future or null
+    # 3. Are not waiting for a retry after a failed attempt
     query = db.session.query(Tender).outerjoin(
         TenderEmbedding, 
-        Tender.tender_id == TenderEmbedding.tender_id
+        embedding_versions.embedding_join(version.id)
     ).filter(
-        TenderEmbedding.id.is_(None)
+        needs_embedding
     ).filter(
         (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    ).filter(
+        embedding_failures.backoff_filter(version.id, now)
     )
+    if tender_ids is not None:
+        query = query.filter(Tender.tender_id.in_(tender_ids))
     
-    if limit:
-        tenders = query.limit(limit).all()
-    else:
-        tenders = query.all()
+    # Spend a limited run on the tenders users are most likely to search for
+    tenders = embedding_priority.select_backlog(query, limit)
     
     logger.info(f"Found {len(tenders)} tenders without embeddings")
     
     count = 0
+    embedded_ids = []
+    replaced = 0
+    # Loaded on the first batch, so runs with nothing to embed never touch subscriptions
+    percolator = None
     
     # Process tenders in batches
     for i in range(0, len(tenders), MAX_BATCH_SIZE):
         batch = tenders[i:i+MAX_BATCH_SIZE]
-        batch_texts = [t.get_text_for_embedding() for t in batch]
+        batch_texts = [embedding_versions.tender_text(t, version.template) for t in batch]
+        
+        # Empty texts would only come back as unusable vectors
+        empty = [t.tender_id for t, text in zip(batch, batch_texts) if not text or not text.strip()]
+        batch = [t for t, text in zip(batch, batch_texts) if text and text.strip()]
+        batch_texts = [text for text in batch_texts if text and text.strip()]
+        if empty:
+            embedding_failures.record_failures(empty, version.id, "Empty embedding text")
+            db.session.commit()
+        if not batch:
+            continue
         
         try:
             # Create embeddings for the batch
             response = client.embeddings.create(
-                model=EMBEDDING_MODEL,
+                model=version.model,
                 input=batch_texts,
-                dimensions=1536
+                dimensions=version.dimensions
             )
             
-            # Store embeddings
+            # Store the batch with one bulk insert instead of an ORM object per row
+            stored_tenders = []
+            stored_vectors = []
+            rows = []
+            invalid = []
             for j, tender in enumerate(batch):
                 try:
                     embedding_vector = response.data[j].embedding
-                    new_embedding = TenderEmbedding(
-                        tender_id=tender.tender_id,
-                        embedding=embedding_vector
-                    )
-                    
-                    db.session.add(new_embedding)
-                    count += 1
+                    if not embedding_failures.is_valid_vector(embedding_vector, version.dimensions):
+                        invalid.append(tender.tender_id)
+                        continue
+                    rows.append(embedding_writer.embedding_row(tender.tender_id, embedding_vector, version.id))
+                    stored_tenders.append(tender)
+                    stored_vectors.append(embedding_vector)
                 except Exception as e:
                     logger.error(f"Error storing embedding for tender {tender.tender_id}: {str(e)}")
+                    invalid.append(tender.tender_id)
+            
+            replaced += embedding_writer.delete_replaced(rows)
+            embedding_writer.write_embeddings(rows)
+            embedding_failures.clear_failures([t.tender_id for t in stored_tenders], version.id)
+            embedding_failures.record_failures(invalid, version.id, "Unusable embedding in provider response")
             
             # Commit the batch
             db.session.commit()
+            count += len(stored_tenders)
+            embedded_ids.extend(t.tender_id for t in stored_tenders)
             logger.info(f"Processed batch of {len(batch)} tenders")
             
         except Exception as e:
             logger.error(f"Error creating batch embeddings: {str(e)}")
             db.session.rollback()
+            # Retried by a later batch once the backoff expires
+            try:
+                embedding_failures.record_failures([t.tender_id for t in batch], version.id, e)
+                db.session.commit()
+            except Exception as record_error:
+                logger.error(f"Error recording embedding failures: {str(record_error)}")
+                db.session.rollback()
+            continue
+        
+        # Versions that are still being built are not searched yet
+        if not serving:
+            continue
+        
+        # Group re-posted copies of the same tender through the LSH buckets
+        try:
+            duplicates.assign_clusters(stored_tenders, stored_vectors)
+        except Exception as e:
+            logger.error(f"Error clustering duplicate tenders: {str(e)}")
+            db.session.rollback()
+        
+        # Place the new tenders in their nearest topic until the next clustering run
+        try:
+            topics.assign_topics(stored_tenders, stored_vectors)
+        except Exception as e:
+            logger.error(f"Error assigning topics: {str(e)}")
+            db.session.rollback()
+        
+        # Match the new tenders against all saved searches in one matrix product
+        try:
+            if percolator is None:
+                percolator = subscriptions.Percolator.load()
+            percolator.percolate(stored_tenders, stored_vectors)
+        except Exception as e:
+            logger.error(f"Error matching saved searches: {str(e)}")
+            db.session.rollback()
     
     logger.info(f"Created embeddings for {count} tenders")
+    
+    # Make new embeddings searchable in this process without waiting for the refresh interval
+    if count and serving:
+        if replaced:
+            vector_index.remove(embedded_ids)
+        vector_index.refresh_if_loaded()
+        bump_data_version()
+    
+    if embedded_ids and serving:
+        # Imported here because neighbors builds on this module
+        import neighbors
+        if neighbors.PRECOMPUTE_NEIGHBORS:
+            try:
+                neighbors.update_neighbors(embedded_ids)
+            except Exception as e:
+                logger.error(f"Error updating neighbour lists: {str(e)}")
+                db.session.rollback()
+    
     return count
 
-def cleanup_expired_embeddings():
-    """Remove embeddings for tenders with passed submission deadlines"""
-    now = get_saudi_now()
+def cleanup_expired_embeddings(batch_size=CLEANUP_BATCH_SIZE):
+    """Remove embeddings for tenders with passed submission deadlines
     
-    # Find embeddings for tenders with passed deadlines
-    expired_embeddings = db.session.query(TenderEmbedding).join(
-        Tender, 
-        TenderEmbedding.tender_id == Tender.tender_id
-    ).filter(
+    Rows are deleted server-side in chunks of batch_size tenders, one
+    transaction per chunk together with their duplicate signatures, and
+    evicted from the in-process vector index.
+    
+    Args:
+        batch_size (int, optional): Tenders whose embeddings are deleted per transaction
+    
+    Returns:
+        int: Number of embeddings removed
+    """
+    now = get_saudi_now()
+    expired_tender_ids = db.session.query(Tender.tender_id).filter(
         Tender.submission_deadline < now
-    ).all()
+    )
     
-    logger.info(f"Found {len(expired_embeddings)} expired embeddings to remove")
+    total = db.session.query(sa.func.count(TenderEmbedding.id)).filter(
+        TenderEmbedding.tender_id.in_(expired_tender_ids)
+    ).scalar()
+    logger.info(f"Found {total} expired embeddings to remove")
+    if not total:
+        return 0
     
     count = 0
-    for embedding in expired_embeddings:
+    while True:
+        # Deleted rows drop out of the join, so each pass picks up the next chunk
+        chunk = [row[0] for row in db.session.query(TenderEmbedding.tender_id).filter(
+            TenderEmbedding.tender_id.in_(expired_tender_ids)
+        ).distinct().limit(batch_size).all()]
+        if not chunk:
+            break
+        
         try:
-            db.session.delete(embedding)
-            count += 1
+            # Archived in the same transaction, so no vector is lost if the delete fails
+            archive.archive_embeddings(chunk)
+            removed = TenderEmbedding.query.filter(
+                TenderEmbedding.tender_id.in_(chunk)
+            ).delete(synchronize_session=False)
+            # Expired tenders are no duplicate candidates any more
+            duplicates.remove_tenders(chunk)
+            db.session.commit()
         except Exception as e:
-            logger.error(f"Error removing embedding {embedding.id}: {str(e)}")
+            logger.error(f"Error removing expired embeddings: {str(e)}")
+            db.session.rollback()
+            break
+        
+        count += removed
+        vector_index.remove(chunk)
+        logger.info(f"Removed {count}/{total} expired embeddings")
     
-    db.session.commit()
+    if count:
+        bump_data_version()
     logger.info(f"Removed {count} expired embeddings")
     return count
 
-def search_similar_tenders(query_text, limit=10, today_only=False):
-    """Search for tenders similar to the query text
+def memory_backend():
+    """Whether the in-process index is the configured vector search backend"""
+    if VECTOR_SEARCH_BACKEND == "memory":
+        return True
+    if VECTOR_SEARCH_BACKEND == "pgvector":
+        return False
+    return db.engine.dialect.name != "postgresql"
+
+def use_memory_index():
+    """Whether vector search should use the in-process index instead of pgvector"""
+    if not memory_backend():
+        return False
+    # Until the scheduler job publishes the first shared generation, PostgreSQL ranks with pgvector
+    if vector_index.shared_dir is not None and not vector_index.in_use and db.engine.dialect.name == "postgresql":
+        return False
+    return True
+
+def load_ranked_tenders(ranked):
+    """Load tenders for (tender_id, similarity) pairs, keeping the ranking order"""
+    tender_ids = [tender_id for tender_id, _ in ranked]
+    if not tender_ids:
+        return []
     
-    Args:
-        query_text (str): Text to search for
-        limit (int, optional): Maximum number of results. Defaults to 10.
-        today_only (bool, optional): If True, only search in tenders published in the last 24 hours. Defaults to False.
+    with request_timing.timed('load'):
+        tenders_by_id = {
+            t.tender_id: t for t in Tender.query.filter(Tender.tender_id.in_(tender_ids)).all()
+        }
+    request_timing.count('tenders_loaded', len(tenders_by_id))
     
-    Returns:
-        list: List of tenders sorted by similarity
-    """
-    # Create embedding for the query
-    query_embedding = create_embedding(query_text)
+    with request_timing.timed('serialize'):
+        return [
+            {"tender": tenders_by_id[tender_id].to_dict(), "similarity": similarity}
+            for tender_id, similarity in ranked
+            if tender_id in tenders_by_id
+        ]
+
+def pg_first_stage_distance(query_embedding):
+    """Distance expression for the approximate first search stage on pgvector, or None
     
+    The truncated coarse prefix takes precedence over the compact formats.
+    """
+    if quantization.COARSE_SEARCH:
+        coarse_query = quantization.truncate_embedding(query_embedding, COARSE_EMBEDDING_DIMENSIONS)
+        if coarse_query is not None:
+            return TenderEmbedding.embedding_coarse.cosine_distance(coarse_query)
+    return quantization.pg_compact_distance(
+        quantization.COMPACT_FORMAT, TenderEmbedding.embedding, query_embedding
+    )
+
+def pg_similarity_query(query_embedding, limit=10, today_only=False, rerank_candidates=None, filters=None):
+    """Build the pgvector query returning (tender_id, distance) for the nearest active tenders"""
     # Get current date for filtering
     now = get_saudi_now()
     
     # Base query
     query = db.session.query(
-        Tender, 
+        Tender.tender_id, 
         TenderEmbedding.embedding.cosine_distance(query_embedding).label('distance')
     ).join(
         TenderEmbedding,
-        Tender.tender_id == TenderEmbedding.tender_id
+        embedding_versions.active_embedding_join()
     )
     
     # Filter out tenders with passed submission dates
@@ -207,10 +457,266 @@ def search_similar_tenders(query_text, limit=10, today_only=False):
         last_24_hours = get_saudi_time_hours_ago(24)
         query = query.filter(Tender.publication_date >= last_24_hours)
     
+    # Structured filters restrict the rows before ranking, using the tender column indexes
+    query = search_filters.apply_filters(query, filters)
+    
+    # Pick candidates on the coarse prefix or the halfvec / bit index first
+    # and only compute full-precision distances for those
+    first_stage_distance = pg_first_stage_distance(query_embedding)
+    if first_stage_distance is not None:
+        candidate_count = max(rerank_candidates or quantization.RERANK_CANDIDATES, limit)
+        candidates = query.with_entities(TenderEmbedding.id).order_by(first_stage_distance).limit(candidate_count)
+        query = query.filter(TenderEmbedding.id.in_(candidates.subquery().select()))
+    
     # Order by similarity and limit results
-    results = query.order_by('distance').limit(limit).all()
+    return query.order_by('distance').limit(limit)
+
+def rank_similar_tenders(query_embedding, limit=10, today_only=False, ef_search=None, probes=None,
+                         rerank_candidates=None, filters=None):
+    """Rank active tenders by similarity to a query embedding
+    
+    Args:
+        query_embedding (list): Query vector
+        limit (int, optional): Maximum number of results. Defaults to 10.
+        today_only (bool, optional): If True, only rank tenders published in the last 24 hours. Defaults to False.
+        ef_search (int, optional): HNSW candidate list size for this query (pgvector backend only).
+        probes (int, optional): IVFFlat lists to probe for this query (pgvector backend only).
+        rerank_candidates (int, optional): Candidates from the compact first stage to re-rank
+            with full vectors. Defaults to RERANK_CANDIDATES.
+        filters (SearchFilters, optional): Structured filters applied before ranking.
+    
+    Returns:
+        list: (tender_id, similarity) tuples sorted by similarity
+    """
+    if use_memory_index():
+        with request_timing.timed('rank', 'memory'):
+            ranked = vector_index.search(
+                query_embedding, limit, today_only=today_only, rerank_candidates=rerank_candidates,
+                filters=filters
+            )
+        request_timing.count('ranked', len(ranked))
+        return ranked
+    
+    # Trade recall for latency on the ANN index, if requested
+    apply_search_params(ef_search=ef_search, probes=probes)
+    if not search_filters.is_empty(filters):
+        apply_filtered_scan()
+    
+    with request_timing.timed('rank', 'pgvector'):
+        results = pg_similarity_query(
+            query_embedding, limit, today_only=today_only, rerank_candidates=rerank_candidates,
+            filters=filters
+        ).all()
+    request_timing.count('ranked', len(results))
+    
+    ranked = [(tender_id, 1 - distance) for tender_id, distance in results]
+    # Relaxed iterative index scans may return rows slightly out of order
+    ranked.sort(key=lambda item: item[1], reverse=True)
+    return ranked
+
+def rank_similar_tenders_batch(query_embeddings, limits, today_only=None, ef_search=None, probes=None,
+                               rerank_candidates=None, filters=None):
+    """Rank active tenders for several query embeddings at once
+    
+    The in-memory index scores all queries with one matrix product; on
+    pgvector the per-query searches are sent as a single UNION ALL statement.
+    
+    Args:
+        query_embeddings (list): Query vectors
+        limits (list): Maximum number of results per query
+        today_only (list, optional): Per-query last-24-hours flags. Defaults to False for all.
+        ef_search (int, optional): HNSW candidate list size (pgvector backend only).
+        probes (int, optional): IVFFlat lists to probe (pgvector backend only).
+        rerank_candidates (int, optional): Candidates from the first stage to re-rank.
+        filters (list, optional): Per-query SearchFilters. Defaults to no filters.
+    
+    Returns:
+        list: One list of (tender_id, similarity) tuples per query
+    """
+    if today_only is None:
+        today_only = [False] * len(query_embeddings)
+    if filters is None:
+        filters = [None] * len(query_embeddings)
+    
+    if use_memory_index():
+        with request_timing.timed('rank', 'memory'):
+            return vector_index.search_batch(
+                query_embeddings, limits, today_only, rerank_candidates=rerank_candidates, filters=filters
+            )
+    
+    ranked = [[] for _ in query_embeddings]
+    if not query_embeddings:
+        return ranked
+    
+    apply_search_params(ef_search=ef_search, probes=probes)
+    if not all(search_filters.is_empty(f) for f in filters):
+        apply_filtered_scan()
+    
+    selects = []
+    for position, query_embedding in enumerate(query_embeddings):
+        per_query = pg_similarity_query(
+            query_embedding, limits[position], today_only=today_only[position],
+            rerank_candidates=rerank_candidates, filters=filters[position]
+        ).subquery()
+        selects.append(sa.select(
+            sa.literal(position).label('position'), per_query.c.tender_id, per_query.c.distance
+        ))
+    
+    with request_timing.timed('rank', 'pgvector'):
+        rows = db.session.execute(sa.union_all(*selects)).all()
+    for position, tender_id, distance in rows:
+        ranked[position].append((tender_id, 1 - distance))
+    
+    for results in ranked:
+        results.sort(key=lambda item: item[1], reverse=True)
+    
+    return ranked
+
+def search_similar_tenders(query_text, limit=10, today_only=False, ef_search=None, probes=None,
+                           rerank_candidates=None, collapse_duplicates=False, filters=None,
+                           include_archive=False):
+    """Search for tenders similar to the query text
+    
+    Args:
+        query_text (str): Text to search for
+        limit (int, optional): Maximum number of results. Defaults to 10.
+        today_only (bool, optional): If True, only search in tenders published in the last 24 hours. Defaults to False.
+        ef_search (int, optional): HNSW candidate list size for this query (pgvector backend only).
+        probes (int, optional): IVFFlat lists to probe for this query (pgvector backend only).
+        rerank_candidates (int, optional): Candidates from the compact first stage to re-rank
+            with full vectors. Defaults to RERANK_CANDIDATES.
+        collapse_duplicates (bool, optional): Return only the best match of each near-duplicate cluster.
+        filters (SearchFilters, optional): Organization, type, city, price and deadline filters
+            applied before ranking.
+        include_archive (bool, optional): Also rank the archived embeddings of expired
+            tenders. Archived results are marked "archived" and scored from int8 codes.
+            Ignored with today_only and by the lexical fallback.
+    
+    Returns:
+        tuple: (results, served_by) - tenders sorted by similarity, and the path that
+            embedded the query (see query_embedding). When no embedding arrived within
+            the deadline the tenders are ranked lexically and carry a lexical_score
+            instead of a similarity. Identical concurrent searches share one result.
+    """
+    # Imported here because query_embedding builds on this module
+    import query_embedding
+    
+    def search():
+        # Create embedding for the query within its latency budget
+        with request_timing.timed('embed') as metric:
+            embedded = query_embedding.embed_query(query_text)
+            metric.description = embedded.path
+        
+        # Rank extra results so the limit can still be filled after collapsing
+        rank_limit = limit * duplicates.COLLAPSE_OVERFETCH if collapse_duplicates else limit
+        if embedded.vector is None:
+            with request_timing.timed('lexical'):
+                ranked = lexical_search.rank_lexical(query_text, rank_limit, today_only=today_only, filters=filters)
+        else:
+            ranked = rank_similar_tenders(
+                embedded.vector, rank_limit, today_only=today_only, ef_search=ef_search, probes=probes,
+                rerank_candidates=rerank_candidates, filters=filters
+            )
+        
+        archived_ids = None
+        if include_archive and not today_only and embedded.vector is not None:
+            hot_ids = {tender_id for tender_id, _ in ranked}
+            with request_timing.timed('archive'):
+                archived = archive.archive_index.search(embedded.vector, rank_limit, filters=filters)
+            archived_ids = {tender_id for tender_id, _ in archived} - hot_ids
+            ranked = archive.merge_ranked(ranked, archived, rank_limit)
+        
+        if collapse_duplicates:
+            with request_timing.timed('collapse'):
+                ranked = duplicates.collapse_ranked(ranked, limit)
+        
+        results = load_ranked_tenders(ranked)
+        if archived_ids is not None:
+            for result in results:
+                result['archived'] = result['tender']['tender_id'] in archived_ids
+        if embedded.vector is None:
+            # Lexical scores are not cosine similarities
+            for result in results:
+                result['lexical_score'] = result['similarity']
+                result['similarity'] = None
+        return results, embedded.path
+    
+    key = json.dumps([
+        'search_similar_tenders', query_text, limit, today_only, ef_search, probes,
+        rerank_candidates, collapse_duplicates, search_filters.to_dict(filters), include_archive
+    ], ensure_ascii=False)
+    return single_flight.do(key, search)
+
+def search_similar_tenders_batch(queries, ef_search=None, probes=None):
+    """Search for tenders similar to several queries in one pass
+    
+    All query texts are embedded with one provider request and scored together;
+    each matching tender is loaded and serialized once even if several queries return it.
+    Queries the provider returned no usable vector for are ranked lexically, as
+    single searches are when their embedding fails.
+    
+    Args:
+        queries (list): Dicts with "query", "limit", "today_only" and optional "filters" keys
+        ef_search (int, optional): HNSW candidate list size (pgvector backend only).
+        probes (int, optional): IVFFlat lists to probe (pgvector backend only).
+    
+    Returns:
+        tuple: (results, served_by) - one list of {"tender", "similarity"} results per
+            query, and per query "primary" or "lexical" (see query_embedding). Lexical
+            results carry a lexical_score instead of a similarity.
+    """
+    # Imported here because query_embedding builds on this module
+    import query_embedding
+    
+    with request_timing.timed('embed', f"{len(queries)} queries"):
+        query_embeddings = create_embeddings([q['query'] for q in queries])
+    
+    # create_embeddings returns zero vectors when the provider fails
+    dimensions = active_version().dimensions
+    vector_positions = [
+        i for i, vector in enumerate(query_embeddings) if embedding_failures.is_valid_vector(vector, dimensions)
+    ]
+    lexical_positions = sorted(set(range(len(queries))) - set(vector_positions))
+    
+    ranked = [[] for _ in queries]
+    if vector_positions:
+        vector_ranked = rank_similar_tenders_batch(
+            [query_embeddings[i] for i in vector_positions],
+            [queries[i].get('limit', 10) for i in vector_positions],
+            [queries[i].get('today_only', False) for i in vector_positions],
+            ef_search=ef_search,
+            probes=probes,
+            filters=[queries[i].get('filters') for i in vector_positions]
+        )
+        for position, results in zip(vector_positions, vector_ranked):
+            ranked[position] = results
+    
+    if lexical_positions:
+        logger.warning(f"No query embedding for {len(lexical_positions)} of {len(queries)} batch queries, ranking them lexically")
+        with request_timing.timed('lexical', f"{len(lexical_positions)} queries"):
+            for position in lexical_positions:
+                q = queries[position]
+                ranked[position] = lexical_search.rank_lexical(
+                    q['query'], q.get('limit', 10), today_only=q.get('today_only', False), filters=q.get('filters')
+                )
     
-    # Extract tenders from results
-    tenders = [{"tender": r[0].to_dict(), "similarity": 1 - r[1]} for r in results]
+    tender_ids = {tender_id for results in ranked for tender_id, _ in results}
+    with request_timing.timed('load'):
+        tenders = Tender.query.filter(Tender.tender_id.in_(tender_ids)).all() if tender_ids else []
+    request_timing.count('tenders_loaded', len(tenders))
+    with request_timing.timed('serialize'):
+        serialized = {t.tender_id: t.to_dict() for t in tenders}
     
-    return tenders
\ No newline at end of file
+    grouped = []
+    served_by = []
+    for position, results in enumerate(ranked):
+        lexical = position in lexical_positions
+        grouped.append([
+            # Lexical scores are not cosine similarities
+            {"tender": serialized[tender_id], "similarity": None, "lexical_score": score} if lexical
+            else {"tender": serialized[tender_id], "similarity": score}
+            for tender_id, score in results
+            if tender_id in serialized
+        ])
+        served_by.append(query_embedding.PATH_LEXICAL if lexical else query_embedding.PATH_PRIMARY)
+    return grouped, served_by
@@ -7,6 +7,8 @@ import time
 import argparse
 from app import app, db
 import embeddings
+import embedding_versions
+import embedding_failures
 from models import Tender, TenderEmbedding
 
 # Configure logging
@@ -71,13 +73,16 @@ def get_unprocessed_count():
     # Count tenders that:
     # 1. Don't have an embedding yet
     # 2. Have a submission deadline in the future or null
+    # 3. Are not waiting for a retry after a failed attempt
     count = db.session.query(Tender).outerjoin(
         TenderEmbedding, 
-        Tender.tender_id == TenderEmbedding.tender_id
+        embedding_versions.active_embedding_join()
     ).filter(
         TenderEmbedding.id.is_(None)
     ).filter(
         (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    ).filter(
+        embedding_failures.backoff_filter(embedding_versions.active_version_id(), now)
     ).count()
     
     return count
@@ -0,0 +1,135 @@
+"""
+Hybrid search combining full-text and vector rankings with reciprocal rank fusion
+Both rankings run in parallel so the slower source bounds the latency, not their sum
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from models import Tender
+import embeddings
+import query_embedding
+import lexical_search
+import duplicates
+import request_timing
+
+logger = logging.getLogger(__name__)
+
+# Constant from the original RRF paper; dampens the weight of the very top ranks
+RRF_K = 60
+# Candidates fetched from each source before fusion
+DEFAULT_CANDIDATES = 50
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hybrid-search')
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked lists of (tender_id, score) into one list of (tender_id, fused_score)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, (tender_id, _) in enumerate(ranking, start=1):
+            fused[tender_id] = fused.get(tender_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+def _run_timed(app, timings, func, *args):
+    """Run func in its own app context, returning (result, elapsed_ms, error)"""
+    # Timers and SQL of the source count towards the request that started it
+    with app.app_context(), request_timing.activate(timings):
+        start = time.perf_counter()
+        try:
+            result, error = func(*args), None
+        except Exception as e:
+            logger.error(f"Error in hybrid search source {func.__name__}: {str(e)}")
+            result, error = [], str(e)
+        return result, (time.perf_counter() - start) * 1000, error
+
+
+def _rank_vector(query_text, limit, today_only):
+    with request_timing.timed('embed') as metric:
+        embedded = query_embedding.embed_query(query_text)
+        metric.description = embedded.path
+    if embedded.vector is None:
+        # Reported under errors; the lexical ranking still serves the request
+        raise RuntimeError("Query embedding did not arrive within its deadline")
+    return embeddings.rank_similar_tenders(embedded.vector, limit, today_only=today_only)
+
+
+def hybrid_search(query_text, limit=10, today_only=False, candidates=DEFAULT_CANDIDATES, collapse_duplicates=False):
+    """Search tenders with full-text and vector ranking fused by RRF
+
+    Args:
+        query_text (str): Search text
+        limit (int, optional): Maximum number of results. Defaults to 10.
+        today_only (bool, optional): Only include tenders published in the last 24 hours.
+        candidates (int, optional): Results taken from each source before fusion.
+        collapse_duplicates (bool, optional): Keep only the best result of each near-duplicate cluster.
+
+    Returns:
+        dict: Fused results with per-source ranks and scores, plus timings in milliseconds
+    """
+    start = time.perf_counter()
+    app = current_app._get_current_object()
+    timings = request_timing.current()
+    candidates = max(candidates, limit)
+
+    lexical_future = _executor.submit(
+        _run_timed, app, timings, lexical_search.rank_lexical, query_text, candidates, today_only
+    )
+    vector_future = _executor.submit(_run_timed, app, timings, _rank_vector, query_text, candidates, today_only)
+    lexical, lexical_ms, lexical_error = lexical_future.result()
+    vector, vector_ms, vector_error = vector_future.result()
+    request_timing.record('lexical', lexical_ms)
+    request_timing.record('vector', vector_ms, 'embed and rank')
+
+    fusion_start = time.perf_counter()
+    fused = reciprocal_rank_fusion([lexical, vector])
+    if collapse_duplicates:
+        fused = duplicates.collapse_ranked(fused, limit)
+    else:
+        fused = fused[:limit]
+
+    lexical_by_id = {tender_id: (rank, score) for rank, (tender_id, score) in enumerate(lexical, start=1)}
+    vector_by_id = {tender_id: (rank, score) for rank, (tender_id, score) in enumerate(vector, start=1)}
+
+    tender_ids = [tender_id for tender_id, _ in fused]
+    with request_timing.timed('load'):
+        tenders_by_id = {
+            t.tender_id: t for t in Tender.query.filter(Tender.tender_id.in_(tender_ids)).all()
+        } if tender_ids else {}
+
+    results = []
+    for tender_id, fused_score in fused:
+        tender = tenders_by_id.get(tender_id)
+        if tender is None:
+            continue
+        lexical_rank, lexical_score = lexical_by_id.get(tender_id, (None, None))
+        vector_rank, similarity = vector_by_id.get(tender_id, (None, None))
+        results.append({
+            'tender': tender.to_dict(),
+            'score': fused_score,
+            'similarity': similarity,
+            'lexical_score': lexical_score,
+            'vector_rank': vector_rank,
+            'lexical_rank': lexical_rank
+        })
+
+    fusion_ms = (time.perf_counter() - fusion_start) * 1000
+    request_timing.record('fusion', fusion_ms, 'includes load')
+    errors = {
+        source: error
+        for source, error in (('lexical', lexical_error), ('vector', vector_error))
+        if error
+    }
+
+    return {
+        'results': results,
+        'timings': {
+            'lexical_ms': round(lexical_ms, 2),
+            'vector_ms': round(vector_ms, 2),
+            'fusion_ms': round(fusion_ms, 2),
+            'total_ms': round((time.perf_counter() - start) * 1000, 2)
+        },
+        'source_counts': {'lexical': len(lexical), 'vector': len(vector)},
+        'errors': errors
+    }
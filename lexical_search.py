@@ -0,0 +1,225 @@
+"""
+Full-text search over tenders with Arabic-aware normalization
+Uses a GIN tsvector index on PostgreSQL and an FTS5 table on SQLite, both
+built over normalized text kept in the tender_search_documents table
+"""
+import re
+import logging
+import threading
+import sqlalchemy as sa
+from app import db
+from models import Tender, TenderSearchDocument
+from utils import get_saudi_now, get_saudi_time_hours_ago
+import search_filters
+
+logger = logging.getLogger(__name__)
+
+SYNC_BATCH_SIZE = 500
+MAX_QUERY_TERMS = 16
+
+# Harakat, Quranic marks and superscript alef carry no meaning for matching
+_ARABIC_DIACRITICS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED]')
+_TATWEEL = '\u0640'
+_ARABIC_CHAR_MAP = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    **{chr(0x0660 + i): str(i) for i in range(10)},  # Arabic-Indic digits
+    **{chr(0x06F0 + i): str(i) for i in range(10)},  # Extended Arabic-Indic digits
+})
+_TERM_PATTERN = re.compile(r'\w+')
+
+# External-content FTS5 table over tender_search_documents, kept in sync by triggers
+_SQLITE_FTS_DDL = {
+    'tender_search_fts': (
+        "CREATE VIRTUAL TABLE tender_search_fts USING fts5("
+        "content, content='tender_search_documents', content_rowid='id')"
+    ),
+    'tender_search_documents_ai': (
+        "CREATE TRIGGER tender_search_documents_ai AFTER INSERT ON tender_search_documents BEGIN "
+        "INSERT INTO tender_search_fts(rowid, content) VALUES (new.id, new.content); END"
+    ),
+    'tender_search_documents_ad': (
+        "CREATE TRIGGER tender_search_documents_ad AFTER DELETE ON tender_search_documents BEGIN "
+        "INSERT INTO tender_search_fts(tender_search_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); END"
+    ),
+    'tender_search_documents_au': (
+        "CREATE TRIGGER tender_search_documents_au AFTER UPDATE ON tender_search_documents BEGIN "
+        "INSERT INTO tender_search_fts(tender_search_fts, rowid, content) "
+        "VALUES ('delete', old.id, old.content); "
+        "INSERT INTO tender_search_fts(rowid, content) VALUES (new.id, new.content); END"
+    ),
+}
+
+_index_ready = False
+_index_lock = threading.Lock()
+
+
+def normalize_text(text):
+    """Normalize Arabic and Latin text so spelling variants match the same terms"""
+    if not text:
+        return ''
+    text = _ARABIC_DIACRITICS.sub('', text).replace(_TATWEEL, '')
+    text = text.translate(_ARABIC_CHAR_MAP).lower()
+    return ' '.join(text.split())
+
+
+def query_terms(query_text):
+    """Split a query into distinct normalized terms"""
+    terms = []
+    for term in _TERM_PATTERN.findall(normalize_text(query_text)):
+        if term not in terms:
+            terms.append(term)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def build_document(tender):
+    """Normalized searchable text for a tender"""
+    parts = [
+        tender.tender_title,
+        tender.reference_number,
+        tender.organization,
+        tender.tender_type,
+        tender.city,
+        tender.main_activities
+    ]
+    return normalize_text(' '.join(part for part in parts if part))
+
+
+def ensure_lexical_index():
+    """Create the search documents table and the dialect-specific full-text index"""
+    global _index_ready
+    if _index_ready:
+        return
+
+    with _index_lock:
+        if _index_ready:
+            return
+
+        TenderSearchDocument.__table__.create(db.engine, checkfirst=True)
+        dialect = db.engine.dialect.name
+
+        with db.engine.begin() as conn:
+            if dialect == 'postgresql':
+                conn.execute(sa.text(
+                    "CREATE INDEX IF NOT EXISTS tender_search_documents_fts_idx "
+                    "ON tender_search_documents USING gin (to_tsvector('simple', content))"
+                ))
+            elif dialect == 'sqlite':
+                existing = {row[0] for row in conn.execute(sa.text(
+                    "SELECT name FROM sqlite_master WHERE name LIKE 'tender_search_%'"
+                ))}
+                missing = [name for name in _SQLITE_FTS_DDL if name not in existing]
+                for name in missing:
+                    conn.execute(sa.text(_SQLITE_FTS_DDL[name]))
+                if missing:
+                    # Index documents that were written while the FTS table or triggers were absent
+                    conn.execute(sa.text("INSERT INTO tender_search_fts(tender_search_fts) VALUES ('rebuild')"))
+            else:
+                logger.warning(f"No full-text index for dialect {dialect}, lexical search will use ILIKE")
+
+        _index_ready = True
+
+
+def sync_search_documents(batch_size=SYNC_BATCH_SIZE):
+    """Create or refresh search documents for new and updated tenders
+
+    Returns:
+        int: Number of documents written
+    """
+    ensure_lexical_index()
+    count = 0
+
+    while True:
+        rows = db.session.query(Tender, TenderSearchDocument).outerjoin(
+            TenderSearchDocument,
+            Tender.tender_id == TenderSearchDocument.tender_id
+        ).filter(
+            (TenderSearchDocument.id.is_(None)) | (Tender.updated_at > TenderSearchDocument.updated_at)
+        ).limit(batch_size).all()
+
+        if not rows:
+            break
+
+        for tender, document in rows:
+            if document is None:
+                document = TenderSearchDocument(tender_id=tender.tender_id)
+                db.session.add(document)
+            document.content = build_document(tender)
+            # Copy the tender timestamp so the row only changes again on the next update
+            document.updated_at = tender.updated_at or get_saudi_now()
+
+        db.session.commit()
+        count += len(rows)
+
+        if len(rows) < batch_size:
+            break
+
+    if count:
+        logger.info(f"Indexed {count} tenders for full-text search")
+    return count
+
+
+def rank_lexical(query_text, limit=50, today_only=False, filters=None):
+    """Rank active tenders by full-text relevance to the query
+
+    Terms are OR-ed together so that partial matches still rank, with
+    documents matching more (and rarer) terms scoring higher.
+
+    Args:
+        query_text (str): Search text
+        limit (int, optional): Maximum number of results. Defaults to 50.
+        today_only (bool, optional): Only rank tenders published in the last 24 hours.
+        filters (SearchFilters, optional): Organization, type, city, price and deadline filters.
+
+    Returns:
+        list: (tender_id, score) tuples sorted by relevance, higher is better
+    """
+    terms = query_terms(query_text)
+    if not terms:
+        return []
+
+    ensure_lexical_index()
+    dialect = db.engine.dialect.name
+
+    if dialect == 'postgresql':
+        tsquery = sa.func.plainto_tsquery('simple', terms[0])
+        for term in terms[1:]:
+            tsquery = tsquery.op('||')(sa.func.plainto_tsquery('simple', term))
+        document = sa.func.to_tsvector('simple', TenderSearchDocument.content)
+        score = sa.func.ts_rank_cd(document, tsquery)
+        query = db.session.query(
+            TenderSearchDocument.tender_id, score.label('score')
+        ).filter(document.op('@@')(tsquery))
+    elif dialect == 'sqlite':
+        fts = sa.table('tender_search_fts', sa.column('rowid'))
+        fts_column = sa.literal_column('tender_search_fts')
+        # Terms only contain word characters, so quoting them is safe
+        match = ' OR '.join(f'"{term}"' for term in terms)
+        # bm25() is lower for better matches
+        score = -sa.func.bm25(fts_column)
+        query = db.session.query(
+            TenderSearchDocument.tender_id, score.label('score')
+        ).select_from(fts).join(
+            TenderSearchDocument,
+            TenderSearchDocument.id == fts.c.rowid
+        ).filter(fts_column.op('MATCH')(match))
+    else:
+        score = sa.literal(1.0)
+        query = db.session.query(
+            TenderSearchDocument.tender_id, score.label('score')
+        ).filter(sa.or_(*[TenderSearchDocument.content.ilike(f'%{term}%') for term in terms]))
+
+    query = query.join(Tender, Tender.tender_id == TenderSearchDocument.tender_id)
+
+    # Same active-tender filters as vector search
+    now = get_saudi_now()
+    query = query.filter(
+        (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    )
+    if today_only:
+        query = query.filter(Tender.publication_date >= get_saudi_time_hours_ago(24))
+    query = search_filters.apply_filters(query, filters)
+
+    results = query.order_by(sa.desc('score')).limit(limit).all()
+    return [(tender_id, float(score)) for tender_id, score in results]
@@ -0,0 +1,77 @@
+"""
+Migration script to add the truncated (Matryoshka) coarse embedding column and backfill it
+The coarse prefix is derived from the stored full vectors, no embedding API calls are made
+"""
+import logging
+import argparse
+from app import app, db
+from models import TenderEmbedding, COARSE_EMBEDDING_DIMENSIONS
+from schema import add_missing_columns
+import quantization
+import pgvector_indexes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def backfill_coarse_embeddings(batch_size=DEFAULT_BATCH_SIZE):
+    """Store the re-normalized prefix for every embedding that has none
+
+    Returns:
+        int: Number of embeddings updated
+    """
+    count = 0
+    last_id = 0
+
+    while True:
+        rows = TenderEmbedding.query.filter(
+            TenderEmbedding.id > last_id
+        ).filter(
+            TenderEmbedding.embedding_coarse.is_(None)
+        ).order_by(TenderEmbedding.id).limit(batch_size).all()
+
+        if not rows:
+            break
+
+        for row in rows:
+            if row.embedding is not None:
+                row.embedding_coarse = quantization.truncate_embedding(row.embedding, COARSE_EMBEDDING_DIMENSIONS)
+            last_id = row.id
+
+        db.session.commit()
+        count += len(rows)
+        logger.info(f"Backfilled coarse embeddings for {count} rows")
+
+    return count
+
+
+def migrate_coarse_embeddings(batch_size=DEFAULT_BATCH_SIZE):
+    """Add the coarse column, backfill it, and index it on PostgreSQL"""
+    try:
+        added = add_missing_columns(TenderEmbedding)
+        if added:
+            logger.info(f"Added columns: {', '.join(added)}")
+
+        count = backfill_coarse_embeddings(batch_size)
+        logger.info(f"Coarse embedding migration completed, {count} rows updated")
+
+        pgvector_indexes.build_ann_index(method="hnsw", column="embedding_coarse")
+        return True
+    except Exception as e:
+        logger.error(f"Error migrating coarse embeddings: {str(e)}")
+        db.session.rollback()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add and backfill the coarse embedding column')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Rows updated per transaction (default: {DEFAULT_BATCH_SIZE})')
+
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate_coarse_embeddings(args.batch_size)
@@ -0,0 +1,85 @@
+"""
+Migration script to add compact embedding storage and backfill it from the full vectors
+Run with EMBEDDING_COMPACT_FORMAT set to float16, int8 or binary
+"""
+import logging
+import argparse
+from app import app, db
+from models import TenderEmbedding
+from schema import add_missing_columns
+import quantization
+import pgvector_indexes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def backfill_compact_embeddings(fmt, batch_size=DEFAULT_BATCH_SIZE):
+    """Encode the compact copy for every embedding stored without one in the given format
+
+    Returns:
+        int: Number of embeddings updated
+    """
+    count = 0
+    last_id = 0
+
+    while True:
+        rows = TenderEmbedding.query.filter(
+            TenderEmbedding.id > last_id
+        ).filter(
+            (TenderEmbedding.compact_format.is_(None)) | (TenderEmbedding.compact_format != fmt)
+        ).order_by(TenderEmbedding.id).limit(batch_size).all()
+
+        if not rows:
+            break
+
+        for row in rows:
+            row.embedding_compact = quantization.encode_compact(row.embedding, fmt)
+            row.compact_format = fmt if row.embedding_compact is not None else None
+            last_id = row.id
+
+        db.session.commit()
+        count += len(rows)
+        logger.info(f"Backfilled compact embeddings for {count} rows")
+
+    return count
+
+
+def migrate_compact_embeddings(fmt, batch_size=DEFAULT_BATCH_SIZE):
+    """Add the compact columns, backfill them, and index them on PostgreSQL"""
+    try:
+        added = add_missing_columns(TenderEmbedding)
+        if added:
+            logger.info(f"Added columns: {', '.join(added)}")
+
+        count = backfill_compact_embeddings(fmt, batch_size)
+        logger.info(f"Compact embedding migration completed, {count} rows encoded as {fmt}")
+
+        # pgvector can index float16 and binary forms directly for two-stage search
+        if fmt in ("float16", "binary"):
+            pgvector_indexes.build_ann_index(method="hnsw", compact_format=fmt)
+
+        return True
+    except Exception as e:
+        logger.error(f"Error migrating compact embeddings: {str(e)}")
+        db.session.rollback()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add and backfill compact embedding storage')
+    parser.add_argument('--format', choices=quantization.COMPACT_FORMATS,
+                        default=quantization.COMPACT_FORMAT,
+                        help='Compact format (default: EMBEDDING_COMPACT_FORMAT)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Rows encoded per transaction (default: {DEFAULT_BATCH_SIZE})')
+
+    args = parser.parse_args()
+    if not args.format:
+        parser.error('--format is required when EMBEDDING_COMPACT_FORMAT is not set')
+
+    with app.app_context():
+        migrate_compact_embeddings(args.format, args.batch_size)
@@ -0,0 +1,97 @@
+"""
+Migration script to version the tender embeddings
+Adds the embedding_versions table and tender_embeddings.version_id, replaces the
+unique constraint on tender_id with one on (tender_id, version_id) plus a partial
+one on tender_id for unversioned rows, and assigns the existing rows to an
+initial active version
+"""
+import logging
+import sqlalchemy as sa
+from app import app, db
+from models import TenderEmbedding, EmbeddingVersion, EMBEDDING_DIMENSIONS
+from schema import add_missing_columns
+import embeddings
+import embedding_versions
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _tender_id_unique_constraints(inspector):
+    """Unique constraints on tender_embeddings that cover tender_id alone"""
+    return [
+        constraint for constraint in inspector.get_unique_constraints(TenderEmbedding.__tablename__)
+        if constraint['column_names'] == ['tender_id']
+    ]
+
+
+def _sqlite_tender_id_unique():
+    """Whether SQLite enforces an inline UNIQUE on tender_id, which the inspector does not report"""
+    with db.engine.connect() as conn:
+        for index in conn.execute(sa.text(f"PRAGMA index_list({TenderEmbedding.__tablename__})")).mappings():
+            if index['origin'] != 'u':
+                continue
+            columns = [row['name'] for row in conn.execute(sa.text(f"PRAGMA index_info('{index['name']}')")).mappings()]
+            if columns == ['tender_id']:
+                return True
+    return False
+
+
+def _rebuild_sqlite_table():
+    """Recreate tender_embeddings from the model, since SQLite cannot drop an inline UNIQUE"""
+    table = TenderEmbedding.__tablename__
+    old_table = f"{table}_unversioned"
+    inspector = sa.inspect(db.engine)
+    old_columns = {column['name'] for column in inspector.get_columns(table)}
+    # Index names are global in SQLite, so the old ones must go before the new table is created
+    old_indexes = [index['name'] for index in inspector.get_indexes(table)]
+
+    with db.engine.begin() as conn:
+        conn.execute(sa.text(f"ALTER TABLE {table} RENAME TO {old_table}"))
+        for name in old_indexes:
+            conn.execute(sa.text(f"DROP INDEX IF EXISTS {name}"))
+
+    TenderEmbedding.__table__.create(db.engine)
+    columns = ', '.join(c.name for c in TenderEmbedding.__table__.columns if c.name in old_columns)
+
+    with db.engine.begin() as conn:
+        conn.execute(sa.text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old_table}"))
+        conn.execute(sa.text(f"DROP TABLE {old_table}"))
+
+
+def migrate_embedding_versions():
+    """Create the versioning schema and the initial active version"""
+    try:
+        add_missing_columns(EmbeddingVersion)
+        added = add_missing_columns(TenderEmbedding)
+        if added:
+            logger.info(f"Added columns: {', '.join(added)}")
+
+        if db.engine.dialect.name == 'sqlite':
+            if _sqlite_tender_id_unique():
+                logger.info("Rebuilding tender_embeddings without the unique tender_id constraint")
+                _rebuild_sqlite_table()
+        else:
+            constraints = _tender_id_unique_constraints(sa.inspect(db.engine))
+            with db.engine.begin() as conn:
+                for constraint in constraints:
+                    logger.info(f"Dropping constraint {constraint['name']}")
+                    conn.execute(sa.text(
+                        f"ALTER TABLE {TenderEmbedding.__tablename__} DROP CONSTRAINT {constraint['name']}"
+                    ))
+
+        version = embedding_versions.ensure_initial_version(
+            embeddings.EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, embedding_versions.DEFAULT_TEMPLATE
+        )
+        logger.info(f"Embedding versioning migration completed, active version {version.id}")
+        return True
+    except Exception as e:
+        logger.error(f"Error migrating embedding versions: {str(e)}")
+        db.session.rollback()
+        return False
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        migrate_embedding_versions()
@@ -7,6 +7,7 @@ from app import db, app
 from models import TenderEmbedding
 import sqlalchemy as sa
 from pgvector.sqlalchemy import Vector
+from pgvector_indexes import build_ann_index, get_ann_indexes
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,6 +26,10 @@ def setup_pgvector():
         db.create_all()
         logger.info("Created tender_embeddings table")
         
+        # Without an ANN index every similarity search is a sequential scan
+        if not get_ann_indexes():
+            build_ann_index(method="hnsw")
+        
         return True
     except Exception as e:
         logger.error(f"Error setting up pgvector: {str(e)}")
@@ -0,0 +1,75 @@
+"""
+Migration script for the vector search filters
+Adds the numeric price_value column and the indexes on the filtered tender
+columns, then parses price_value from the stored price strings
+"""
+import logging
+import argparse
+from app import app, db
+from models import Tender
+from schema import add_missing_columns
+import search_filters
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def backfill_price_values(batch_size=DEFAULT_BATCH_SIZE):
+    """Parse price_value for every tender that has a price but no value yet
+
+    Returns:
+        int: Number of tenders updated
+    """
+    count = 0
+    last_id = 0
+
+    while True:
+        rows = Tender.query.filter(
+            Tender.id > last_id
+        ).filter(
+            Tender.price_value.is_(None)
+        ).filter(
+            Tender.price.isnot(None)
+        ).order_by(Tender.id).limit(batch_size).all()
+
+        if not rows:
+            break
+
+        for tender in rows:
+            tender.price_value = search_filters.parse_price(tender.price)
+            last_id = tender.id
+
+        db.session.commit()
+        count += len(rows)
+        logger.info(f"Parsed prices for {count} tenders")
+
+    return count
+
+
+def migrate_search_filters(batch_size=DEFAULT_BATCH_SIZE):
+    """Add the filter column and indexes and backfill prices"""
+    try:
+        added = add_missing_columns(Tender)
+        if added:
+            logger.info(f"Added columns: {', '.join(added)}")
+
+        count = backfill_price_values(batch_size)
+        logger.info(f"Search filter migration completed, {count} tenders updated")
+        return True
+    except Exception as e:
+        logger.error(f"Error migrating search filters: {str(e)}")
+        db.session.rollback()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add the columns and indexes used by vector search filters')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Tenders updated per transaction (default: {DEFAULT_BATCH_SIZE})')
+
+    args = parser.parse_args()
+    with app.app_context():
+        migrate_search_filters(args.batch_size)
@@ -3,6 +3,10 @@ from app import db
 from pgvector.sqlalchemy import Vector
 from utils import get_saudi_now
 
+EMBEDDING_DIMENSIONS = 1536
+# Truncated Matryoshka prefix of the embedding used as a coarse first-stage index
+COARSE_EMBEDDING_DIMENSIONS = 256
+
 class Tender(db.Model):
     __tablename__ = 'tenders'
     
@@ -10,18 +14,20 @@ class Tender(db.Model):
     tender_id = db.Column(db.String(255), unique=True, nullable=False, index=True)
     reference_number = db.Column(db.String(255), nullable=True)
     publication_date = db.Column(db.DateTime, nullable=True)
-    tender_type = db.Column(db.String(255), nullable=True)
+    tender_type = db.Column(db.String(255), nullable=True, index=True)
     tender_title = db.Column(db.String(500), nullable=True)
-    organization = db.Column(db.String(255), nullable=True)
+    organization = db.Column(db.String(255), nullable=True, index=True)
     tender_url = db.Column(db.String(500), nullable=True)
     main_activities = db.Column(db.Text, nullable=True)
     duration = db.Column(db.String(255), nullable=True)
     inquiry_deadline = db.Column(db.DateTime, nullable=True)
-    submission_deadline = db.Column(db.DateTime, nullable=True)
+    submission_deadline = db.Column(db.DateTime, nullable=True, index=True)
     opening_date = db.Column(db.DateTime, nullable=True)
     # Additional fields for new data structure
-    city = db.Column(db.String(255), nullable=True)
+    city = db.Column(db.String(255), nullable=True, index=True)
     price = db.Column(db.String(255), nullable=True)
+    # Number parsed from price, used by the price range search filters
+    price_value = db.Column(db.Float, nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=get_saudi_now)
     updated_at = db.Column(db.DateTime, default=get_saudi_now, onupdate=get_saudi_now)
     
@@ -64,21 +70,242 @@ class Tender(db.Model):
         return f"{title} {org} {activities}"
 
 
+class EmbeddingVersion(db.Model):
+    """Embedding model, dimensions and text template that a set of embeddings was built with"""
+    __tablename__ = 'embedding_versions'
+    __table_args__ = (
+        db.UniqueConstraint('model', 'dimensions', 'template', name='uq_embedding_version'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    model = db.Column(db.String(100), nullable=False)
+    dimensions = db.Column(db.Integer, nullable=False)
+    template = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='building')  # building, active, retired
+    created_at = db.Column(db.DateTime, default=get_saudi_now)
+    activated_at = db.Column(db.DateTime, nullable=True)
+    retired_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'model': self.model,
+            'dimensions': self.dimensions,
+            'template': self.template,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'activated_at': self.activated_at.isoformat() if self.activated_at else None,
+            'retired_at': self.retired_at.isoformat() if self.retired_at else None
+        }
+
 class TenderEmbedding(db.Model):
     """Store vector embeddings for tenders"""
     __tablename__ = 'tender_embeddings'
+    __table_args__ = (
+        # One embedding per tender and version
+        db.Index('uq_tender_embeddings_tender_version', 'tender_id', 'version_id', unique=True),
+        # NULLs are distinct in unique indexes, so unversioned rows need their own
+        db.Index('uq_tender_embeddings_tender_unversioned', 'tender_id', unique=True,
+                 sqlite_where=db.text('version_id IS NULL'), postgresql_where=db.text('version_id IS NULL')),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, unique=True)
-    embedding = db.Column(Vector(1536))  # 1536 dimensions for text-embedding-3-small
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, index=True)
+    # Null for rows written before embeddings were versioned
+    version_id = db.Column(db.Integer, db.ForeignKey('embedding_versions.id'), nullable=True, index=True)
+    embedding = db.Column(Vector(EMBEDDING_DIMENSIONS))  # 1536 dimensions for text-embedding-3-small
+    # Re-normalized prefix of the embedding, equivalent to requesting fewer dimensions from the model
+    embedding_coarse = db.Column(Vector(COARSE_EMBEDDING_DIMENSIONS), nullable=True)
+    # Optional compact copy (float16, int8 or binary) for first-stage candidate search
+    embedding_compact = db.Column(db.LargeBinary, nullable=True)
+    compact_format = db.Column(db.String(16), nullable=True)
     created_at = db.Column(db.DateTime, default=get_saudi_now)
     
     # Relationship to the tender
-    tender = db.relationship('Tender', foreign_keys=[tender_id], backref=db.backref('embedding_rel', uselist=False, cascade='all, delete-orphan'))
+    # A tender has one row per embedding version
+    tender = db.relationship('Tender', foreign_keys=[tender_id], backref=db.backref('embedding_rel', cascade='all, delete-orphan'))
     
     def __repr__(self):
         return f"<TenderEmbedding {self.tender_id}>"
 
+class ArchivedEmbedding(db.Model):
+    """Compact embedding of an expired tender, searched only on request (see archive.py)"""
+    __tablename__ = 'archived_embeddings'
+    __table_args__ = (
+        db.Index('uq_archived_embeddings_tender_version', 'tender_id', 'version_id', unique=True),
+        db.Index('uq_archived_embeddings_tender_unversioned', 'tender_id', unique=True,
+                 sqlite_where=db.text('version_id IS NULL'), postgresql_where=db.text('version_id IS NULL')),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, index=True)
+    version_id = db.Column(db.Integer, db.ForeignKey('embedding_versions.id', ondelete='CASCADE'), nullable=True, index=True)
+    # Quantized codes in the layout of quantization.encode_compact
+    embedding_compact = db.Column(db.LargeBinary, nullable=False)
+    compact_format = db.Column(db.String(16), nullable=False)
+    archived_at = db.Column(db.DateTime, default=get_saudi_now)
+    
+    def __repr__(self):
+        return f"<ArchivedEmbedding {self.tender_id}>"
+
+class EmbeddingFailure(db.Model):
+    """Tender whose embedding could not be created, retried with backoff (see embedding_failures.py)"""
+    __tablename__ = 'embedding_failures'
+    __table_args__ = (
+        db.Index('uq_embedding_failures_tender_version', 'tender_id', 'version_id', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, index=True)
+    version_id = db.Column(db.Integer, db.ForeignKey('embedding_versions.id', ondelete='CASCADE'), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, nullable=True, index=True)
+    first_failed_at = db.Column(db.DateTime, default=get_saudi_now)
+    last_failed_at = db.Column(db.DateTime, default=get_saudi_now)
+    
+    def __repr__(self):
+        return f"<EmbeddingFailure {self.tender_id} attempts={self.attempts}>"
+
+class TenderSearchDocument(db.Model):
+    """Normalized tender text indexed for full-text search (see lexical_search.py)"""
+    __tablename__ = 'tender_search_documents'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, unique=True)
+    content = db.Column(db.Text, nullable=False, default='')
+    updated_at = db.Column(db.DateTime, default=get_saudi_now)
+    
+    def __repr__(self):
+        return f"<TenderSearchDocument {self.tender_id}>"
+
+class TenderNeighbor(db.Model):
+    """Precomputed nearest neighbour of a tender (see neighbors.py)"""
+    __tablename__ = 'tender_neighbors'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, index=True)
+    neighbor_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False)
+    rank = db.Column(db.Integer, nullable=False)
+    similarity = db.Column(db.Float, nullable=False)
+    computed_at = db.Column(db.DateTime, default=get_saudi_now)
+    
+    def __repr__(self):
+        return f"<TenderNeighbor {self.tender_id} #{self.rank} {self.neighbor_id}>"
+
+class TenderSignature(db.Model):
+    """LSH signature and duplicate cluster of an embedded tender (see duplicates.py)"""
+    __tablename__ = 'tender_signatures'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, unique=True)
+    # Random-hyperplane signature bits as hex
+    signature = db.Column(db.String(128), nullable=False)
+    title_hash = db.Column(db.String(40), nullable=True)
+    # tender_id of the newest tender in the cluster
+    cluster_id = db.Column(db.String(255), nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<TenderSignature {self.tender_id} cluster={self.cluster_id}>"
+
+class DuplicateBucket(db.Model):
+    """LSH bucket membership used to find near-duplicate candidates"""
+    __tablename__ = 'duplicate_buckets'
+    __table_args__ = (
+        db.Index('ix_duplicate_buckets_band_bucket', 'band', 'bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    band = db.Column(db.SmallInteger, nullable=False)
+    bucket = db.Column(db.String(40), nullable=False)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, index=True)
+
+class TopicCluster(db.Model):
+    """Topic of open tenders found by k-means over their embeddings (see topics.py)"""
+    __tablename__ = 'topic_clusters'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Embedding version the centroid was computed in
+    version_id = db.Column(db.Integer, db.ForeignKey('embedding_versions.id', ondelete='CASCADE'), nullable=True, index=True)
+    label = db.Column(db.String(255), nullable=False)
+    centroid = db.Column(Vector(EMBEDDING_DIMENSIONS), nullable=False)
+    size = db.Column(db.Integer, nullable=False, default=0)
+    computed_at = db.Column(db.DateTime, default=get_saudi_now)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'label': self.label,
+            'size': self.size,
+            'computed_at': self.computed_at.isoformat() if self.computed_at else None
+        }
+
+class TenderTopic(db.Model):
+    """Topic cluster a tender was assigned to"""
+    __tablename__ = 'tender_topics'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False, unique=True)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topic_clusters.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Cosine similarity to the topic centroid
+    similarity = db.Column(db.Float, nullable=False)
+
+class SearchSubscription(db.Model):
+    """Saved search matched against newly embedded tenders (see subscriptions.py)"""
+    __tablename__ = 'search_subscriptions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=True)
+    query_text = db.Column(db.Text, nullable=False)
+    # Cached query embedding so percolation never calls the embedding API
+    embedding = db.Column(Vector(EMBEDDING_DIMENSIONS), nullable=False)
+    # Optional exact-match filters, None matches any value
+    organization = db.Column(db.String(255), nullable=True)
+    tender_type = db.Column(db.String(255), nullable=True)
+    city = db.Column(db.String(255), nullable=True)
+    threshold = db.Column(db.Float, nullable=False, default=0.5)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=get_saudi_now)
+    
+    matches = db.relationship('SubscriptionMatch', backref='subscription', cascade='all, delete-orphan', lazy='dynamic')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'query': self.query_text,
+            'organization': self.organization,
+            'tender_type': self.tender_type,
+            'city': self.city,
+            'threshold': self.threshold,
+            'active': self.active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class SubscriptionMatch(db.Model):
+    """A tender that matched a saved search when it was embedded"""
+    __tablename__ = 'subscription_matches'
+    __table_args__ = (
+        db.UniqueConstraint('subscription_id', 'tender_id', name='uq_subscription_match'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    subscription_id = db.Column(db.Integer, db.ForeignKey('search_subscriptions.id', ondelete='CASCADE'), nullable=False, index=True)
+    tender_id = db.Column(db.String(255), db.ForeignKey('tenders.tender_id', ondelete='CASCADE'), nullable=False)
+    similarity = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=get_saudi_now)
+    
+    tender = db.relationship('Tender', foreign_keys=[tender_id])
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'subscription_id': self.subscription_id,
+            'tender': self.tender.to_dict() if self.tender else None,
+            'similarity': self.similarity,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 class ScrapingLog(db.Model):
     __tablename__ = 'scraping_logs'
     
@@ -102,3 +329,11 @@ class ScrapingLog(db.Model):
             'new_tenders': self.new_tenders,
             'updated_tenders': self.updated_tenders
         }
+
+class DataVersion(db.Model):
+    """Counter bumped by writes that change search results, used to invalidate cached responses"""
+    __tablename__ = 'data_versions'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=get_saudi_now)
@@ -0,0 +1,199 @@
+"""
+"More like this" search from stored tender embeddings
+Neighbours are ranked from the tender's own vector, so no embedding API call is
+made. With PRECOMPUTE_NEIGHBORS enabled the top NEIGHBOR_COUNT neighbours of
+every tender are stored in tender_neighbors and updated after each embedding batch.
+"""
+import os
+import logging
+from app import app, db
+from models import Tender, TenderEmbedding, TenderNeighbor
+from utils import get_saudi_now
+import embeddings
+import embedding_versions
+import request_timing
+
+logger = logging.getLogger(__name__)
+
+# Store precomputed neighbour lists and serve them when they can answer the request
+PRECOMPUTE_NEIGHBORS = os.environ.get("PRECOMPUTE_NEIGHBORS", "false").lower() == "true"
+# Neighbours stored per tender
+NEIGHBOR_COUNT = int(os.environ.get("NEIGHBOR_COUNT", 20))
+# Tenders whose lists are recomputed per batched search
+REFRESH_BATCH_SIZE = 100
+# New tenders can enter the lists of tenders that are among their nearest
+# REVERSE_CANDIDATES, which are checked against each list's current cut-off
+REVERSE_CANDIDATES = NEIGHBOR_COUNT * 4
+
+
+def get_tender_vector(tender_id):
+    """Stored embedding of a tender, or None if it has not been embedded"""
+    row = db.session.query(TenderEmbedding.embedding).filter(
+        TenderEmbedding.tender_id == tender_id
+    ).filter(embedding_versions.active_filter()).first()
+    if row is None or row[0] is None:
+        return None
+    return list(row[0])
+
+
+def rank_neighbors(tender_id, vector, limit=10, today_only=False):
+    """Rank active tenders by similarity to a tender's vector, excluding the tender itself"""
+    ranked = embeddings.rank_similar_tenders(vector, limit + 1, today_only=today_only)
+    return [(other_id, similarity) for other_id, similarity in ranked if other_id != tender_id][:limit]
+
+
+def get_precomputed_neighbors(tender_id, limit=10):
+    """Stored neighbours of a tender that are still open, or None if no list was computed"""
+    if not TenderNeighbor.query.filter_by(tender_id=tender_id).first():
+        return None
+
+    now = get_saudi_now()
+    rows = db.session.query(TenderNeighbor.neighbor_id, TenderNeighbor.similarity).join(
+        Tender, Tender.tender_id == TenderNeighbor.neighbor_id
+    ).filter(
+        TenderNeighbor.tender_id == tender_id
+    ).filter(
+        (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    ).order_by(TenderNeighbor.rank).limit(limit).all()
+
+    return [(neighbor_id, similarity) for neighbor_id, similarity in rows]
+
+
+def find_similar_tenders(tender_id, limit=10, today_only=False, use_precomputed=True):
+    """Find tenders similar to a stored tender without calling the embedding API
+
+    Args:
+        tender_id (str): Tender to find neighbours for
+        limit (int, optional): Maximum number of results. Defaults to 10.
+        today_only (bool, optional): Only include tenders published in the last 24 hours.
+        use_precomputed (bool, optional): Serve the stored neighbour list when it covers the request
+            and still holds limit open tenders.
+
+    Returns:
+        tuple: (results, source) where results are {"tender", "similarity"} dicts and source
+            is "precomputed" or "live", or (None, None) if the tender has no embedding
+    """
+    # Stored lists ignore the publication window and hold at most NEIGHBOR_COUNT entries
+    if use_precomputed and PRECOMPUTE_NEIGHBORS and not today_only and limit <= NEIGHBOR_COUNT:
+        with request_timing.timed('rank', 'precomputed'):
+            ranked = get_precomputed_neighbors(tender_id, limit)
+        # Expired neighbours drop out of a stored list, so a short one is ranked live instead
+        if ranked is not None and len(ranked) >= limit:
+            return embeddings.load_ranked_tenders(ranked), "precomputed"
+
+    vector = get_tender_vector(tender_id)
+    if vector is None:
+        return None, None
+
+    ranked = rank_neighbors(tender_id, vector, limit, today_only=today_only)
+    return embeddings.load_ranked_tenders(ranked), "live"
+
+
+def refresh_neighbors(tender_ids, batch_size=REFRESH_BATCH_SIZE):
+    """Recompute and store the neighbour lists of the given tenders
+
+    Returns:
+        int: Number of lists written
+    """
+    tender_ids = list(tender_ids)
+    count = 0
+
+    for i in range(0, len(tender_ids), batch_size):
+        batch_ids = tender_ids[i:i + batch_size]
+        rows = db.session.query(TenderEmbedding.tender_id, TenderEmbedding.embedding).filter(
+            TenderEmbedding.tender_id.in_(batch_ids)
+        ).filter(embedding_versions.active_filter()).all()
+        if not rows:
+            continue
+
+        # One batched search for the whole chunk; +1 because each tender finds itself
+        ranked = embeddings.rank_similar_tenders_batch(
+            [list(vector) for _, vector in rows], [NEIGHBOR_COUNT + 1] * len(rows)
+        )
+
+        TenderNeighbor.query.filter(
+            TenderNeighbor.tender_id.in_([tender_id for tender_id, _ in rows])
+        ).delete(synchronize_session=False)
+
+        now = get_saudi_now()
+        for (tender_id, _), results in zip(rows, ranked):
+            neighbors = [(other_id, s) for other_id, s in results if other_id != tender_id][:NEIGHBOR_COUNT]
+            db.session.add_all([
+                TenderNeighbor(tender_id=tender_id, neighbor_id=other_id, rank=rank,
+                               similarity=similarity, computed_at=now)
+                for rank, (other_id, similarity) in enumerate(neighbors, start=1)
+            ])
+
+        db.session.commit()
+        count += len(rows)
+
+    return count
+
+
+def update_neighbors(new_tender_ids):
+    """Bring stored neighbour lists up to date after new tenders were embedded
+
+    New tenders get a fresh list. Existing lists are recomputed only when one of
+    the new tenders scores above their current last entry, found by checking the
+    new tenders' own nearest REVERSE_CANDIDATES (similarity is symmetric).
+
+    Returns:
+        int: Number of lists written
+    """
+    new_tender_ids = set(new_tender_ids)
+    if not new_tender_ids:
+        return 0
+
+    rows = db.session.query(TenderEmbedding.tender_id, TenderEmbedding.embedding).filter(
+        TenderEmbedding.tender_id.in_(new_tender_ids)
+    ).filter(embedding_versions.active_filter()).all()
+    ranked = embeddings.rank_similar_tenders_batch(
+        [list(vector) for _, vector in rows], [REVERSE_CANDIDATES] * len(rows)
+    )
+
+    # Best similarity any new tender reaches for each existing tender
+    best = {}
+    for results in ranked:
+        for other_id, similarity in results:
+            if other_id not in new_tender_ids and similarity > best.get(other_id, -2.0):
+                best[other_id] = similarity
+
+    affected = set()
+    if best:
+        stored = db.session.query(
+            TenderNeighbor.tender_id,
+            db.func.min(TenderNeighbor.similarity),
+            db.func.count(TenderNeighbor.id)
+        ).filter(
+            TenderNeighbor.tender_id.in_(best.keys())
+        ).group_by(TenderNeighbor.tender_id).all()
+
+        # Tenders without a stored list are left for refresh_all_neighbors
+        affected = {
+            other_id for other_id, cutoff, length in stored
+            if best[other_id] > cutoff or length < NEIGHBOR_COUNT
+        }
+
+    count = refresh_neighbors(new_tender_ids | affected)
+    logger.info(f"Updated neighbour lists for {len(new_tender_ids)} new and {len(affected)} existing tenders")
+    return count
+
+
+def refresh_all_neighbors(batch_size=REFRESH_BATCH_SIZE):
+    """Recompute the neighbour list of every open tender with an embedding"""
+    now = get_saudi_now()
+    tender_ids = [row[0] for row in db.session.query(TenderEmbedding.tender_id).join(
+        Tender, embedding_versions.active_embedding_join()
+    ).filter(
+        (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    ).all()]
+
+    count = refresh_neighbors(tender_ids, batch_size)
+    logger.info(f"Refreshed neighbour lists for {count} tenders")
+    return count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        refresh_all_neighbors()
@@ -0,0 +1,251 @@
+"""
+Management of approximate-nearest-neighbour (HNSW / IVFFlat) indexes on tender embeddings
+Indexes are built concurrently under a temporary name and swapped in, so
+searches keep working while an index is being rebuilt
+"""
+import os
+import logging
+import argparse
+import sqlalchemy as sa
+from app import app, db
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ANN_INDEX_NAME = "tender_embeddings_embedding_ann_idx"
+COMPACT_ANN_INDEX_NAME = "tender_embeddings_compact_ann_idx"
+COARSE_ANN_INDEX_NAME = "tender_embeddings_coarse_ann_idx"
+ANN_METHODS = ("hnsw", "ivfflat")
+
+# Build parameter defaults recommended by pgvector
+DEFAULT_HNSW_M = 16
+DEFAULT_HNSW_EF_CONSTRUCTION = 64
+MIN_IVFFLAT_LISTS = 10
+
+# Bounds for the per-query recall/latency knobs
+MAX_EF_SEARCH = 1000
+MAX_PROBES = 1000
+# hnsw.iterative_scan mode for filtered searches: strict_order, relaxed_order or off
+ITERATIVE_SCAN = os.environ.get("PGVECTOR_ITERATIVE_SCAN", "strict_order")
+
+
+def is_postgresql():
+    """Whether the configured database supports pgvector indexes"""
+    return db.engine.dialect.name == "postgresql"
+
+
+def default_ivfflat_lists():
+    """Number of IVFFlat lists: rows / 1000 as recommended by pgvector"""
+    rows = db.session.execute(sa.text("SELECT count(*) FROM tender_embeddings")).scalar()
+    return max(MIN_IVFFLAT_LISTS, rows // 1000)
+
+
+def indexed_expression(column="embedding", compact_format=None, dimensions=1536):
+    """Return (expression, operator class) indexed for a column and optional compact format
+
+    The expressions must match quantization.pg_compact_distance so that the
+    planner can use the index for the first-stage candidate search.
+    """
+    if compact_format is None:
+        return column, "vector_cosine_ops"
+    if compact_format == "float16":
+        return f"({column}::halfvec({dimensions}))", "halfvec_cosine_ops"
+    if compact_format == "binary":
+        return f"(binary_quantize({column})::bit({dimensions}))", "bit_hamming_ops"
+    raise ValueError(f"pgvector has no index type for compact format {compact_format}")
+
+
+def build_index_sql(index_name, method="hnsw", m=None, ef_construction=None, lists=None,
+                    column="embedding", compact_format=None, table="tender_embeddings"):
+    """Return the CREATE INDEX statement for an ANN index on a vector column"""
+    if method == "hnsw":
+        m = int(m or DEFAULT_HNSW_M)
+        ef_construction = int(ef_construction or DEFAULT_HNSW_EF_CONSTRUCTION)
+        options = f"m = {m}, ef_construction = {ef_construction}"
+    elif method == "ivfflat":
+        lists = int(lists or default_ivfflat_lists())
+        options = f"lists = {lists}"
+    else:
+        raise ValueError(f"Unknown ANN index method: {method}")
+
+    expression, opclass = indexed_expression(column, compact_format)
+    return (
+        f"CREATE INDEX CONCURRENTLY {index_name} ON {table} "
+        f"USING {method} ({expression} {opclass}) WITH ({options})"
+    )
+
+
+def build_ann_index(method="hnsw", m=None, ef_construction=None, lists=None,
+                    maintenance_work_mem=None, index_name=None, column="embedding",
+                    compact_format=None):
+    """Create or rebuild the ANN index on tender_embeddings without blocking searches
+
+    Args:
+        method (str, optional): "hnsw" or "ivfflat". Defaults to "hnsw".
+        m (int, optional): HNSW max connections per layer.
+        ef_construction (int, optional): HNSW candidate list size during the build.
+        lists (int, optional): IVFFlat list count. Defaults to rows / 1000.
+        maintenance_work_mem (str, optional): Memory for the build, e.g. "1GB".
+        index_name (str, optional): Name of the managed index.
+        column (str, optional): Vector column to index. Defaults to "embedding".
+        compact_format (str, optional): Index the "float16" or "binary" form of the column
+            for two-stage search instead of the full vectors.
+
+    Returns:
+        bool: True if the index was built
+    """
+    if not is_postgresql():
+        logger.warning("ANN indexes require PostgreSQL with pgvector, skipping")
+        return False
+
+    if index_name is None:
+        if column == "embedding_coarse":
+            index_name = COARSE_ANN_INDEX_NAME
+        elif compact_format:
+            index_name = COMPACT_ANN_INDEX_NAME
+        else:
+            index_name = ANN_INDEX_NAME
+
+    new_name = f"{index_name}_new"
+    create_sql = build_index_sql(new_name, method, m, ef_construction, lists, column, compact_format)
+
+    try:
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {new_name}"))
+            if maintenance_work_mem:
+                conn.execute(sa.text("SELECT set_config('maintenance_work_mem', :value, false)"),
+                             {"value": str(maintenance_work_mem)})
+            logger.info(f"Building ANN index: {create_sql}")
+            conn.execute(sa.text(create_sql))
+            if maintenance_work_mem:
+                conn.execute(sa.text("RESET maintenance_work_mem"))
+
+        # Swap the new index in atomically
+        with db.engine.begin() as conn:
+            conn.execute(sa.text(f"DROP INDEX IF EXISTS {index_name}"))
+            conn.execute(sa.text(f"ALTER INDEX {new_name} RENAME TO {index_name}"))
+
+        logger.info(f"ANN index {index_name} built with method {method}")
+        return True
+    except Exception as e:
+        logger.error(f"Error building ANN index: {str(e)}")
+        return False
+
+
+def drop_ann_index(index_name=ANN_INDEX_NAME):
+    """Drop the managed ANN index, falling back to exact sequential scans"""
+    if not is_postgresql():
+        return False
+
+    try:
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(sa.text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+        logger.info(f"Dropped ANN index {index_name}")
+        return True
+    except Exception as e:
+        logger.error(f"Error dropping ANN index: {str(e)}")
+        return False
+
+
+def get_ann_indexes():
+    """List the vector indexes on tender_embeddings with their definitions and sizes"""
+    if not is_postgresql():
+        return []
+
+    rows = db.session.execute(sa.text("""
+        SELECT indexname, indexdef, pg_relation_size(quote_ident(indexname)::regclass)
+        FROM pg_indexes
+        WHERE tablename = 'tender_embeddings'
+          AND (indexdef ILIKE '%USING hnsw%' OR indexdef ILIKE '%USING ivfflat%')
+    """)).all()
+
+    return [
+        {'name': name, 'definition': definition, 'size_bytes': size}
+        for name, definition, size in rows
+    ]
+
+
+def apply_search_params(ef_search=None, probes=None):
+    """Set the per-query recall/latency knobs for the current transaction
+
+    Higher ef_search (HNSW) or probes (IVFFlat) improve recall at the cost
+    of latency. SET LOCAL keeps the setting scoped to this transaction.
+    """
+    if ef_search is not None:
+        db.session.execute(sa.text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+    if probes is not None:
+        db.session.execute(sa.text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+
+
+def apply_filtered_scan():
+    """Let ANN index scans continue until enough rows pass the search filters
+
+    Without this an HNSW scan stops after ef_search candidates, so a
+    selective filter can return fewer rows than requested. Iterative scans
+    need pgvector 0.8; older versions keep the default behaviour.
+    """
+    if ITERATIVE_SCAN == "off":
+        return
+    try:
+        # Savepoint, so an unknown setting does not abort the search transaction
+        with db.session.begin_nested():
+            db.session.execute(sa.text(f"SET LOCAL hnsw.iterative_scan = {ITERATIVE_SCAN}"))
+            # IVFFlat only supports relaxed ordering, callers re-sort the rows they fetch
+            db.session.execute(sa.text("SET LOCAL ivfflat.iterative_scan = relaxed_order"))
+    except Exception as e:
+        logger.warning(f"Iterative index scans are not available: {str(e)}")
+
+
+def validate_search_params(ef_search=None, probes=None):
+    """Return an error message if the search knobs are out of range, else None"""
+    if ef_search is not None and not 1 <= ef_search <= MAX_EF_SEARCH:
+        return f"ef_search must be between 1 and {MAX_EF_SEARCH}"
+    if probes is not None and not 1 <= probes <= MAX_PROBES:
+        return f"probes must be between 1 and {MAX_PROBES}"
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Manage the ANN index on tender embeddings')
+    parser.add_argument('action', choices=['build', 'drop', 'info'],
+                        help='Build (or rebuild) the index, drop it, or show existing indexes')
+    parser.add_argument('--method', choices=ANN_METHODS, default='hnsw',
+                        help='Index method (default: hnsw)')
+    parser.add_argument('--m', type=int, default=DEFAULT_HNSW_M,
+                        help=f'HNSW max connections per layer (default: {DEFAULT_HNSW_M})')
+    parser.add_argument('--ef-construction', type=int, default=DEFAULT_HNSW_EF_CONSTRUCTION,
+                        help=f'HNSW build candidate list size (default: {DEFAULT_HNSW_EF_CONSTRUCTION})')
+    parser.add_argument('--lists', type=int, default=None,
+                        help='IVFFlat list count (default: rows / 1000)')
+    parser.add_argument('--maintenance-work-mem', default=None,
+                        help='Memory available to the index build, e.g. 1GB')
+    parser.add_argument('--compact', choices=['float16', 'binary'], default=None,
+                        help='Index the compact form of the embeddings for two-stage search')
+    parser.add_argument('--coarse', action='store_true',
+                        help='Index the truncated embedding_coarse column instead of the full vectors')
+
+    args = parser.parse_args()
+    if args.coarse and args.compact:
+        parser.error('--coarse and --compact cannot be combined')
+
+    with app.app_context():
+        if args.action == 'build':
+            build_ann_index(
+                method=args.method,
+                m=args.m,
+                ef_construction=args.ef_construction,
+                lists=args.lists,
+                maintenance_work_mem=args.maintenance_work_mem,
+                column='embedding_coarse' if args.coarse else 'embedding',
+                compact_format=args.compact
+            )
+        elif args.action == 'drop':
+            if args.coarse:
+                drop_ann_index(COARSE_ANN_INDEX_NAME)
+            else:
+                drop_ann_index(COMPACT_ANN_INDEX_NAME if args.compact else ANN_INDEX_NAME)
+        else:
+            for index in get_ann_indexes():
+                logger.info(f"{index['name']} ({index['size_bytes']} bytes): {index['definition']}")
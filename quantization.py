@@ -0,0 +1,198 @@
+"""
+Compact embedding formats for first-stage candidate search
+Vectors are L2-normalized before encoding so that scores approximate cosine similarity:
+  float16 - half precision, 2 bytes per dimension
+  int8    - per-vector scalar quantization, 1 byte per dimension plus a float32 scale
+  binary  - sign bits packed 8 per byte, scored by Hamming distance
+Matryoshka truncation keeps only a re-normalized prefix of the dimensions,
+which text-embedding-3 models are trained to support.
+"""
+import os
+import logging
+import numpy as np
+import sqlalchemy as sa
+from pgvector.sqlalchemy import HALFVEC, BIT
+
+logger = logging.getLogger(__name__)
+
+COMPACT_FORMATS = ("float16", "int8", "binary")
+# Compact format written alongside every full embedding, or None to disable
+COMPACT_FORMAT = os.environ.get("EMBEDDING_COMPACT_FORMAT") or None
+# Number of first-stage candidates re-ranked with full-precision vectors
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", 200))
+# Rows scored per chunk, bounds the temporary float32 copy of compact codes
+SCORE_CHUNK_ROWS = 8192
+# Run the first search stage on the truncated embedding_coarse prefix
+COARSE_SEARCH = os.environ.get("COARSE_SEARCH", "false").lower() == "true"
+
+if COMPACT_FORMAT and COMPACT_FORMAT not in COMPACT_FORMATS:
+    logger.error(f"Unknown EMBEDDING_COMPACT_FORMAT {COMPACT_FORMAT}, compact storage disabled")
+    COMPACT_FORMAT = None
+
+
+def truncate_embedding(vector, dimensions):
+    """Return the re-normalized prefix of a vector, or None if the prefix is all zeros"""
+    prefix = np.asarray(vector, dtype=np.float32)[:dimensions]
+    norm = np.linalg.norm(prefix)
+    if norm == 0 or not np.isfinite(norm):
+        return None
+    return (prefix / norm).tolist()
+
+
+def code_layout(fmt, dimensions):
+    """Return (dtype, width) of one encoded row in the in-memory code matrix"""
+    if fmt is None:
+        return np.float32, dimensions
+    if fmt == "float16":
+        return np.float16, dimensions
+    if fmt == "int8":
+        return np.int8, dimensions
+    if fmt == "binary":
+        return np.uint8, (dimensions + 7) // 8
+    raise ValueError(f"Unknown compact format: {fmt}")
+
+
+def encode_row(vector, fmt):
+    """Encode a vector into a code-matrix row and its scale
+
+    Returns:
+        tuple: (codes, scale), or None if the vector is all zeros
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0 or not np.isfinite(norm):
+        return None
+    vector = vector / norm
+
+    if fmt is None:
+        return vector, 1.0
+    if fmt == "float16":
+        return vector.astype(np.float16), 1.0
+    if fmt == "int8":
+        scale = float(np.abs(vector).max()) / 127.0
+        return np.round(vector / scale).astype(np.int8), scale
+    if fmt == "binary":
+        return np.packbits(vector > 0), 1.0
+    raise ValueError(f"Unknown compact format: {fmt}")
+
+
+def encode_rows(matrix, fmt):
+    """Encode every row of a float32 matrix at once, as encode_row does for one vector
+
+    Rows that are all zeros are left as zero codes with scale 1.
+
+    Returns:
+        tuple: (codes, scales) arrays
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[(norms == 0) | ~np.isfinite(norms)] = 1.0
+    matrix = matrix / norms
+    scales = np.ones(len(matrix), dtype=np.float32)
+
+    if fmt is None:
+        return matrix, scales
+    if fmt == "float16":
+        return matrix.astype(np.float16), scales
+    if fmt == "int8":
+        peaks = np.abs(matrix).max(axis=1)
+        scales = np.where(peaks > 0, peaks / 127.0, 1.0).astype(np.float32)
+        return np.round(matrix / scales[:, np.newaxis]).astype(np.int8), scales
+    if fmt == "binary":
+        return np.packbits(matrix > 0, axis=1), scales
+    raise ValueError(f"Unknown compact format: {fmt}")
+
+
+def encode_compact(vector, fmt=COMPACT_FORMAT):
+    """Serialize a vector in a compact format for the embedding_compact column"""
+    if fmt is None:
+        return None
+    encoded = encode_row(vector, fmt)
+    if encoded is None:
+        return None
+    codes, scale = encoded
+    if fmt == "int8":
+        return np.float32(scale).tobytes() + codes.tobytes()
+    return codes.astype(code_layout(fmt, len(vector))[0]).tobytes()
+
+
+def decode_compact(blob, fmt, dimensions):
+    """Inverse of encode_compact, returning (codes, scale) or None if the blob does not fit"""
+    dtype, width = code_layout(fmt, dimensions)
+    if fmt == "int8":
+        if len(blob) != 4 + width:
+            return None
+        scale = float(np.frombuffer(blob[:4], dtype=np.float32)[0])
+        return np.frombuffer(blob[4:], dtype=np.int8), scale
+    codes = np.frombuffer(blob, dtype=dtype)
+    if len(codes) != width:
+        return None
+    return codes, 1.0
+
+
+def score_codes(fmt, codes, scales, query, dimensions):
+    """Approximate cosine similarity between every code row and a normalized query
+
+    Args:
+        fmt (str): Compact format of the codes, or None for float32 vectors
+        codes (np.ndarray): Code matrix, one row per vector
+        scales (np.ndarray): Per-row scales (int8 only)
+        query (np.ndarray): Normalized float32 query vector
+        dimensions (int): Number of dimensions of the original vectors
+
+    Returns:
+        np.ndarray: float32 scores, one per row
+    """
+    return score_codes_batch(fmt, codes, scales, query[np.newaxis, :], dimensions)[:, 0]
+
+
+def score_codes_batch(fmt, codes, scales, queries, dimensions):
+    """Score every code row against several normalized queries at once
+
+    Args:
+        fmt (str): Compact format of the codes, or None for float32 vectors
+        codes (np.ndarray): Code matrix, one row per vector
+        scales (np.ndarray): Per-row scales (int8 only)
+        queries (np.ndarray): Normalized float32 queries, one per row
+        dimensions (int): Number of dimensions of the original vectors
+
+    Returns:
+        np.ndarray: float32 scores of shape (rows, queries)
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if fmt is None:
+        return codes @ queries.T
+
+    scores = np.empty((len(codes), len(queries)), dtype=np.float32)
+    if fmt == "binary":
+        packed_queries = np.packbits(queries > 0, axis=1)
+
+    for start in range(0, len(codes), SCORE_CHUNK_ROWS):
+        chunk = codes[start:start + SCORE_CHUNK_ROWS]
+        end = start + len(chunk)
+        if fmt == "binary":
+            for j, packed in enumerate(packed_queries):
+                differing = np.bitwise_count(chunk ^ packed).sum(axis=1)
+                scores[start:end, j] = 1.0 - 2.0 * differing / dimensions
+        else:
+            scores[start:end] = chunk.astype(np.float32) @ queries.T
+            if fmt == "int8":
+                scores[start:end] *= scales[start:end, np.newaxis]
+    return scores
+
+
+def pg_compact_distance(fmt, column, query_vector):
+    """SQL expression for the compact-format distance between a vector column and a query
+
+    Only float16 (halfvec) and binary (bit) have native pgvector support; these
+    expressions match the compact ANN indexes built by pgvector_indexes.
+    """
+    dimensions = len(query_vector)
+    if fmt == "float16":
+        query = sa.cast(sa.literal(list(query_vector), HALFVEC(dimensions)), HALFVEC(dimensions))
+        return sa.cast(column, HALFVEC(dimensions)).cosine_distance(query)
+    if fmt == "binary":
+        bits = ''.join('1' if x > 0 else '0' for x in query_vector)
+        query = sa.cast(sa.literal(bits), BIT(dimensions))
+        return sa.cast(sa.func.binary_quantize(column), BIT(dimensions)).hamming_distance(query)
+    return None
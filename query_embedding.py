@@ -0,0 +1,157 @@
+"""
+Latency-bounded embedding of search queries
+A query embedding must arrive within QUERY_EMBEDDING_DEADLINE_MS. The provider
+request runs in a worker thread; if it has not answered by the
+QUERY_HEDGE_PERCENTILE of recent request latencies, or fails early, a second
+identical request is sent and whichever answers first wins. Embeddings are kept
+in a small per-process cache, which also serves repeated queries without a
+request. When the deadline passes without a vector, callers fall back to
+lexical ranking. Every result records the path that produced it.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque, namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import embeddings
+import embedding_failures
+
+logger = logging.getLogger(__name__)
+
+QUERY_EMBEDDING_DEADLINE_MS = float(os.environ.get("QUERY_EMBEDDING_DEADLINE_MS", 2000))
+QUERY_HEDGING = os.environ.get("QUERY_HEDGING", "true").lower() == "true"
+QUERY_HEDGE_PERCENTILE = float(os.environ.get("QUERY_HEDGE_PERCENTILE", 95))
+# Hedge delay until enough latencies have been observed, and its lower bound
+QUERY_HEDGE_DEFAULT_DELAY_MS = float(os.environ.get("QUERY_HEDGE_DEFAULT_DELAY_MS", 800))
+QUERY_HEDGE_MIN_DELAY_MS = float(os.environ.get("QUERY_HEDGE_MIN_DELAY_MS", 100))
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 1000))
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+# Paths that can serve a query
+PATH_CACHE = 'cache'
+PATH_PRIMARY = 'primary'
+PATH_HEDGE = 'hedge'
+PATH_LEXICAL = 'lexical'
+
+# vector is None when no embedding arrived within the deadline
+QueryEmbedding = namedtuple('QueryEmbedding', ['vector', 'path', 'elapsed_ms'])
+
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='query-embedding')
+_lock = threading.Lock()
+_cache = OrderedDict()
+_latencies = deque(maxlen=LATENCY_WINDOW)
+_paths = Counter()
+
+
+def _cache_key(text, version):
+    return (version.model, version.dimensions, version.template, " ".join(text.split()))
+
+
+def _cached(key):
+    with _lock:
+        vector = _cache.get(key)
+        if vector is not None:
+            _cache.move_to_end(key)
+        return vector
+
+
+def _remember(key, vector):
+    with _lock:
+        _cache[key] = vector
+        _cache.move_to_end(key)
+        while len(_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def hedge_delay_ms():
+    """Delay before the hedged request: a high percentile of recent request latencies"""
+    with _lock:
+        samples = list(_latencies)
+    if len(samples) < MIN_LATENCY_SAMPLES:
+        return QUERY_HEDGE_DEFAULT_DELAY_MS
+    return max(float(np.percentile(samples, QUERY_HEDGE_PERCENTILE)), QUERY_HEDGE_MIN_DELAY_MS)
+
+
+def _request(text, version, key, timeout):
+    """One provider request; returns the vector or None"""
+    start = time.perf_counter()
+    vector = embeddings.create_embedding(text, version, timeout=timeout)
+    if not embedding_failures.is_valid_vector(vector, version.dimensions):
+        return None
+    with _lock:
+        _latencies.append((time.perf_counter() - start) * 1000)
+    # Requests that answer after the deadline still serve the next identical query
+    _remember(key, vector)
+    return vector
+
+
+def embed_query(text, version=None, deadline_ms=None):
+    """Embed a search query within a deadline
+
+    Args:
+        text (str): Query text
+        version (VersionInfo, optional): Embedding version. Defaults to the active one.
+        deadline_ms (float, optional): Budget in milliseconds. Defaults to QUERY_EMBEDDING_DEADLINE_MS.
+
+    Returns:
+        QueryEmbedding: The vector and the path that produced it, or a None vector
+            with path PATH_LEXICAL when the budget ran out or every request failed
+    """
+    start = time.perf_counter()
+    version = version or embeddings.active_version()
+    deadline_ms = QUERY_EMBEDDING_DEADLINE_MS if deadline_ms is None else deadline_ms
+    deadline = start + deadline_ms / 1000
+
+    def result(vector, path):
+        with _lock:
+            _paths[path] += 1
+        return QueryEmbedding(vector, path, round((time.perf_counter() - start) * 1000, 2))
+
+    key = _cache_key(text, version)
+    vector = _cached(key)
+    if vector is not None:
+        return result(vector, PATH_CACHE)
+
+    pending = {_executor.submit(_request, text, version, key, deadline_ms / 1000): PATH_PRIMARY}
+    delay_ms = hedge_delay_ms()
+    hedge_at = start + delay_ms / 1000 if QUERY_HEDGING and delay_ms < deadline_ms else None
+
+    while pending:
+        wake_at = min(deadline, hedge_at) if hedge_at is not None else deadline
+        done, _ = wait(pending, timeout=max(wake_at - time.perf_counter(), 0), return_when=FIRST_COMPLETED)
+        for future in done:
+            path = pending.pop(future)
+            vector = future.result()
+            if vector is not None:
+                return result(vector, path)
+
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+        # Hedge once the delay has passed, or straight away when the first request failed
+        if hedge_at is not None and (now >= hedge_at or not pending):
+            pending[_executor.submit(_request, text, version, key, deadline - now)] = PATH_HEDGE
+            hedge_at = None
+
+    logger.warning(f"No query embedding within {deadline_ms:.0f} ms, falling back to lexical search")
+    return result(None, PATH_LEXICAL)
+
+
+def stats():
+    """Query embedding paths and latencies of this process"""
+    with _lock:
+        samples = list(_latencies)
+        paths = dict(_paths)
+        cached = len(_cache)
+    return {
+        'deadline_ms': QUERY_EMBEDDING_DEADLINE_MS,
+        'hedging': QUERY_HEDGING,
+        'hedge_delay_ms': round(hedge_delay_ms(), 2),
+        'latency_p50_ms': round(float(np.percentile(samples, 50)), 2) if samples else None,
+        'latency_p99_ms': round(float(np.percentile(samples, 99)), 2) if samples else None,
+        'served_by': paths,
+        'cached_queries': cached
+    }
@@ -1,54 +1,184 @@
 """
-Script to regenerate all embeddings with the new text structure
-This will delete all existing embeddings and regenerate them with 
-the updated get_text_for_embedding function that includes main activities
+Script to regenerate all embeddings online as a new embedding version
+Embeddings for the new model or text template are built next to the current
+ones, which keep serving search until the new version covers every open
+tender and is activated. The old version is then deleted in batches.
 """
+import time
 import logging
-from app import app, db
-from models import TenderEmbedding
-import generate_embeddings_incremental
+import argparse
+from app import app
+from models import SearchSubscription, EmbeddingVersion
+import embeddings
+import embedding_versions
+import embedding_failures
+import duplicates
+import neighbors
+import topics
+from vector_index import vector_index
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def delete_all_embeddings():
-    """Delete all existing embeddings to force regeneration"""
-    with app.app_context():
-        try:
-            # Count embeddings before deletion
-            count = db.session.query(TenderEmbedding).count()
-            logger.info(f"Deleting {count} existing embeddings")
-            
-            # Delete all embeddings
-            db.session.query(TenderEmbedding).delete()
-            db.session.commit()
-            
-            logger.info(f"Successfully deleted {count} embeddings")
-            return count
-        except Exception as e:
-            logger.error(f"Error deleting embeddings: {str(e)}")
-            db.session.rollback()
-            return 0
-
-def regenerate_all_embeddings():
-    """Regenerate all embeddings with updated text structure"""
-    # First delete all existing embeddings
-    deleted = delete_all_embeddings()
-    logger.info(f"Deleted {deleted} existing embeddings")
-    
-    # Now regenerate embeddings for all tenders
-    with app.app_context():
-        # Use incremental generator without any limits to process all tenders
-        # Use small batch size and delay to avoid API rate limits
-        total_processed = generate_embeddings_incremental.generate_embeddings_incrementally(
-            batch_size=50,
-            delay=5,
-            max_batches=None  # Process all tenders
-        )
-        
-        logger.info(f"Regenerated embeddings for {total_processed} tenders with new text structure")
-        return total_processed
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_DELAY = 5
+
+
+def build_version(version, batch_size=DEFAULT_BATCH_SIZE, delay=DEFAULT_DELAY, max_batches=None):
+    """Embed open tenders that have no embedding in the version yet
+
+    Tenders that fail to embed are retried with the backoff of embedding_failures,
+    and are given up on once they exhaust their attempts, so the build ends when
+    every open tender is embedded or parked.
+
+    Args:
+        version (VersionInfo): Version to fill
+        batch_size (int, optional): Tenders embedded per batch
+        delay (int, optional): Seconds to wait between batches to respect API rate limits
+        max_batches (int, optional): Stop after this many batches. Defaults to None (until covered).
+
+    Returns:
+        int: Number of tenders embedded
+    """
+    total = 0
+    batches = 0
+    empty_batches = 0
+    while max_batches is None or batches < max_batches:
+        remaining = embedding_versions.missing_count(version.id)
+        if remaining == 0:
+            break
+
+        processed = embeddings.batch_embed_tenders(limit=batch_size, version=version)
+        batches += 1
+        total += processed
+        if processed:
+            empty_batches = 0
+            logger.info(f"Embedded {total} tenders for version {version.id}, {remaining - processed} remaining")
+            if delay:
+                time.sleep(delay)
+            continue
+
+        # A failed batch waits for its retry while the next batch tries other tenders. Two
+        # empty batches in a row mean every remaining tender is waiting, or the provider is down
+        empty_batches += 1
+        wait = 0
+        if empty_batches > 1:
+            wait = embedding_failures.seconds_until_retry(version.id)
+            if wait is None:
+                logger.warning(f"{remaining} tenders are missing from version {version.id} but none can be embedded")
+                break
+            logger.info(f"{remaining} tenders of version {version.id} wait for a retry, next in {wait:.0f}s")
+        time.sleep(max(delay or 0, wait))
+    return total
+
+
+def embed_subscriptions(version):
+    """Embed saved-search queries with a version before it is activated
+
+    Returns:
+        dict: Query vector of each subscription by ID
+
+    Raises:
+        ValueError: If the provider returned no usable vector for a query
+    """
+    saved = SearchSubscription.query.all()
+    vectors = {}
+    for i in range(0, len(saved), embeddings.MAX_BATCH_SIZE):
+        batch = saved[i:i + embeddings.MAX_BATCH_SIZE]
+        for subscription, vector in zip(batch, embeddings.create_embeddings([s.query_text for s in batch], version)):
+            if not embedding_failures.is_valid_vector(vector, version.dimensions):
+                raise ValueError(f"Saved search {subscription.id} could not be embedded with version {version.id}")
+            vectors[subscription.id] = vector
+    return vectors
+
+
+def switch_version(version_id):
+    """Activate a built version together with its re-embedded saved searches
+
+    Subscriptions are embedded first and stored in the activation transaction, so
+    they are never compared with the vectors of another model.
+
+    Raises:
+        ValueError: If the version does not exist, is incomplete, or a saved search could not be embedded
+    """
+    target = EmbeddingVersion.query.filter_by(id=version_id).first()
+    if target is None:
+        raise ValueError(f"Embedding version {version_id} not found")
+    if target.status == embedding_versions.VERSION_ACTIVE:
+        return target
+    missing = embedding_versions.missing_count(version_id)
+    if missing:
+        raise ValueError(f"Embedding version {version_id} is missing {missing} open tenders")
+
+    version = embedding_versions.VersionInfo(target.id, target.model, target.dimensions, target.template)
+    return embedding_versions.activate_version(version_id, subscription_embeddings=embed_subscriptions(version))
+
+
+def rebuild_derived_data():
+    """Recompute data derived from the active version's vectors"""
+    vector_index.refresh_if_loaded()
+
+    # Signatures of different models are not comparable, so clusters start over
+    duplicates.rebuild_clusters()
+
+    if neighbors.PRECOMPUTE_NEIGHBORS:
+        neighbors.refresh_all_neighbors()
+
+    # Centroids of the old model do not fit the new vectors
+    topics.recompute_topics()
+
+
+def regenerate_all_embeddings(model=None, template=None, batch_size=DEFAULT_BATCH_SIZE, delay=DEFAULT_DELAY):
+    """Build embeddings for a new version in the background and switch search to it
+
+    Args:
+        model (str, optional): Embedding model. Defaults to the active version's model.
+        template (str, optional): Text template name. Defaults to the active version's template.
+
+    Returns:
+        int: Number of tenders embedded for the new version
+    """
+    current = embeddings.active_version()
+    # Unversioned rows must belong to a version before a second one exists
+    embedding_versions.ensure_initial_version(current.model, current.dimensions, current.template)
+
+    target = embedding_versions.get_or_create_version(
+        model or current.model, current.dimensions, template or current.template
+    )
+    version = embedding_versions.VersionInfo(target.id, target.model, target.dimensions, target.template)
+    if target.status == embedding_versions.VERSION_ACTIVE:
+        logger.info(f"Embedding version {version.id} is already active")
+        return 0
+
+    logger.info(f"Building embedding version {version.id} ({version.model}, {version.template})")
+    total = build_version(version, batch_size, delay)
+
+    try:
+        switch_version(version.id)
+    except ValueError as e:
+        logger.error(f"Embedding version {version.id} was not activated: {str(e)}")
+        return total
+
+    rebuild_derived_data()
+
+    # Give processes still holding the old active version time to notice the switch
+    time.sleep(embedding_versions.RETIRED_GRACE_SECONDS)
+    deleted = embedding_versions.collect_retired_versions()
+    logger.info(f"Regenerated embeddings for {total} tenders as version {version.id}, removed {deleted} old rows")
+    return total
+
 
 if __name__ == "__main__":
-    regenerate_all_embeddings()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Regenerate all embeddings as a new embedding version')
+    parser.add_argument('--model', help='Embedding model (default: the active model)')
+    parser.add_argument('--template', choices=sorted(embedding_versions.TEXT_TEMPLATES),
+                        help='Text template (default: the active template)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f'Tenders embedded per batch (default: {DEFAULT_BATCH_SIZE})')
+    parser.add_argument('--delay', type=int, default=DEFAULT_DELAY,
+                        help=f'Seconds between batches (default: {DEFAULT_DELAY})')
+
+    args = parser.parse_args()
+    with app.app_context():
+        regenerate_all_embeddings(args.model, args.template, args.batch_size, args.delay)
@@ -0,0 +1,230 @@
+"""
+Per-request timing breakdown of the API routes
+Every /api/ request collects named timers (query embedding, ranking, loading
+and serializing tenders, JSON encoding, ...) plus the time and number of SQL
+statements, and reports them in a Server-Timing response header, which browser
+developer tools display per request. With API_DEBUG_ENABLED=true (off by
+default) and debug=1 the same numbers, the executed SQL statements and row
+counts are added to the JSON body under "debug"; such requests bypass the
+response cache and single-flight sharing so that they measure the actual work.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+from flask import request, g
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from app import db
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING_ENABLED = os.environ.get("SERVER_TIMING_ENABLED", "true").lower() == "true"
+# Allow debug=1 to return SQL statements in response bodies. Off by default: the API is
+# public, and debug requests also skip the response cache and single-flight sharing
+API_DEBUG_ENABLED = os.environ.get("API_DEBUG_ENABLED", "false").lower() == "true"
+# Statements kept per debug request
+MAX_DEBUG_STATEMENTS = 200
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class Metric:
+    """A named timer; its description is shown next to the duration"""
+
+    __slots__ = ('name', 'ms', 'description')
+
+    def __init__(self, name, ms=0.0, description=None):
+        self.name = name
+        self.ms = ms
+        self.description = description
+
+
+class RequestTimings:
+    """Timers, SQL statements and row counts of one request"""
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.started = time.perf_counter()
+        self.metrics = {}
+        self.counts = {}
+        self.statements = []
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        # Sources of hybrid search record from worker threads
+        self._lock = threading.Lock()
+
+    def add(self, name, ms, description=None):
+        """Add to a timer; timers recorded several times per request accumulate"""
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(name)
+            metric.ms += ms
+            if description is not None:
+                metric.description = description
+
+    def add_statement(self, statement, ms, rows):
+        with self._lock:
+            self.sql_count += 1
+            self.sql_ms += ms
+            if self.debug and len(self.statements) < MAX_DEBUG_STATEMENTS:
+                self.statements.append({
+                    'statement': ' '.join(statement.split()),
+                    'ms': round(ms, 3),
+                    'rows': rows
+                })
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def header(self):
+        """Server-Timing header value"""
+        parts = []
+        metrics = list(self.metrics.values()) + [
+            Metric('db', self.sql_ms, f"{self.sql_count} {'query' if self.sql_count == 1 else 'queries'}"),
+            Metric('total', self.total_ms())
+        ]
+        for metric in metrics:
+            part = f"{metric.name};dur={metric.ms:.2f}"
+            if metric.description:
+                part += ';desc="' + str(metric.description).replace('"', "'") + '"'
+            parts.append(part)
+        return ', '.join(parts)
+
+    def payload(self):
+        """Numbers added to the body of debug=1 responses"""
+        return {
+            'timings_ms': {
+                **{name: round(metric.ms, 2) for name, metric in self.metrics.items()},
+                'db': round(self.sql_ms, 2),
+                'total': round(self.total_ms(), 2)
+            },
+            'descriptions': {
+                name: metric.description for name, metric in self.metrics.items() if metric.description
+            },
+            'counts': dict(self.counts),
+            'sql_count': self.sql_count,
+            'sql': self.statements
+        }
+
+
+def current():
+    """Timings of the request being served, None outside API requests"""
+    return _current.get()
+
+
+def debug_requested():
+    """Whether the current request asked for the debug payload"""
+    timings = _current.get()
+    return timings is not None and timings.debug
+
+
+@contextlib.contextmanager
+def timed(name, description=None):
+    """Time a block under a Server-Timing metric name; yields the Metric to set its description"""
+    timings = _current.get()
+    metric = Metric(name, description=description)
+    if timings is None:
+        yield metric
+        return
+    start = time.perf_counter()
+    try:
+        yield metric
+    finally:
+        timings.add(name, (time.perf_counter() - start) * 1000, metric.description)
+
+
+def record(name, ms, description=None):
+    """Add a duration measured elsewhere"""
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, ms, description)
+
+
+def count(name, value):
+    """Row count reported in the debug payload"""
+    timings = _current.get()
+    if timings is not None:
+        timings.counts[name] = value
+
+
+@contextlib.contextmanager
+def activate(timings):
+    """Record into a request's timings from another thread"""
+    token = _current.set(timings)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Times the JSON encoding of responses"""
+
+    def dumps(self, obj, **kwargs):
+        with timed('json'):
+            return super().dumps(obj, **kwargs)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('request_timing_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    started = conn.info.get('request_timing_started')
+    if timings is None or not started:
+        return
+    ms = (time.perf_counter() - started.pop()) * 1000
+    # Drivers report -1 when the count is unknown, e.g. for SELECTs on SQLite
+    rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    timings.add_statement(statement, ms, rows)
+
+
+def init_app(app):
+    """Time the API routes of the app and the SQL they run"""
+    if not SERVER_TIMING_ENABLED:
+        return
+
+    with app.app_context():
+        if not event.contains(db.engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_request_timing():
+        if not request.path.startswith('/api/'):
+            return
+        debug = API_DEBUG_ENABLED and request.args.get('debug', '').lower() in ('1', 'true')
+        g.request_timing_token = _current.set(RequestTimings(debug=debug))
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = _current.get()
+        if timings is None:
+            return response
+        if timings.debug and response.mimetype == 'application/json':
+            try:
+                body = json.loads(response.get_data(as_text=True))
+                if isinstance(body, dict):
+                    body['debug'] = timings.payload()
+                    response.set_data(json.dumps(body, ensure_ascii=False, default=str))
+            except ValueError as e:
+                logger.warning(f"Could not add debug payload: {str(e)}")
+        response.headers['Server-Timing'] = timings.header()
+        # Lets cross-origin pages read the timings, as the API is public
+        response.headers['Timing-Allow-Origin'] = '*'
+        return response
+
+    @app.teardown_request
+    def end_request_timing(exc):
+        token = g.pop('request_timing_token', None)
+        if token is not None:
+            _current.reset(token)
@@ -0,0 +1,164 @@
+"""
+Response cache for read-only API endpoints
+Responses are cached per process, keyed by endpoint and normalized request
+parameters and tagged with the data version they were computed from. The data
+version is a counter in the database bumped by every write that can change
+search results (scrapes, embedding batches, cleanup, version switches), so an
+entry is served only while no such write has happened in any process. A short
+TTL covers results that change with the clock alone, such as tenders whose
+deadline passes.
+"""
+import os
+import time
+import json
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from flask import request, Response
+from app import db
+from models import DataVersion
+from utils import get_saudi_now
+from single_flight import single_flight
+import request_timing
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 500))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 300))
+
+# Single row holding the counter
+DATA_VERSION_ID = 1
+
+
+def current_data_version():
+    """Current data version, 0 before the first bump"""
+    return db.session.query(DataVersion.version).filter_by(id=DATA_VERSION_ID).scalar() or 0
+
+
+def bump_data_version():
+    """Invalidate cached responses in every process after a committed write"""
+    try:
+        updated = DataVersion.query.filter_by(id=DATA_VERSION_ID).update({
+            DataVersion.version: DataVersion.version + 1,
+            DataVersion.updated_at: get_saudi_now()
+        }, synchronize_session=False)
+        if not updated:
+            db.session.add(DataVersion(id=DATA_VERSION_ID, version=1, updated_at=get_saudi_now()))
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error bumping data version: {str(e)}")
+        db.session.rollback()
+
+
+def _normalize(value):
+    value = " ".join(str(value).split())
+    return value.lower() if value.lower() in ('true', 'false') else value
+
+
+def cache_key(name, args):
+    """Key from the endpoint name and its non-empty parameters in sorted order"""
+    params = []
+    for key in sorted(args.keys()):
+        values = [_normalize(value) for value in args.getlist(key)]
+        values = [value for value in values if value]
+        if values:
+            params.append((key, values))
+    return json.dumps([name, params], ensure_ascii=False)
+
+
+class ResponseCache:
+    """Bounded LRU of serialized JSON responses tagged with their data version"""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        """Cached body for the key if it was computed from this data version, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            entry_version, stored_at, body = entry
+            if entry_version != version or time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, version, body):
+        with self._lock:
+            self._entries[key] = (version, time.monotonic(), body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': RESPONSE_CACHE_ENABLED,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.evictions
+            }
+
+    def cached(self, name):
+        """Decorator caching successful JSON responses of a GET view"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                # Debug requests measure the actual work
+                if not RESPONSE_CACHE_ENABLED or request_timing.debug_requested():
+                    return view(*args, **kwargs)
+
+                try:
+                    version = current_data_version()
+                except Exception as e:
+                    logger.error(f"Error reading data version, response not cached: {str(e)}")
+                    db.session.rollback()
+                    return view(*args, **kwargs)
+
+                key = cache_key(name, request.args)
+                with request_timing.timed('cache') as metric:
+                    body = self.get(key, version)
+                    metric.description = 'hit' if body is not None else 'miss'
+                if body is not None:
+                    response = Response(body, mimetype='application/json')
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                # Identical requests arriving before the first one is cached wait for it
+                response = single_flight.run_view(f"{key}@{version}", view, *args, **kwargs)
+                if response.status_code == 200 and 'no-store' not in response.headers.get('Cache-Control', ''):
+                    self.put(key, version, response.get_data())
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+
+# Shared by the API routes of this process
+response_cache = ResponseCache()
@@ -2,16 +2,40 @@ import logging
 import threading
 from datetime import datetime, timedelta
 from flask import render_template, jsonify, request
-from models import Tender, ScrapingLog, TenderEmbedding
+from models import Tender, ScrapingLog, TenderEmbedding, SearchSubscription, EmbeddingVersion
 from scraper import run_scraper
 from sqlalchemy import desc, func
 from app import db
 import embeddings
+import pgvector_indexes
+import hybrid_search
+import subscriptions
+import neighbors
+import duplicates
+import embedding_versions
+import embedding_failures
+import search_filters
+import query_embedding
+import topics
+import request_timing
 from utils import get_saudi_now, get_saudi_time_days_ago
+from embedding_queue import embedding_queue
+from response_cache import response_cache
+from single_flight import single_flight
 
 logger = logging.getLogger(__name__)
 
+def _batch_limit(value):
+    """Validate a result limit of the batch search"""
+    limit = int(value)
+    if not 1 <= limit <= embeddings.MAX_BATCH_LIMIT:
+        raise ValueError(f'limit must be between 1 and {embeddings.MAX_BATCH_LIMIT}')
+    return limit
+
 def register_routes(app):
+    # Server-Timing header on every API response, debug=1 payload
+    request_timing.init_app(app)
+    
     # Add CORS headers for API endpoints
     @app.after_request
     def add_cors_headers(response):
@@ -19,6 +43,7 @@ def register_routes(app):
         response.headers.add('Access-Control-Allow-Origin', '*')
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
         response.headers.add('Access-Control-Allow-Methods', 'GET,OPTIONS,POST')
+        response.headers.add('Access-Control-Expose-Headers', 'Server-Timing,X-Cache')
         return response
         
     @app.route('/')
@@ -42,6 +67,7 @@ def register_routes(app):
         return render_template('api_docs.html')
     
     @app.route('/api/tenders')
+    @response_cache.cached('tenders')
     def api_tenders():
         """API endpoint to get tenders with pagination and filtering"""
         try:
@@ -53,10 +79,16 @@ def register_routes(app):
             tender_type = request.args.get('tender_type', '')
             date_from = request.args.get('date_from', '')
             date_to = request.args.get('date_to', '')
+            collapse_duplicates = request.args.get('collapse_duplicates', 'false').lower() == 'true'
+            topic = request.args.get('topic', None, type=int)
             
             # Build the query
             query = Tender.query
             
+            # Show only the newest posting of re-posted tenders
+            if collapse_duplicates:
+                query = duplicates.collapse_query(query)
+            
             # Apply filters
             if search:
                 query = query.filter(Tender.tender_title.ilike(f'%{search}%') | 
@@ -85,18 +117,28 @@ def register_routes(app):
                 except ValueError:
                     logger.warning(f"Invalid date_to format: {date_to}")
             
+            # Topic counts under the other filters, so clients can switch between topics
+            with request_timing.timed('facets'):
+                topic_facets = topics.facet_counts(query)
+            if topic is not None:
+                query = query.filter(topics.topic_filter(topic))
+            
             # Order by publication date (newest first)
             query = query.order_by(Tender.publication_date.desc())
             
             # Paginate the results
-            paginated_tenders = query.paginate(page=page, per_page=per_page, error_out=False)
+            with request_timing.timed('query'):
+                paginated_tenders = query.paginate(page=page, per_page=per_page, error_out=False)
             
             # Format the response
+            with request_timing.timed('serialize'):
+                tenders_page = [tender.to_dict() for tender in paginated_tenders.items]
             result = {
-                'tenders': [tender.to_dict() for tender in paginated_tenders.items],
+                'tenders': tenders_page,
                 'total': paginated_tenders.total,
                 'pages': paginated_tenders.pages,
-                'current_page': page
+                'current_page': page,
+                'topics': topic_facets
             }
             
             return jsonify(result)
@@ -118,6 +160,36 @@ def register_routes(app):
             logger.error(f"Error fetching tender details: {str(e)}")
             return jsonify({'error': str(e)}), 500
     
+    @app.route('/api/tenders/<tender_id>/similar')
+    @single_flight.coalesced('similar-tenders')
+    def api_similar_tenders(tender_id):
+        """Tenders similar to a stored tender, ranked from its existing embedding - public access"""
+        try:
+            limit = request.args.get('limit', 10, type=int)
+            last_24h_only = request.args.get('today_only', 'false').lower() == 'true'
+            use_precomputed = request.args.get('precomputed', 'true').lower() == 'true'
+            
+            if not Tender.query.filter_by(tender_id=tender_id).first():
+                return jsonify({'error': 'Tender not found'}), 404
+            
+            results, source = neighbors.find_similar_tenders(
+                tender_id, limit, today_only=last_24h_only, use_precomputed=use_precomputed
+            )
+            
+            if results is None:
+                return jsonify({'error': 'Tender has no embedding yet'}), 404
+            
+            return jsonify({
+                'tender_id': tender_id,
+                'results': results,
+                'count': len(results),
+                'today_only': last_24h_only,
+                'source': source
+            })
+        except Exception as e:
+            logger.error(f"Error finding similar tenders: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+    
     @app.route('/api/stats')
     def api_stats():
         """API endpoint to get statistics for the dashboard"""
@@ -144,6 +216,9 @@ def register_routes(app):
                 func.count(Tender.id).label('count')
             ).filter(Tender.publication_date >= thirty_days_ago).group_by('date').all()
             
+            # Get tenders by topic cluster
+            tenders_by_topic = topics.facet_counts(Tender.query)
+            
             # Get latest scraping logs
             latest_logs = ScrapingLog.query.order_by(ScrapingLog.start_time.desc()).limit(5).all()
             
@@ -152,6 +227,7 @@ def register_routes(app):
                 'tenders_by_type': [{'type': t[0] or 'Unknown', 'count': t[1]} for t in tenders_by_type],
                 'tenders_by_organization': [{'organization': o[0] or 'Unknown', 'count': o[1]} for o in tenders_by_org],
                 'tenders_by_date': [{'date': d[0].strftime('%Y-%m-%d') if d[0] else 'Unknown', 'count': d[1]} for d in tenders_by_date],
+                'tenders_by_topic': tenders_by_topic,
                 'latest_logs': [log.to_dict() for log in latest_logs]
             }
             
@@ -220,6 +296,7 @@ def register_routes(app):
             return jsonify({'error': str(e)}), 500
             
     @app.route('/api/vector-search', methods=['GET'])
+    @response_cache.cached('vector-search')
     def api_vector_search():
         """Vector search API using OpenAI embeddings - public access"""
         try:
@@ -228,35 +305,238 @@ def register_routes(app):
             # Still using 'today_only' as parameter name for backward compatibility
             # but now it filters to the last 24 hours
             last_24h_only = request.args.get('today_only', 'false').lower() == 'true'
+            # Optional ANN recall/latency knobs
+            ef_search = request.args.get('ef_search', None, type=int)
+            probes = request.args.get('probes', None, type=int)
+            collapse_duplicates = request.args.get('collapse_duplicates', 'false').lower() == 'true'
+            # Also rank expired tenders from the compact archive
+            include_archive = request.args.get('include_archive', 'false').lower() == 'true'
             
             if not query:
                 return jsonify({'error': 'Query parameter is required'}), 400
+            
+            params_error = pgvector_indexes.validate_search_params(ef_search=ef_search, probes=probes)
+            if params_error:
+                return jsonify({'error': params_error}), 400
+            
+            # Organization, type, city, price and deadline filters applied before ranking
+            try:
+                filters = search_filters.parse_filters(request.args)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
                 
             # Perform vector search
-            results = embeddings.search_similar_tenders(query, limit, today_only=last_24h_only)
+            results, served_by = embeddings.search_similar_tenders(
+                query, limit, today_only=last_24h_only, ef_search=ef_search, probes=probes,
+                collapse_duplicates=collapse_duplicates, filters=filters, include_archive=include_archive
+            )
             
-            return jsonify({
+            response = jsonify({
                 'query': query,
                 'results': results,
                 'count': len(results),
-                'today_only': last_24h_only
+                'today_only': last_24h_only,
+                'include_archive': include_archive,
+                'filters': search_filters.to_dict(filters),
+                'served_by': served_by
             })
+            if served_by == query_embedding.PATH_LEXICAL:
+                # Degraded results are not cached, so the next request tries vector search again
+                response.headers['Cache-Control'] = 'no-store'
+            return response
         except Exception as e:
             logger.error(f"Error during vector search: {str(e)}")
             return jsonify({'error': str(e)}), 500
             
+    @app.route('/api/vector-search/batch', methods=['POST'])
+    def api_vector_search_batch():
+        """Run many vector searches with one embedding call and one scoring pass - public access"""
+        try:
+            payload = request.get_json(silent=True) or {}
+            raw_queries = payload.get('queries')
+            default_limit = _batch_limit(payload.get('limit', 10))
+            ef_search = payload.get('ef_search')
+            probes = payload.get('probes')
+            
+            if not isinstance(raw_queries, list) or not raw_queries:
+                return jsonify({'error': 'queries must be a non-empty list'}), 400
+            if len(raw_queries) > embeddings.MAX_BATCH_QUERIES:
+                return jsonify({'error': f'At most {embeddings.MAX_BATCH_QUERIES} queries per request'}), 400
+            
+            queries = []
+            for item in raw_queries:
+                # Plain strings are accepted as queries with the default options
+                if isinstance(item, str):
+                    item = {'query': item}
+                if not isinstance(item, dict) or not str(item.get('query', '')).strip():
+                    return jsonify({'error': 'Every query needs a non-empty query text'}), 400
+                queries.append({
+                    'query': str(item['query']),
+                    'limit': _batch_limit(item.get('limit', default_limit)),
+                    'today_only': str(item.get('today_only', 'false')).lower() == 'true',
+                    'filters': search_filters.parse_filters(item)
+                })
+            
+            params_error = pgvector_indexes.validate_search_params(ef_search=ef_search, probes=probes)
+            if params_error:
+                return jsonify({'error': params_error}), 400
+            
+            grouped, served_by = embeddings.search_similar_tenders_batch(queries, ef_search=ef_search, probes=probes)
+            
+            return jsonify({
+                'results': [
+                    {
+                        'query': q['query'],
+                        'results': results,
+                        'count': len(results),
+                        'today_only': q['today_only'],
+                        'filters': search_filters.to_dict(q['filters']),
+                        'served_by': path
+                    }
+                    for q, results, path in zip(queries, grouped, served_by)
+                ],
+                'count': len(queries)
+            })
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid query options: {str(e)}'}), 400
+        except Exception as e:
+            logger.error(f"Error during batch vector search: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+            
+    @app.route('/api/hybrid-search', methods=['GET'])
+    @single_flight.coalesced('hybrid-search')
+    def api_hybrid_search():
+        """Hybrid full-text + vector search fused with reciprocal rank fusion - public access"""
+        try:
+            query = request.args.get('query', '')
+            limit = request.args.get('limit', 10, type=int)
+            last_24h_only = request.args.get('today_only', 'false').lower() == 'true'
+            candidates = request.args.get('candidates', hybrid_search.DEFAULT_CANDIDATES, type=int)
+            collapse_duplicates = request.args.get('collapse_duplicates', 'false').lower() == 'true'
+            
+            if not query:
+                return jsonify({'error': 'Query parameter is required'}), 400
+            
+            result = hybrid_search.hybrid_search(
+                query, limit, today_only=last_24h_only, candidates=candidates,
+                collapse_duplicates=collapse_duplicates
+            )
+            
+            return jsonify({
+                'query': query,
+                'results': result['results'],
+                'count': len(result['results']),
+                'today_only': last_24h_only,
+                'timings': result['timings'],
+                'source_counts': result['source_counts'],
+                'errors': result['errors']
+            })
+        except Exception as e:
+            logger.error(f"Error during hybrid search: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+            
+    @app.route('/api/subscriptions', methods=['GET'])
+    def api_list_subscriptions():
+        """List saved searches"""
+        try:
+            saved = SearchSubscription.query.order_by(SearchSubscription.id).all()
+            return jsonify({
+                'subscriptions': [s.to_dict() for s in saved],
+                'count': len(saved)
+            })
+        except Exception as e:
+            logger.error(f"Error listing subscriptions: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/subscriptions', methods=['POST'])
+    def api_create_subscription():
+        """Save a search whose matches are recorded as new tenders are embedded"""
+        try:
+            payload = request.get_json(silent=True) or {}
+            query = str(payload.get('query', '')).strip()
+            
+            if not query:
+                return jsonify({'error': 'query is required'}), 400
+            
+            try:
+                threshold = float(payload.get('threshold', subscriptions.DEFAULT_THRESHOLD))
+            except (TypeError, ValueError):
+                return jsonify({'error': 'threshold must be a number'}), 400
+            if not -1.0 <= threshold <= 1.0:
+                return jsonify({'error': 'threshold must be between -1 and 1'}), 400
+            
+            # Embed once here; percolation reuses the cached vector
+            query_embedding = embeddings.create_embedding(query)
+            if not any(query_embedding):
+                return jsonify({'error': 'Could not create an embedding for the query'}), 500
+            
+            subscription = subscriptions.create_subscription(
+                query,
+                query_embedding,
+                name=payload.get('name'),
+                threshold=threshold,
+                **{field: payload.get(field) for field in subscriptions.FILTER_FIELDS}
+            )
+            
+            return jsonify(subscription.to_dict()), 201
+        except Exception as e:
+            logger.error(f"Error creating subscription: {str(e)}")
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/subscriptions/<int:subscription_id>', methods=['DELETE'])
+    def api_delete_subscription(subscription_id):
+        """Delete a saved search and its matches"""
+        try:
+            subscription = SearchSubscription.query.filter_by(id=subscription_id).first()
+            
+            if not subscription:
+                return jsonify({'error': 'Subscription not found'}), 404
+            
+            db.session.delete(subscription)
+            db.session.commit()
+            
+            return jsonify({'status': 'success', 'id': subscription_id})
+        except Exception as e:
+            logger.error(f"Error deleting subscription: {str(e)}")
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/subscriptions/<int:subscription_id>/matches')
+    def api_subscription_matches(subscription_id):
+        """Feed of tenders matched by a saved search, paged by since_id"""
+        try:
+            since_id = request.args.get('since_id', 0, type=int)
+            limit = min(request.args.get('limit', 50, type=int), 500)
+            
+            if not SearchSubscription.query.filter_by(id=subscription_id).first():
+                return jsonify({'error': 'Subscription not found'}), 404
+            
+            matches = subscriptions.get_matches(subscription_id, since_id=since_id, limit=limit)
+            
+            return jsonify({
+                'subscription_id': subscription_id,
+                'matches': [m.to_dict() for m in matches],
+                'count': len(matches),
+                # Pass back as since_id to receive only newer matches
+                'next_since_id': matches[-1].id if matches else since_id
+            })
+        except Exception as e:
+            logger.error(f"Error fetching subscription matches: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+    
     @app.route('/api/embeddings/stats')
     def api_embeddings_stats():
         """Get statistics about the embeddings"""
         try:
             # Count total embeddings
-            total_embeddings = TenderEmbedding.query.count()
+            total_embeddings = TenderEmbedding.query.filter(embedding_versions.active_filter()).count()
             
             # Count tenders with and without embeddings
             total_tenders = Tender.query.count()
             tenders_with_embeddings = db.session.query(Tender).join(
                 TenderEmbedding, 
-                Tender.tender_id == TenderEmbedding.tender_id
+                embedding_versions.active_embedding_join()
             ).count()
             
             # Count tenders with future submission deadlines
@@ -268,7 +548,7 @@ def register_routes(app):
             # Count tenders that need embeddings
             tenders_needing_embeddings = db.session.query(Tender).outerjoin(
                 TenderEmbedding, 
-                Tender.tender_id == TenderEmbedding.tender_id
+                embedding_versions.active_embedding_join()
             ).filter(
                 TenderEmbedding.id.is_(None)
             ).filter(
@@ -281,12 +561,23 @@ def register_routes(app):
                 'tenders_with_embeddings': tenders_with_embeddings,
                 'tenders_without_embeddings': total_tenders - tenders_with_embeddings,
                 'future_tenders': future_tenders,
-                'tenders_needing_embeddings': tenders_needing_embeddings
+                'tenders_needing_embeddings': tenders_needing_embeddings,
+                'embedding_queue': embedding_queue.stats(),
+                'embedding_failures': embedding_failures.failure_stats(embedding_versions.active_version_id()),
+                'query_embedding': query_embedding.stats(),
+                'topics': topics.topic_model.stats()
             })
         except Exception as e:
             logger.error(f"Error fetching embedding stats: {str(e)}")
             return jsonify({'error': str(e)}), 500
             
+    @app.route('/api/cache/stats')
+    def api_cache_stats():
+        """Response cache and request coalescing counters of this worker"""
+        stats = response_cache.stats()
+        stats['single_flight'] = single_flight.stats()
+        return jsonify(stats)
+            
     @app.route('/api/embeddings/generate', methods=['POST'])
     def api_generate_embeddings():
         """API endpoint to generate embeddings for tenders that don't have them"""
@@ -298,7 +589,7 @@ def register_routes(app):
             now = get_saudi_now()
             count_before = db.session.query(Tender).outerjoin(
                 TenderEmbedding, 
-                Tender.tender_id == TenderEmbedding.tender_id
+                embedding_versions.active_embedding_join()
             ).filter(
                 TenderEmbedding.id.is_(None)
             ).filter(
@@ -311,7 +602,7 @@ def register_routes(app):
             # Find tenders without embeddings
             tenders = db.session.query(Tender).outerjoin(
                 TenderEmbedding, 
-                Tender.tender_id == TenderEmbedding.tender_id
+                embedding_versions.active_embedding_join()
             ).filter(
                 TenderEmbedding.id.is_(None)
             ).filter(
@@ -336,17 +627,27 @@ def register_routes(app):
             
     @app.route('/api/embeddings/regenerate-all', methods=['POST'])
     def api_regenerate_all_embeddings():
-        """API endpoint to regenerate all embeddings with new text structure including main activities"""
+        """API endpoint to re-embed all tenders as a new embedding version while search keeps serving the current one"""
         try:
             # Import the regeneration module
             from regenerate_all_embeddings import regenerate_all_embeddings
             
+            payload = request.get_json(silent=True) or {}
+            current = embeddings.active_version()
+            model = payload.get('model') or current.model
+            template = payload.get('template') or current.template
+            
+            if template not in embedding_versions.TEXT_TEMPLATES:
+                return jsonify({'error': f'template must be one of: {", ".join(embedding_versions.TEXT_TEMPLATES)}'}), 400
+            if model == current.model and template == current.template:
+                return jsonify({'error': 'The requested model and template are already active'}), 400
+            
             # Run the process in a background thread to avoid timeouts
             def run_regeneration():
                 with app.app_context():
                     try:
-                        regenerate_all_embeddings()
-                        logger.info("Successfully regenerated all embeddings with new text structure")
+                        regenerate_all_embeddings(model=model, template=template)
+                        logger.info(f"Successfully regenerated all embeddings with {model} and template {template}")
                     except Exception as e:
                         logger.error(f"Error during embeddings regeneration: {str(e)}")
             
@@ -357,11 +658,52 @@ def register_routes(app):
             
             return jsonify({
                 'status': 'success',
-                'message': 'Started regeneration of all embeddings with the new text structure (including main activities). This process will run in the background and may take some time.'
+                'message': f'Started building embeddings with {model} and template {template}. Search keeps using the current embeddings until the new version covers every open tender.'
             })
         except Exception as e:
             logger.error(f"Error starting embeddings regeneration: {str(e)}")
             return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/embeddings/versions')
+    def api_embedding_versions():
+        """List embedding versions with their coverage of open tenders"""
+        try:
+            versions = EmbeddingVersion.query.order_by(EmbeddingVersion.id).all()
+            return jsonify({
+                'versions': [embedding_versions.version_stats(v) for v in versions],
+                'active_version_id': embedding_versions.active_version_id()
+            })
+        except Exception as e:
+            logger.error(f"Error listing embedding versions: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/embeddings/versions/<int:version_id>/activate', methods=['POST'])
+    def api_activate_embedding_version(version_id):
+        """Switch search to a fully built embedding version"""
+        try:
+            from regenerate_all_embeddings import switch_version
+            
+            version = switch_version(version_id)
+            return jsonify({'status': 'success', 'version': version.to_dict()})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error activating embedding version: {str(e)}")
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/embeddings/versions/<int:version_id>', methods=['DELETE'])
+    def api_retire_embedding_version(version_id):
+        """Abandon an inactive version; its rows are removed by the daily cleanup"""
+        try:
+            version = embedding_versions.retire_version(version_id)
+            return jsonify({'status': 'success', 'version': version.to_dict()})
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error retiring embedding version: {str(e)}")
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
             
     @app.route('/api/embeddings/migrate-vector-size', methods=['POST'])
     def api_migrate_vector_size():
@@ -395,6 +737,51 @@ def register_routes(app):
             logger.error(f"Error starting vector migration: {str(e)}")
             return jsonify({'error': str(e)}), 500
             
+    @app.route('/api/embeddings/ann-index', methods=['GET'])
+    def api_ann_index_info():
+        """List the approximate-nearest-neighbour indexes on the embeddings table"""
+        try:
+            return jsonify({'indexes': pgvector_indexes.get_ann_indexes()})
+        except Exception as e:
+            logger.error(f"Error fetching ANN index info: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+    
+    @app.route('/api/embeddings/ann-index', methods=['POST'])
+    def api_build_ann_index():
+        """API endpoint to create or rebuild the HNSW / IVFFlat index on embeddings"""
+        try:
+            params = request.json if request.is_json else {}
+            method = params.get('method', 'hnsw')
+            
+            if method not in pgvector_indexes.ANN_METHODS:
+                return jsonify({'error': f"method must be one of {', '.join(pgvector_indexes.ANN_METHODS)}"}), 400
+            
+            # Run the build in a background thread, large indexes take minutes
+            def run_index_build():
+                with app.app_context():
+                    try:
+                        pgvector_indexes.build_ann_index(
+                            method=method,
+                            m=params.get('m'),
+                            ef_construction=params.get('ef_construction'),
+                            lists=params.get('lists'),
+                            maintenance_work_mem=params.get('maintenance_work_mem')
+                        )
+                    except Exception as e:
+                        logger.error(f"Error during ANN index build: {str(e)}")
+            
+            thread = threading.Thread(target=run_index_build)
+            thread.daemon = True
+            thread.start()
+            
+            return jsonify({
+                'status': 'success',
+                'message': f'Started building {method} index on tender embeddings. Searches keep using the current index until the new one is ready.'
+            })
+        except Exception as e:
+            logger.error(f"Error starting ANN index build: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+            
     @app.route('/api/update-tender-urls', methods=['POST'])
     def api_update_tender_urls():
         """API endpoint to update tender URLs by searching on Etimad website"""
@@ -3,7 +3,8 @@ Script to run the vector size migration
 """
 import logging
 from migrate_vector_size import migrate_vector_size
-from regenerate_all_embeddings import regenerate_all_embeddings
+from app import app
+import generate_embeddings_incremental
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,7 +23,13 @@ def run_migration():
             
         # Step 2: Regenerate all embeddings with the new model
         logger.info("Regenerating embeddings with the new model...")
-        count = regenerate_all_embeddings()
+        # The migration deleted every row, so the active version is simply filled again
+        with app.app_context():
+            count = generate_embeddings_incremental.generate_embeddings_incrementally(
+                batch_size=50,
+                delay=5,
+                max_batches=None
+            )
         
         logger.info(f"Migration completed successfully. Regenerated {count} embeddings.")
         return True
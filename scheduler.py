@@ -6,7 +6,12 @@ from apscheduler.triggers.cron import CronTrigger
 from flask import Flask
 from scraper import run_scraper
 import generate_embeddings_incremental
-from embeddings import cleanup_expired_embeddings
+from embeddings import cleanup_expired_embeddings, memory_backend
+import embedding_versions
+import topics
+import shared_index
+from vector_index import vector_index, REFRESH_INTERVAL
+from embedding_queue import embedding_queue, EVENT_EMBEDDINGS
 from utils import get_saudi_now, SAUDI_TIMEZONE
 
 logger = logging.getLogger(__name__)
@@ -76,11 +81,41 @@ def init_scheduler(app: Flask):
         replace_existing=True
     )
     
+    # Recluster open tenders into browse topics daily at 3 AM (Saudi Arabia time, GMT+3),
+    # after the 2 AM embeddings run
+    scheduler.add_job(
+        func=run_topics_with_app_context(app),
+        trigger=CronTrigger(hour='3', minute='0', timezone=SAUDI_TIMEZONE),
+        id='topics_job',
+        name='Cluster Tender Topics',
+        replace_existing=True
+    )
+    
+    # Build the shared vector index at startup and keep it current. The first process to
+    # run this job becomes the builder; in the other workers it only maps what the builder publishes
+    if shared_index.SHARED_VECTOR_INDEX:
+        scheduler.add_job(
+            func=run_vector_index_refresh_with_app_context(app),
+            trigger='interval',
+            seconds=REFRESH_INTERVAL,
+            next_run_time=get_saudi_now(),
+            id='vector_index_job',
+            name='Refresh Shared Vector Index',
+            replace_existing=True
+        )
+    
+    # Embed newly scraped tenders in micro-batches as the scraper publishes them
+    if EVENT_EMBEDDINGS:
+        embedding_queue.start(app)
+    
     # Start the scheduler
     scheduler.start()
     logger.info("Scheduler started, scraper will run every minute fetching 24 tenders from page 1")
     logger.info("Embeddings generator will run at 10 AM, 6 PM, and 2 AM (Saudi Arabia time, GMT+3)")
+    if EVENT_EMBEDDINGS:
+        logger.info("New tenders are embedded as they are scraped, the scheduled runs catch up on the rest")
     logger.info("Expired embeddings cleanup will run daily at 8 AM (Saudi Arabia time, GMT+3)")
+    logger.info("Topic clustering will run daily at 3 AM (Saudi Arabia time, GMT+3)")
     logger.info("Initial scrape will run in the background after startup")
 
 def run_scraper_with_app_context(app: Flask):
@@ -111,4 +146,26 @@ def run_cleanup_with_app_context(app: Flask):
             # Clean up expired embeddings
             removed = cleanup_expired_embeddings()
             logger.info(f"Cleaned up {removed} expired embeddings from vector database")
+            
+            # Delete rows of embedding versions replaced by a newer one
+            removed = embedding_versions.collect_retired_versions()
+            if removed:
+                logger.info(f"Removed {removed} embeddings of retired versions")
+    return wrapper
+
+
+def run_topics_with_app_context(app: Flask):
+    """Return a function that reclusters tender topics within the app context"""
+    def wrapper():
+        with app.app_context():
+            topics.recompute_topics()
+    return wrapper
+
+
+def run_vector_index_refresh_with_app_context(app: Flask):
+    """Return a function that builds the shared vector index within the app context"""
+    def wrapper():
+        with app.app_context():
+            if memory_backend():
+                vector_index.refresh(build=True)
     return wrapper
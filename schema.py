@@ -0,0 +1,42 @@
+"""
+Helpers for evolving the database schema of existing deployments
+db.create_all() creates missing tables but never adds columns to existing ones
+"""
+import logging
+import sqlalchemy as sa
+from app import db
+
+logger = logging.getLogger(__name__)
+
+
+def add_missing_columns(model):
+    """Add columns and indexes declared on the model that are missing from its table
+
+    Args:
+        model: SQLAlchemy model class
+
+    Returns:
+        list: Names of the columns that were added
+    """
+    table = model.__table__
+    inspector = sa.inspect(db.engine)
+    if not inspector.has_table(table.name):
+        table.create(db.engine)
+        return [column.name for column in table.columns]
+
+    existing = {column['name'] for column in inspector.get_columns(table.name)}
+    added = []
+
+    with db.engine.begin() as conn:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_sql = sa.schema.CreateColumn(column).compile(dialect=db.engine.dialect)
+            logger.info(f"Adding column {column.name} to {table.name}")
+            conn.execute(sa.text(f"ALTER TABLE {table.name} ADD COLUMN {column_sql}"))
+            added.append(column.name)
+
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    return added
@@ -11,6 +11,11 @@ import datetime
 from models import Tender, ScrapingLog
 from app import db
 from utils import get_saudi_now
+import lexical_search
+import embedding_versions
+import search_filters
+from embedding_queue import embedding_queue
+from response_cache import bump_data_version
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -187,6 +192,9 @@ class EtimadScraper:
         new_count = 0
         updated_count = 0
         batch_size = 50  # Process in smaller batches to reduce transaction time
+        # Text template of the active embedding version, to detect changes that need re-embedding
+        active = embedding_versions.get_active_version()
+        template = active.template if active else embedding_versions.DEFAULT_TEMPLATE
         
         try:
             # Split tenders into smaller batches for more reliable processing
@@ -194,6 +202,10 @@ class EtimadScraper:
                 batch = tenders[i:i+batch_size]
                 batch_new = 0
                 batch_updated = 0
+                new_ids = []
+                changed_ids = []
+                # Whether any stored value changed, so cached search responses are stale
+                batch_modified = False
                 
                 try:
                     # Process each tender in the current batch
@@ -214,6 +226,7 @@ class EtimadScraper:
                                 continue
                                 
                             if existing_tender:
+                                old_text = embedding_versions.tender_text(existing_tender, template)
                                 # Update existing tender
                                 existing_tender.tender_title = tender_data['tender_title']
                                 existing_tender.organization = tender_data['organization']
@@ -237,8 +250,12 @@ class EtimadScraper:
                                 existing_tender.tender_url = tender_data['tender_url']
                                 existing_tender.city = tender_data.get('city', '')
                                 existing_tender.price = tender_data.get('price', '')
+                                existing_tender.price_value = search_filters.parse_price(existing_tender.price)
+                                batch_modified = batch_modified or db.session.is_modified(existing_tender)
                                 existing_tender.updated_at = get_saudi_now()
                                 batch_updated += 1
+                                if embedding_versions.tender_text(existing_tender, template) != old_text:
+                                    changed_ids.append(tender_id)
                             else:
                                 # Create new tender with sanitized tender_id
                                 new_tender = Tender(
@@ -256,11 +273,13 @@ class EtimadScraper:
                                     tender_url=tender_data['tender_url'],
                                     city=tender_data.get('city', ''),
                                     price=tender_data.get('price', ''),
+                                    price_value=search_filters.parse_price(tender_data.get('price')),
                                     created_at=get_saudi_now(),
                                     updated_at=get_saudi_now()
                                 )
                                 db.session.add(new_tender)
                                 batch_new += 1
+                                new_ids.append(tender_id)
                         except Exception as e:
                             # Log the error but continue with next tender
                             logger.warning(f"Error processing tender {tender_data.get('tender_id', 'unknown')}: {str(e)}")
@@ -272,6 +291,12 @@ class EtimadScraper:
                         logger.info(f"Committed batch {i//batch_size + 1} with {batch_new} new and {batch_updated} updated tenders")
                         new_count += batch_new
                         updated_count += batch_updated
+                        
+                        # Embed the committed tenders within the next minute instead of at the next scheduled run
+                        embedding_queue.publish(new_ids)
+                        embedding_queue.publish(changed_ids, changed=True)
+                        if batch_new or batch_modified:
+                            bump_data_version()
                     except Exception as e:
                         logger.error(f"Error committing batch {i//batch_size + 1}: {str(e)}")
                         db.session.rollback()
@@ -311,6 +336,13 @@ class EtimadScraper:
                 # Save tenders to database
                 new_count, updated_count = self.save_tenders_to_db(tenders)
                 
+                # Keep the full-text index in step with new and updated tenders
+                try:
+                    lexical_search.sync_search_documents()
+                except Exception as e:
+                    logger.error(f"Error updating full-text index: {str(e)}")
+                    db.session.rollback()
+                
                 # Update log entry
                 log_entry.status = "SUCCESS"
                 log_entry.tenders_scraped = len(tenders)
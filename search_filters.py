@@ -0,0 +1,109 @@
+"""
+Structured filters for vector search
+Filters are applied before ranking: as SQL predicates on pgvector, where the
+indexed tender columns let a narrow filter skip most rows, and as boolean masks
+over per-row attribute arrays in the in-memory index, which then only scores
+the rows that pass. Organization, type and city are exact matches; prices use
+the numeric price_value column; deadline bounds are inclusive dates.
+"""
+import re
+import datetime
+from collections import namedtuple
+from models import Tender
+
+FILTER_FIELDS = ('organization', 'tender_type', 'city', 'min_price', 'max_price', 'deadline_from', 'deadline_to')
+# Attributes compared for equality
+CATEGORY_FIELDS = ('organization', 'tender_type', 'city')
+
+SearchFilters = namedtuple('SearchFilters', FILTER_FIELDS, defaults=(None,) * len(FILTER_FIELDS))
+
+NO_FILTERS = SearchFilters()
+
+_NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+def parse_price(price):
+    """Numeric value of a scraped price string, or None if it holds no number"""
+    if price is None:
+        return None
+    match = _NUMBER.search(str(price).replace(',', ''))
+    return float(match.group()) if match else None
+
+
+def _parse_date(value, name, end_of_day=False):
+    try:
+        if len(value) == 10:
+            parsed = datetime.datetime.strptime(value, '%Y-%m-%d')
+            # Date-only upper bounds include the whole day
+            return parsed + datetime.timedelta(days=1, microseconds=-1) if end_of_day else parsed
+        return datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD) or ISO datetime")
+
+
+def _parse_float(value, name):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+
+
+def parse_filters(args):
+    """Build SearchFilters from request arguments or a JSON object
+
+    Raises:
+        ValueError: If a value cannot be parsed or a range is empty
+    """
+    values = {}
+    for field in FILTER_FIELDS:
+        value = args.get(field)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            continue
+        if field in CATEGORY_FIELDS:
+            values[field] = str(value).strip()
+        elif field in ('min_price', 'max_price'):
+            values[field] = _parse_float(value, field)
+        else:
+            values[field] = _parse_date(str(value).strip(), field, end_of_day=field == 'deadline_to')
+
+    filters = SearchFilters(**values)
+    if filters.min_price is not None and filters.max_price is not None and filters.min_price > filters.max_price:
+        raise ValueError("min_price must not be greater than max_price")
+    if filters.deadline_from and filters.deadline_to and filters.deadline_from > filters.deadline_to:
+        raise ValueError("deadline_from must not be after deadline_to")
+    return filters
+
+
+def is_empty(filters):
+    return filters is None or filters == NO_FILTERS
+
+
+def to_dict(filters):
+    """Filters that are set, for echoing in API responses"""
+    if is_empty(filters):
+        return {}
+    return {
+        field: value.isoformat() if isinstance(value, datetime.datetime) else value
+        for field, value in filters._asdict().items() if value is not None
+    }
+
+
+def apply_filters(query, filters):
+    """Add the filters to a query that selects from Tender"""
+    if is_empty(filters):
+        return query
+    if filters.organization is not None:
+        query = query.filter(Tender.organization == filters.organization)
+    if filters.tender_type is not None:
+        query = query.filter(Tender.tender_type == filters.tender_type)
+    if filters.city is not None:
+        query = query.filter(Tender.city == filters.city)
+    if filters.min_price is not None:
+        query = query.filter(Tender.price_value >= filters.min_price)
+    if filters.max_price is not None:
+        query = query.filter(Tender.price_value <= filters.max_price)
+    if filters.deadline_from is not None:
+        query = query.filter(Tender.submission_deadline >= filters.deadline_from)
+    if filters.deadline_to is not None:
+        query = query.filter(Tender.submission_deadline <= filters.deadline_to)
+    return query
@@ -0,0 +1,225 @@
+"""
+Memory-mapped vector index files shared by the workers of one host
+A built index is written as a generation directory of .npy arrays with room
+for more rows than it holds, plus numbered meta-N.json revisions recording how
+many rows are published. The CURRENT pointer file names the published revision
+and is replaced atomically. Workers map the arrays read-only with
+np.load(mmap_mode='r'), so the vectors are held once in the page cache however
+many workers serve searches, and a worker starting cold maps the latest
+generation instead of loading every embedding from the database.
+
+One process per host is the builder: the first whose scheduler job refreshes
+the index takes an flock on build.lock, holds it for as long as it runs and is
+the only one writing. New rows are written in place past
+the published row count and then published as a new revision; a new generation
+is only written when rows are evicted, the embedding version changes or the
+capacity is used up.
+"""
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where every worker acts as a builder
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SHARED_VECTOR_INDEX = os.environ.get("SHARED_VECTOR_INDEX", "false").lower() == "true"
+VECTOR_INDEX_DIR = os.environ.get(
+    "VECTOR_INDEX_DIR", os.path.join(tempfile.gettempdir(), "etimad-vector-index")
+)
+
+POINTER_FILE = 'CURRENT'
+LOCK_FILE = 'build.lock'
+META_TEMP_FILE = 'meta.tmp'
+# Generations and meta revisions kept besides the current one, for workers still opening them
+KEEP_PREVIOUS = 1
+# Minimum width of string arrays, so that identifiers appended later fit
+MIN_STRING_WIDTH = 32
+
+# Directory -> (pid, open lock file) of the builder role held by this process
+_builder_locks = {}
+
+
+def current_revision(directory):
+    """Published 'generation/meta-N.json' path, or None before the first build"""
+    try:
+        with open(os.path.join(directory, POINTER_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def is_builder(directory):
+    """Whether this process holds the builder role, without trying to take it"""
+    if fcntl is None:
+        return True
+    held = _builder_locks.get(directory)
+    return held is not None and held[0] == os.getpid()
+
+
+def hold_builder(directory):
+    """Whether this process is the builder, taking the role if no running process holds it
+
+    The lock is kept until the process exits, so only one process writes
+    generations; when it exits the operating system releases the lock and the
+    next process to call this takes over.
+    """
+    # A forked worker does not inherit the role of its parent
+    if is_builder(directory):
+        return True
+    os.makedirs(directory, exist_ok=True)
+    handle = open(os.path.join(directory, LOCK_FILE), 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return False
+    _builder_locks[directory] = (os.getpid(), handle)
+    return True
+
+
+def _publish(directory, revision):
+    """Point CURRENT at a revision"""
+    pointer_temp = os.path.join(directory, f'{POINTER_FILE}.{os.getpid()}.tmp')
+    with open(pointer_temp, 'w', encoding='utf-8') as f:
+        f.write(revision)
+    # Readers see either the previous or the new revision
+    os.replace(pointer_temp, os.path.join(directory, POINTER_FILE))
+
+
+def _meta_name(number):
+    """File name of meta revision number"""
+    return f'meta-{number}.json'
+
+
+def _write_meta(path, meta):
+    """Atomically write the meta file of meta['revision'] into a generation directory"""
+    temp = os.path.join(path, f'{META_TEMP_FILE}.{os.getpid()}')
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(temp, os.path.join(path, _meta_name(meta['revision'])))
+
+
+def read_meta(directory, revision):
+    """Load the metadata of a published revision
+
+    Raises:
+        OSError: If the revision was removed
+    """
+    with open(os.path.join(directory, revision), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def map_arrays(directory, meta, writable=False):
+    """Map the arrays of a generation, read-only unless writable is set
+
+    Arrays hold meta['capacity'] rows, of which the first meta['size'] are published.
+
+    Returns:
+        dict: Name -> memory-mapped array
+
+    Raises:
+        OSError: If the generation was removed or is incomplete
+    """
+    path = os.path.join(directory, meta['generation'])
+    return {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r+' if writable else 'r')
+        for name in meta['arrays']
+    }
+
+
+def string_width(array):
+    """Characters that fit in each element of a fixed-width unicode array"""
+    return array.dtype.itemsize // np.dtype('U1').itemsize
+
+
+def write_generation(directory, arrays, meta, capacity):
+    """Write a new generation and publish it
+
+    Args:
+        directory (str): Index directory
+        arrays (dict): Name -> array of the published rows; object arrays of strings
+            are stored as fixed-width unicode
+        meta (dict): JSON-serializable metadata, stored with the array names, generation,
+            revision and capacity
+        capacity (int): Rows allocated in every array, for later append_revision calls
+
+    Returns:
+        str: Published revision
+    """
+    os.makedirs(directory, exist_ok=True)
+    generation = f"index-{time.time_ns()}-{os.getpid()}"
+    temp_path = os.path.join(directory, generation + '.tmp')
+    os.makedirs(temp_path)
+
+    for name, array in arrays.items():
+        if array.dtype == object:
+            width = max([MIN_STRING_WIDTH] + [2 * len(str(value)) for value in array])
+            array = np.asarray([str(value) for value in array], dtype=f'U{width}')
+        # Rows past the published ones stay sparse on disk until they are appended
+        mapped = np.lib.format.open_memmap(
+            os.path.join(temp_path, f'{name}.npy'), mode='w+', dtype=array.dtype,
+            shape=(capacity,) + array.shape[1:]
+        )
+        mapped[:len(array)] = array
+        mapped.flush()
+        del mapped
+    meta = dict(meta, generation=generation, revision=1, arrays=list(arrays), capacity=capacity)
+    _write_meta(temp_path, meta)
+    os.rename(temp_path, os.path.join(directory, generation))
+
+    revision = f"{generation}/{_meta_name(1)}"
+    _publish(directory, revision)
+    _prune(directory, generation)
+    return revision
+
+
+def append_revision(directory, revision, meta):
+    """Publish rows the builder wrote in place past the published ones
+
+    Rows written to a writable mapping are visible to every worker through the
+    page cache, so publishing only needs a new meta revision with the larger size.
+
+    Args:
+        directory (str): Index directory
+        revision (str): Revision the rows were appended to
+        meta (dict): Metadata of the new revision; generation, arrays and capacity are kept
+
+    Returns:
+        str: Published revision
+    """
+    previous = read_meta(directory, revision)
+    number = previous['revision'] + 1
+    path = os.path.join(directory, previous['generation'])
+    _write_meta(path, dict(
+        meta, generation=previous['generation'], revision=number,
+        arrays=previous['arrays'], capacity=previous['capacity']
+    ))
+
+    published = f"{previous['generation']}/{_meta_name(number)}"
+    _publish(directory, published)
+    stale = os.path.join(path, _meta_name(number - 1 - KEEP_PREVIOUS))
+    if os.path.exists(stale):
+        os.remove(stale)
+    return published
+
+
+def _prune(directory, current):
+    """Remove older generations; workers that mapped them keep their mappings"""
+    names = [
+        entry.name for entry in os.scandir(directory)
+        if entry.is_dir() and entry.name.startswith('index-') and entry.name != current
+    ]
+    # Left behind by builds that failed; only the builder writes, so none is in progress
+    unfinished = [name for name in names if name.endswith('.tmp')]
+    generations = sorted(name for name in names if not name.endswith('.tmp'))
+    for name in unfinished + generations[:max(len(generations) - KEEP_PREVIOUS, 0)]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
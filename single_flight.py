@@ -0,0 +1,242 @@
+"""
+Single-flight de-duplication of identical concurrent computations
+When many clients fire the same search at once, only the first call for a key
+runs and the others wait for it and share its result. Threads of one worker
+wait on the running call; gunicorn workers on the same host take an flock on a
+per-key file in SINGLE_FLIGHT_DIR, and the worker holding it publishes its JSON
+result next to the lock for the workers that waited. Coalescing is best effort:
+a caller that times out or finds no fresh result computes the value itself.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import functools
+import threading
+from flask import request, Response, make_response
+import request_timing
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where calls are only coalesced within a worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+# Longest a caller waits for another call before computing the value itself
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", 30))
+SINGLE_FLIGHT_DIR = os.environ.get(
+    "SINGLE_FLIGHT_DIR", os.path.join(tempfile.gettempdir(), "etimad-single-flight")
+)
+# Lock and result files untouched for this long are removed
+SINGLE_FLIGHT_FILE_TTL = 300
+_POLL_SECONDS = 0.02
+
+
+class _Call:
+    """A computation in progress in this worker"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _try_lock(handle):
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+
+class SingleFlight:
+    """Runs one computation per key for all concurrent callers"""
+
+    def __init__(self, directory=SINGLE_FLIGHT_DIR, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.directory = directory
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self.computed = 0
+        self.shared_in_worker = 0
+        self.shared_across_workers = 0
+        self.timeouts = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def do(self, key, fn):
+        """Run fn once for all concurrent callers with the same key
+
+        Callers that joined a running call receive the same result object, or
+        its exception, so results must not be modified.
+
+        Args:
+            key (str): Identifies identical computations
+            fn (callable): Computation without arguments. Its result is shared
+                with other workers only if it is JSON serializable.
+
+        Returns:
+            The result of fn
+        """
+        if not SINGLE_FLIGHT_ENABLED or request_timing.debug_requested():
+            return fn()
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            with request_timing.timed('coalesced', 'this worker'):
+                finished = call.done.wait(self.timeout)
+            if not finished:
+                self._count('timeouts')
+                return fn()
+            self._count('shared_in_worker')
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_across_workers(key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _run_across_workers(self, key, fn):
+        """Compute the value, or wait for another worker computing the same key"""
+        if fcntl is None:
+            self._count('computed')
+            return fn()
+
+        path = os.path.join(self.directory, hashlib.sha256(key.encode('utf-8')).hexdigest())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            handle = open(path + '.lock', 'a')
+        except OSError as e:
+            logger.warning(f"Single-flight lock unavailable, computing directly: {str(e)}")
+            self._count('computed')
+            return fn()
+
+        try:
+            started = time.time()
+            if not _try_lock(handle):
+                # Another worker is computing the same key
+                deadline = started + self.timeout
+                with request_timing.timed('coalesced', 'other worker'):
+                    acquired = _try_lock(handle)
+                    while not acquired and time.time() < deadline:
+                        time.sleep(_POLL_SECONDS)
+                        acquired = _try_lock(handle)
+                if not acquired:
+                    self._count('timeouts')
+                    return fn()
+
+                found, result = self._read_result(path, key, started)
+                if found:
+                    self._count('shared_across_workers')
+                    return result
+
+            self._count('computed')
+            result = fn()
+            self._write_result(path, key, result)
+            return result
+        finally:
+            # Closing the file releases the lock
+            handle.close()
+            self._prune()
+
+    def _read_result(self, path, key, since):
+        """Result published for the key after `since`, as (found, result)"""
+        try:
+            with open(path + '.json', encoding='utf-8') as f:
+                published = json.load(f)
+        except (OSError, ValueError):
+            return False, None
+        if published.get('key') != key or published.get('written_at', 0) < since:
+            return False, None
+        return True, published.get('value')
+
+    def _write_result(self, path, key, value):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'written_at': time.time(), 'value': value}, f, ensure_ascii=False)
+            # Readers see either the previous or the complete new result
+            os.replace(temp_path, path + '.json')
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not share single-flight result: {str(e)}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        """Remove old lock and result files, at most once a minute per worker"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < 60:
+                return
+            self._last_prune = now
+        try:
+            for entry in os.scandir(self.directory):
+                # A removed lock file only stops callers that open it later from coalescing
+                if entry.is_file() and now - entry.stat().st_mtime > SINGLE_FLIGHT_FILE_TTL:
+                    os.remove(entry.path)
+        except OSError:
+            pass
+
+    def run_view(self, key, view, *args, **kwargs):
+        """Call a JSON view once for identical concurrent requests
+
+        Returns:
+            Response: The shared response, rebuilt from its status, body and Cache-Control header
+        """
+        def compute():
+            response = make_response(view(*args, **kwargs))
+            return [response.status_code, response.get_data(as_text=True), response.headers.get('Cache-Control')]
+
+        status, body, cache_control = self.do(key, compute)
+        response = Response(body, status=status, mimetype='application/json')
+        if cache_control:
+            response.headers['Cache-Control'] = cache_control
+        return response
+
+    def coalesced(self, name):
+        """Decorator sharing one response among identical concurrent GET requests"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                key = json.dumps([name, request.path, sorted(request.args.items(multi=True))], ensure_ascii=False)
+                return self.run_view(key, view, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': SINGLE_FLIGHT_ENABLED,
+                'in_flight': len(self._calls),
+                'computed': self.computed,
+                'shared_in_worker': self.shared_in_worker,
+                'shared_across_workers': self.shared_across_workers,
+                'timeouts': self.timeouts
+            }
+
+
+# Shared by the searches and API routes of this process
+single_flight = SingleFlight()
@@ -160,6 +160,9 @@ function initializeTendersTable() {
                 data: 'similarity_score',
                 render: function(data) {
                     if (!data) return '';
+                    if (data === 'Keyword match') {
+                        return '<span class="badge bg-secondary">Keyword match</span>';
+                    }
                     
                     // Extract the percentage value without the % sign
                     const value = parseFloat(data);
@@ -443,14 +446,14 @@ function performVectorSearch() {
     
     statusContainer.innerHTML = '<div class="alert alert-info"><div class="spinner-border spinner-border-sm text-primary me-2" role="status"></div> Searching...</div>';
     
-    // Perform vector search with optional today_only filter
+    // Perform hybrid keyword + semantic search with optional today_only filter
     const searchParams = new URLSearchParams({
         query: query,
         limit: limit,
         today_only: todayOnly
     });
     
-    fetch(`/api/vector-search?${searchParams}`)
+    fetch(`/api/hybrid-search?${searchParams}`)
         .then(response => {
             if (!response.ok) {
                 throw new Error('Network response was not ok');
@@ -502,11 +505,17 @@ function updateTableWithVectorResults() {
         // Use raw similarity score directly without any buffering
         const rawScore = item.similarity;
         
-        // Convert to percentage (0.0-1.0 to 0-100%)
-        const exactPercentage = (rawScore * 100).toFixed(2);
-        tenderWithScore.similarity_score = `${exactPercentage}%`;
-        // Store the raw score for debugging/sorting
-        tenderWithScore.raw_similarity = rawScore;
+        if (rawScore === null || rawScore === undefined) {
+            // Hybrid search result found by keyword match only
+            tenderWithScore.similarity_score = 'Keyword match';
+            tenderWithScore.raw_similarity = 0;
+        } else {
+            // Convert to percentage (0.0-1.0 to 0-100%)
+            const exactPercentage = (rawScore * 100).toFixed(2);
+            tenderWithScore.similarity_score = `${exactPercentage}%`;
+            // Store the raw score for debugging/sorting
+            tenderWithScore.raw_similarity = rawScore;
+        }
         
         return tenderWithScore;
     });
@@ -516,7 +525,6 @@ function updateTableWithVectorResults() {
     tendersTable.draw();
 }
 
-// Regenerate all embeddings with new text structure (title + organization + main activities)
 // Update all tender URLs to the correct format
 function updateTenderUrls() {
     const button = document.getElementById('update-tender-urls');
@@ -572,12 +580,14 @@ function updateTenderUrls() {
         });
 }
 
+// Regenerate all embeddings as a new version with the chosen text template
 function regenerateAllEmbeddings() {
     const button = document.getElementById('regenerate-all-embeddings');
     const statusContainer = document.getElementById('vector-status');
     
-    // Show confirmation dialog
-    if (!confirm('This will delete and regenerate ALL vector embeddings with the updated text structure (title + organization + main activities). This operation cannot be undone and may take some time. Continue?')) {
+    // Ask for the text template of the new embedding version
+    const template = prompt('Regenerate all embeddings as a new version. Search keeps using the current embeddings until the new ones are complete.\n\nText template (title_org_activities or detailed):', 'detailed');
+    if (!template) {
         return;
     }
     
@@ -585,20 +595,21 @@ function regenerateAllEmbeddings() {
     button.setAttribute('disabled', 'disabled');
     button.innerHTML = '<span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span> Regenerating...';
     
-    statusContainer.innerHTML = '<div class="alert alert-info">Regenerating all embeddings with updated structure (title + organization + main activities). This may take some time...</div>';
+    statusContainer.innerHTML = '<div class="alert alert-info">Building a new embedding version in the background. This may take some time...</div>';
     
     fetch('/api/embeddings/regenerate-all', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json'
-        }
+        },
+        body: JSON.stringify({ template: template })
     })
-        .then(response => {
+        .then(response => response.json().then(result => {
             if (!response.ok) {
-                throw new Error('Network response was not ok');
+                throw new Error(result.error || 'Network response was not ok');
             }
-            return response.json();
-        })
+            return result;
+        }))
         .then(result => {
             statusContainer.innerHTML = `<div class="alert alert-success">${result.message}</div>`;
             
@@ -611,7 +622,7 @@ function regenerateAllEmbeddings() {
         })
         .catch(error => {
             console.error('Error regenerating embeddings:', error);
-            statusContainer.innerHTML = '<div class="alert alert-danger">Error regenerating embeddings. Please try again later.</div>';
+            statusContainer.innerHTML = `<div class="alert alert-danger">Error regenerating embeddings: ${error.message}</div>`;
             
             // Re-enable button
             button.removeAttribute('disabled');
@@ -0,0 +1,133 @@
+"""
+Saved-search percolation
+Each subscription stores its query embedding once; newly embedded tenders are
+scored against every active subscription with one matrix product per batch
+instead of clients polling /api/vector-search.
+"""
+import logging
+import numpy as np
+from app import db
+from models import SearchSubscription, SubscriptionMatch
+from vector_index import normalize_vector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.5
+# Tender attributes that subscriptions can filter on with an exact match
+FILTER_FIELDS = ('organization', 'tender_type', 'city')
+
+
+def create_subscription(query_text, query_embedding, name=None, threshold=DEFAULT_THRESHOLD, **filters):
+    """Store a saved search with its cached query embedding
+
+    Args:
+        query_text (str): Search text
+        query_embedding (list): Embedding of the search text
+        name (str, optional): Display name
+        threshold (float, optional): Minimum cosine similarity for a match
+        **filters: Optional organization, tender_type and city values
+
+    Returns:
+        SearchSubscription: The created subscription
+    """
+    subscription = SearchSubscription(
+        name=name,
+        query_text=query_text,
+        embedding=query_embedding,
+        threshold=threshold,
+        **{field: filters.get(field) or None for field in FILTER_FIELDS}
+    )
+    db.session.add(subscription)
+    db.session.commit()
+    return subscription
+
+
+class Percolator:
+    """Active subscriptions loaded as one normalized matrix for batch matching"""
+
+    def __init__(self, subscriptions):
+        subscriptions = [s for s in subscriptions if normalize_vector(s.embedding) is not None]
+        self.ids = np.array([s.id for s in subscriptions], dtype=np.int64)
+        self.thresholds = np.array([s.threshold for s in subscriptions], dtype=np.float32)
+        self.filters = {
+            field: np.array([getattr(s, field) for s in subscriptions], dtype=object)
+            for field in FILTER_FIELDS
+        }
+        self.vectors = np.vstack([
+            normalize_vector(s.embedding) for s in subscriptions
+        ]) if subscriptions else np.empty((0, 0), dtype=np.float32)
+
+    @classmethod
+    def load(cls):
+        """Load all active subscriptions"""
+        return cls(SearchSubscription.query.filter_by(active=True).order_by(SearchSubscription.id).all())
+
+    def __len__(self):
+        return len(self.ids)
+
+    def match(self, tenders, vectors):
+        """Find (tender_id, subscription_id, similarity) matches for newly embedded tenders
+
+        Args:
+            tenders (list): Tender objects
+            vectors (list): Their embeddings, in the same order
+
+        Returns:
+            list: Matches above each subscription's threshold that pass its filters
+        """
+        # Zero vectors from failed embeddings cannot match anything
+        pairs = [(t, normalize_vector(v)) for t, v in zip(tenders, vectors)]
+        pairs = [(t, v) for t, v in pairs if v is not None]
+        if not len(self) or not pairs:
+            return []
+
+        tenders = [t for t, _ in pairs]
+        scores = np.vstack([v for _, v in pairs]) @ self.vectors.T
+        mask = scores >= self.thresholds[np.newaxis, :]
+
+        for field, wanted in self.filters.items():
+            values = np.array([getattr(t, field) for t in tenders], dtype=object)
+            mask &= (wanted[np.newaxis, :] == None) | (values[:, np.newaxis] == wanted[np.newaxis, :])  # noqa: E711
+
+        rows, columns = np.nonzero(mask)
+        return [
+            (tenders[row].tender_id, int(self.ids[column]), float(scores[row, column]))
+            for row, column in zip(rows, columns)
+        ]
+
+    def percolate(self, tenders, vectors):
+        """Match newly embedded tenders and store the matches
+
+        Returns:
+            int: Number of matches written
+        """
+        matches = self.match(tenders, vectors)
+        if not matches:
+            return 0
+
+        # A re-embedded tender keeps its original match
+        existing = set(db.session.query(
+            SubscriptionMatch.tender_id, SubscriptionMatch.subscription_id
+        ).filter(
+            SubscriptionMatch.tender_id.in_({tender_id for tender_id, _, _ in matches})
+        ).all())
+
+        new_matches = [
+            SubscriptionMatch(tender_id=tender_id, subscription_id=subscription_id, similarity=similarity)
+            for tender_id, subscription_id, similarity in matches
+            if (tender_id, subscription_id) not in existing
+        ]
+        db.session.add_all(new_matches)
+        db.session.commit()
+
+        if new_matches:
+            logger.info(f"Recorded {len(new_matches)} saved-search matches")
+        return len(new_matches)
+
+
+def get_matches(subscription_id, since_id=0, limit=50):
+    """Matches for a subscription newer than since_id, oldest first, for feed polling"""
+    return SubscriptionMatch.query.filter(
+        SubscriptionMatch.subscription_id == subscription_id,
+        SubscriptionMatch.id > since_id
+    ).order_by(SubscriptionMatch.id).limit(limit).all()
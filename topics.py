@@ -0,0 +1,402 @@
+"""
+Topic clusters of open tenders for browsing and as a search pre-filter
+A periodic job runs mini-batch k-means (spherical, on normalized vectors) over
+the active version's embeddings of open tenders and stores each cluster's
+centroid, its label made of the title terms most specific to it, and every
+tender's cluster. Tenders embedded between runs join their nearest centroid.
+The clusters are offered as a facet on /api/tenders and /api/stats. With
+TOPIC_PREFILTER enabled, the in-memory vector index only scores the tenders of
+the TOPIC_PREFILTER_PROBES clusters nearest to the query.
+
+Usage:
+    python topics.py
+"""
+import os
+import re
+import math
+import time
+import logging
+import threading
+from collections import Counter
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import desc, func
+from app import app, db
+from models import Tender, TenderEmbedding, TopicCluster, TenderTopic, EMBEDDING_DIMENSIONS
+from utils import get_saudi_now
+from lexical_search import normalize_text
+import embedding_versions
+from response_cache import bump_data_version
+from vector_index import normalize_vector, REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of clusters; small collections get fewer
+TOPIC_CLUSTERS = int(os.environ.get("TOPIC_CLUSTERS", 32))
+TOPIC_BATCH_SIZE = int(os.environ.get("TOPIC_BATCH_SIZE", 1024))
+TOPIC_ITERATIONS = int(os.environ.get("TOPIC_ITERATIONS", 100))
+# Score only the tenders of the clusters nearest to the query (in-memory index only)
+TOPIC_PREFILTER = os.environ.get("TOPIC_PREFILTER", "false").lower() == "true"
+TOPIC_PREFILTER_PROBES = int(os.environ.get("TOPIC_PREFILTER_PROBES", 4))
+MIN_CLUSTER_SIZE = 5
+LABEL_TERMS = 3
+# Candidates considered for k-means++ seeding, per cluster
+SEED_SAMPLE_PER_CLUSTER = 50
+LOAD_CHUNK_ROWS = 1000
+# Fixed seed so runs over the same tenders give the same topics
+KMEANS_SEED = 20240601
+
+_TERM_PATTERN = re.compile(r'\w+')
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _seed_centroids(vectors, k, rng):
+    """k-means++ seeding on a sample, with cosine distance"""
+    sample_size = min(len(vectors), k * SEED_SAMPLE_PER_CLUSTER)
+    sample = vectors[rng.choice(len(vectors), size=sample_size, replace=False)]
+    centroids = [sample[rng.integers(sample_size)]]
+    closest = 1.0 - sample @ centroids[0]
+    for _ in range(1, k):
+        weights = np.clip(closest, 0, None) ** 2
+        total = weights.sum()
+        choice = rng.choice(sample_size, p=weights / total) if total > 0 else rng.integers(sample_size)
+        centroids.append(sample[choice])
+        closest = np.minimum(closest, 1.0 - sample @ sample[choice])
+    return np.stack(centroids).astype(np.float32)
+
+
+def mini_batch_kmeans(vectors, k, batch_size=TOPIC_BATCH_SIZE, iterations=TOPIC_ITERATIONS, seed=KMEANS_SEED):
+    """Spherical mini-batch k-means
+
+    Each iteration assigns a random batch to the nearest centroids and moves every
+    centroid towards the mean of its batch members, with a step that shrinks as
+    the centroid accumulates members.
+
+    Args:
+        vectors (np.ndarray): Normalized float32 vectors, one per row
+        k (int): Number of clusters
+        batch_size (int, optional): Vectors per iteration
+        iterations (int, optional): Number of mini-batches
+
+    Returns:
+        np.ndarray: Normalized centroids, one per row
+    """
+    rng = np.random.default_rng(seed)
+    centroids = _seed_centroids(vectors, k, rng)
+    counts = np.zeros(k, dtype=np.float64)
+    batch_size = min(batch_size, len(vectors))
+
+    for _ in range(iterations):
+        batch = vectors[rng.integers(len(vectors), size=batch_size)]
+        nearest = np.argmax(batch @ centroids.T, axis=1)
+        batch_counts = np.bincount(nearest, minlength=k)
+        # Per-cluster sums of the batch as one matrix product
+        members = np.zeros((batch_size, k), dtype=np.float32)
+        members[np.arange(batch_size), nearest] = 1.0
+        sums = members.T @ batch
+
+        moved = batch_counts > 0
+        counts[moved] += batch_counts[moved]
+        step = (sums[moved] - batch_counts[moved, np.newaxis] * centroids[moved]) / counts[moved, np.newaxis]
+        centroids[moved] += step.astype(np.float32)
+        centroids = _normalize_rows(centroids)
+    return centroids
+
+
+def assign_nearest(vectors, centroids):
+    """Nearest centroid and its similarity for every vector
+
+    Returns:
+        tuple: (positions, similarities) arrays
+    """
+    positions = np.empty(len(vectors), dtype=np.int64)
+    similarities = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), LOAD_CHUNK_ROWS):
+        scores = vectors[start:start + LOAD_CHUNK_ROWS] @ centroids.T
+        positions[start:start + LOAD_CHUNK_ROWS] = np.argmax(scores, axis=1)
+        similarities[start:start + LOAD_CHUNK_ROWS] = scores.max(axis=1)
+    return positions, similarities
+
+
+def _title_terms(title):
+    """Distinct normalized terms of a title, with the spelling they were written in"""
+    terms = {}
+    for word in _TERM_PATTERN.findall((title or '').lower()):
+        term = normalize_text(word)
+        if len(term) >= 3 and not term.isdigit():
+            terms.setdefault(term, word)
+    return terms
+
+
+def cluster_labels(titles, positions, k):
+    """Label every cluster with the title terms most specific to it
+
+    Terms are scored by the number of titles in the cluster containing them,
+    weighted by their inverse frequency over all titles, so words common to
+    every tender do not make it into labels.
+
+    Returns:
+        list: One label per cluster, empty when no title term qualifies
+    """
+    document_frequency = Counter()
+    cluster_frequency = [Counter() for _ in range(k)]
+    spellings = {}
+    for title, position in zip(titles, positions):
+        terms = _title_terms(title)
+        document_frequency.update(terms.keys())
+        cluster_frequency[position].update(terms.keys())
+        for term, word in terms.items():
+            spellings.setdefault(term, Counter())[word] += 1
+
+    labels = []
+    for frequency in cluster_frequency:
+        scored = sorted(
+            ((count * math.log(len(titles) / document_frequency[term]), term)
+             for term, count in frequency.items() if count >= 2 or len(frequency) <= LABEL_TERMS),
+            reverse=True
+        )
+        labels.append(' / '.join(spellings[term].most_common(1)[0][0] for _, term in scored[:LABEL_TERMS]))
+    return labels
+
+
+def _load_open_vectors():
+    """Normalized active-version vectors and titles of open tenders"""
+    now = get_saudi_now()
+    query = db.session.query(TenderEmbedding.id, TenderEmbedding.embedding, Tender.tender_id, Tender.tender_title).join(
+        Tender, embedding_versions.active_embedding_join()
+    ).filter(
+        (Tender.submission_deadline.is_(None)) | (Tender.submission_deadline > now)
+    )
+    total = query.count()
+    vectors = np.empty((total, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    tender_ids = []
+    titles = []
+
+    last_id = 0
+    while len(tender_ids) < total:
+        rows = query.filter(TenderEmbedding.id > last_id).order_by(TenderEmbedding.id).limit(LOAD_CHUNK_ROWS).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for _, embedding, tender_id, title in rows:
+            vector = normalize_vector(embedding) if embedding is not None else None
+            if vector is None or len(vector) != EMBEDDING_DIMENSIONS or len(tender_ids) == total:
+                continue
+            vectors[len(tender_ids)] = vector
+            tender_ids.append(tender_id)
+            titles.append(title)
+    return vectors[:len(tender_ids)], tender_ids, titles
+
+
+def recompute_topics(max_clusters=TOPIC_CLUSTERS):
+    """Cluster the open tenders and replace the stored topics
+
+    Returns:
+        int: Number of topics stored
+    """
+    start = time.perf_counter()
+    vectors, tender_ids, titles = _load_open_vectors()
+    k = min(max_clusters, len(tender_ids) // MIN_CLUSTER_SIZE)
+    if k < 2:
+        logger.info(f"Only {len(tender_ids)} open tenders with embeddings, not clustering topics")
+        return 0
+
+    centroids = mini_batch_kmeans(vectors, k)
+    positions, similarities = assign_nearest(vectors, centroids)
+    sizes = np.bincount(positions, minlength=k)
+    labels = cluster_labels(titles, positions, k)
+
+    version_id = embedding_versions.active_version_id()
+    now = get_saudi_now()
+    try:
+        TenderTopic.query.delete(synchronize_session=False)
+        TopicCluster.query.delete(synchronize_session=False)
+        clusters = {}
+        for position in np.flatnonzero(sizes):
+            clusters[position] = TopicCluster(
+                version_id=version_id,
+                label=labels[position] or f"Topic {len(clusters) + 1}",
+                centroid=centroids[position].tolist(),
+                size=int(sizes[position]),
+                computed_at=now
+            )
+        db.session.add_all(clusters.values())
+        db.session.flush()
+
+        values = [
+            {'tender_id': tender_id, 'topic_id': clusters[position].id, 'similarity': float(similarity)}
+            for tender_id, position, similarity in zip(tender_ids, positions, similarities)
+        ]
+        for chunk_start in range(0, len(values), LOAD_CHUNK_ROWS):
+            db.session.execute(sa.insert(TenderTopic), values[chunk_start:chunk_start + LOAD_CHUNK_ROWS])
+        db.session.commit()
+    except Exception as e:
+        logger.error(f"Error storing topic clusters: {str(e)}")
+        db.session.rollback()
+        raise
+
+    bump_data_version()
+    topic_model.refresh_if_loaded()
+    logger.info(f"Clustered {len(tender_ids)} tenders into {len(clusters)} topics "
+                f"in {time.perf_counter() - start:.1f}s")
+    return len(clusters)
+
+
+def assign_topics(tenders, vectors):
+    """Place newly embedded tenders in their nearest topic and commit
+
+    Returns:
+        int: Number of tenders assigned, 0 before the first clustering run
+    """
+    centroids, topic_ids = topic_model.centroids()
+    if centroids is None or not tenders:
+        return 0
+
+    matrix = np.stack([normalize_vector(vector) for vector in vectors]).astype(np.float32)
+    positions, similarities = assign_nearest(matrix, centroids)
+    tender_ids = [tender.tender_id for tender in tenders]
+
+    TenderTopic.query.filter(TenderTopic.tender_id.in_(tender_ids)).delete(synchronize_session=False)
+    db.session.execute(sa.insert(TenderTopic), [
+        {'tender_id': tender_id, 'topic_id': int(topic_ids[position]), 'similarity': float(similarity)}
+        for tender_id, position, similarity in zip(tender_ids, positions, similarities)
+    ])
+    db.session.commit()
+    return len(tender_ids)
+
+
+def facet_counts(query):
+    """Tenders per topic among the rows of a query that selects from Tender
+
+    Returns:
+        list: {"id", "label", "count"} dicts, largest topic first
+    """
+    rows = query.order_by(None).join(
+        TenderTopic, TenderTopic.tender_id == Tender.tender_id
+    ).join(
+        TopicCluster, TopicCluster.id == TenderTopic.topic_id
+    ).with_entities(
+        TopicCluster.id, TopicCluster.label, func.count(Tender.id).label('count')
+    ).group_by(TopicCluster.id, TopicCluster.label).order_by(desc('count')).all()
+    return [{'id': topic_id, 'label': label, 'count': count} for topic_id, label, count in rows]
+
+
+def topic_filter(topic_id):
+    """Filter on Tender selecting the tenders of one topic"""
+    return Tender.tender_id.in_(
+        db.session.query(TenderTopic.tender_id).filter(TenderTopic.topic_id == topic_id)
+    )
+
+
+class TopicModel:
+    """Centroids and tender assignments of the active version, cached per process for the pre-filter"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._centroids = None
+        self._topic_ids = None
+        self._assignments = {}
+        self._version_id = None
+        self._last_refresh = None
+        # Topic position of every row of the last index snapshot seen
+        self._rows_for = None
+        self._row_topics = None
+        self.searches = 0
+        self.rows_scanned = 0
+        self.rows_total = 0
+
+    @property
+    def loaded(self):
+        return self._last_refresh is not None
+
+    def refresh(self):
+        version_id = embedding_versions.active_version_id()
+        clusters = db.session.query(TopicCluster.id, TopicCluster.centroid).filter(
+            TopicCluster.version_id.is_(None) if version_id is None else TopicCluster.version_id == version_id
+        ).order_by(TopicCluster.id).all()
+
+        centroids = topic_ids = None
+        assignments = {}
+        if clusters:
+            topic_ids = np.asarray([topic_id for topic_id, _ in clusters], dtype=np.int64)
+            centroids = _normalize_rows(np.asarray([list(c) for _, c in clusters], dtype=np.float32))
+            positions = {int(topic_id): position for position, topic_id in enumerate(topic_ids)}
+            assignments = {
+                tender_id: positions[topic_id]
+                for tender_id, topic_id in db.session.query(TenderTopic.tender_id, TenderTopic.topic_id).all()
+                if topic_id in positions
+            }
+
+        with self._lock:
+            self._centroids = centroids
+            self._topic_ids = topic_ids
+            self._assignments = assignments
+            self._version_id = version_id
+            self._rows_for = None
+            self._last_refresh = time.monotonic()
+
+    def refresh_if_stale(self, max_age=REFRESH_INTERVAL):
+        if (not self.loaded or time.monotonic() - self._last_refresh > max_age
+                or embedding_versions.active_version_id() != self._version_id):
+            self.refresh()
+
+    def refresh_if_loaded(self):
+        if self.loaded:
+            self.refresh()
+
+    def centroids(self):
+        """(centroids, topic_ids) of the active version, or (None, None) before the first run"""
+        self.refresh_if_stale()
+        return self._centroids, self._topic_ids
+
+    def nearest_topics(self, query, probes=TOPIC_PREFILTER_PROBES):
+        """Positions of the topics nearest to a normalized query, as a sorted tuple, or None"""
+        centroids, _ = self.centroids()
+        if centroids is None or probes >= len(centroids):
+            return None
+        scores = centroids @ query[:centroids.shape[1]]
+        return tuple(sorted(int(p) for p in np.argpartition(-scores, probes - 1)[:probes]))
+
+    def row_mask(self, tender_ids, topics):
+        """Rows of an index snapshot in the given topics, or not assigned to any topic yet"""
+        with self._lock:
+            if self._rows_for is not tender_ids:
+                self._row_topics = np.fromiter(
+                    (self._assignments.get(tender_id, -1) for tender_id in tender_ids.tolist()),
+                    dtype=np.int32, count=len(tender_ids)
+                )
+                self._rows_for = tender_ids
+            row_topics = self._row_topics
+        return np.isin(row_topics, topics) | (row_topics < 0)
+
+    def record(self, scanned, total):
+        with self._lock:
+            self.searches += 1
+            self.rows_scanned += scanned
+            self.rows_total += total
+
+    def stats(self):
+        with self._lock:
+            return {
+                'prefilter': TOPIC_PREFILTER,
+                'probes': TOPIC_PREFILTER_PROBES,
+                'topics': len(self._topic_ids) if self._topic_ids is not None else 0,
+                'assigned_tenders': len(self._assignments),
+                'prefiltered_searches': self.searches,
+                'scanned_fraction': round(self.rows_scanned / self.rows_total, 4) if self.rows_total else None
+            }
+
+
+# Loaded on first use by the searches and embedding batches of this process
+topic_model = TopicModel()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        recompute_topics()
@@ -0,0 +1,758 @@
+"""
+In-process vector index for semantic search over active tenders
+Keeps L2-normalized embeddings in a contiguous float32 matrix (or compact
+quantized codes) so searches work without pgvector and without a database
+round-trip per query
+"""
+import os
+import time
+import datetime
+import logging
+import threading
+import contextlib
+import numpy as np
+from sqlalchemy import func
+from app import db
+from models import Tender, TenderEmbedding, EMBEDDING_DIMENSIONS, COARSE_EMBEDDING_DIMENSIONS
+from utils import get_saudi_now, get_saudi_time_hours_ago, SAUDI_TIMEZONE
+import quantization
+import embedding_versions
+import search_filters
+import shared_index
+
+logger = logging.getLogger(__name__)
+
+# Seconds between automatic incremental refreshes triggered by searches
+REFRESH_INTERVAL = int(os.environ.get("VECTOR_INDEX_REFRESH_SECONDS", 60))
+# Initial number of rows allocated for the matrix, doubled when full
+INITIAL_CAPACITY = 1024
+# Rows per IN (...) query when fetching full vectors
+LOAD_CHUNK_ROWS = 500
+# Filtered searches score only the selected rows when at most this fraction of the index passes
+SUBSET_SCORING_FRACTION = 0.5
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def to_saudi_timestamp(dt, default):
+    """Convert a datetime to seconds on the Saudi wall clock
+
+    Naive values are treated as Saudi local time, matching how they are
+    stored by the scraper and compared by the SQL filters.
+    """
+    if dt is None:
+        return default
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(SAUDI_TIMEZONE).replace(tzinfo=None)
+    return (dt - _EPOCH).total_seconds()
+
+
+def normalize_vector(vector):
+    """Return the vector as float32 with unit L2 norm, or None if it is all zeros"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm == 0 or not np.isfinite(norm):
+        return None
+    return vector / norm
+
+
+class _IndexSnapshot:
+    """Immutable view of the index used by searches while a refresh is running"""
+
+    __slots__ = ('codes', 'scales', 'tender_ids', 'deadlines', 'published', 'categories', 'prices')
+
+    def __init__(self, codes, scales, tender_ids, deadlines, published, categories, prices):
+        self.codes = codes
+        self.scales = scales
+        self.tender_ids = tender_ids
+        self.deadlines = deadlines
+        self.published = published
+        # Filter field -> int32 code of each row's value, see VectorIndex.category_code
+        self.categories = categories
+        self.prices = prices
+
+    def __len__(self):
+        return len(self.tender_ids)
+
+
+class VectorIndex:
+    """Cosine-similarity index held in process memory
+
+    Rows are appended into preallocated buffers and published as views, so a
+    search never sees a partially written row and never blocks on a refresh.
+
+    With a compact format and/or coarse (truncated) dimensions the index holds
+    a reduced representation instead of the full float32 vectors; candidates
+    from that first-stage scan are re-ranked with the full vectors loaded
+    from the database.
+
+    With a shared_dir the rows live in memory-mapped generation files (see
+    shared_index) and only the builder process changes them. The builder role
+    is only taken by the scheduler job, never by a search. The builder maps
+    the generation writable and appends new rows in place, publishing them as a
+    new revision; evictions, version switches and a full generation are
+    compacted into private buffers and written as a new generation. Every
+    other worker maps the files read-only, so no worker keeps its own copy.
+    """
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS, compact_format=None, coarse_dimensions=None,
+                 shared_dir=None):
+        self.dimensions = dimensions
+        self.compact_format = compact_format
+        self.coarse_dimensions = coarse_dimensions
+        # Width of the vectors scored in the first stage
+        self.search_dimensions = coarse_dimensions or dimensions
+        self._code_dtype, self._code_width = quantization.code_layout(compact_format, self.search_dimensions)
+        self._lock = threading.Lock()
+        # Filter field -> value -> code; only grows, so older snapshots keep valid codes
+        self._vocabulary = {field: {} for field in search_filters.CATEGORY_FIELDS}
+        self.shared_dir = shared_dir
+        # Shared generation the buffers were mapped from, and its published revision
+        self._generation = None
+        self._revision = None
+        self._reset()
+        self._snapshot = self._publish()
+
+    def _reset(self):
+        self._codes = np.empty((0, self._code_width), dtype=self._code_dtype)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._tender_ids = np.empty(0, dtype=object)
+        self._deadlines = np.empty(0, dtype=np.float64)
+        self._published = np.empty(0, dtype=np.float64)
+        self._categories = {field: np.empty(0, dtype=np.int32) for field in search_filters.CATEGORY_FIELDS}
+        self._prices = np.empty(0, dtype=np.float64)
+        self._size = 0
+        self._max_embedding_id = 0
+        self._seen_rows = 0
+        self._last_refresh = None
+        # Embedding version the rows were loaded from
+        self._version_id = None
+        # Whether the buffers are the builder's writable mapping of the shared generation
+        self._in_place = False
+
+    def _publish(self):
+        n = self._size
+        return _IndexSnapshot(
+            self._codes[:n],
+            self._scales[:n],
+            self._tender_ids[:n],
+            self._deadlines[:n],
+            self._published[:n],
+            {field: codes[:n] for field, codes in self._categories.items()},
+            self._prices[:n]
+        )
+
+    def _buffers(self):
+        """Row buffers keyed by their shared array name"""
+        buffers = {
+            'codes': self._codes,
+            'scales': self._scales,
+            'tender_ids': self._tender_ids,
+            'deadlines': self._deadlines,
+            'published': self._published,
+            'prices': self._prices
+        }
+        for field, codes in self._categories.items():
+            buffers[f'category_{field}'] = codes
+        return buffers
+
+    def _set_buffers(self, buffers):
+        """Replace the row buffers with arrays keyed like _buffers"""
+        self._codes = buffers['codes']
+        self._scales = buffers['scales']
+        self._tender_ids = buffers['tender_ids']
+        self._deadlines = buffers['deadlines']
+        self._published = buffers['published']
+        self._categories = {
+            field: buffers[f'category_{field}'] for field in search_filters.CATEGORY_FIELDS
+        }
+        self._prices = buffers['prices']
+
+    def _reallocate(self, capacity):
+        """Copy the rows into private buffers with room for capacity rows"""
+        # Fresh buffers: published snapshots keep referencing the old ones
+        def grow(buffer):
+            # Mapped fixed-width identifiers become objects again, so longer ones fit
+            dtype = object if buffer.dtype.kind == 'U' else buffer.dtype
+            grown = np.empty((capacity,) + buffer.shape[1:], dtype=dtype)
+            grown[:self._size] = buffer[:self._size]
+            return grown
+
+        self._set_buffers({name: grow(buffer) for name, buffer in self._buffers().items()})
+        self._in_place = False
+
+    def _ensure_capacity(self, extra):
+        """Grow the row buffers so that `extra` more rows fit"""
+        needed = self._size + extra
+        capacity = len(self._codes)
+        if needed <= capacity:
+            return
+
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < needed:
+            new_capacity *= 2
+        self._reallocate(new_capacity)
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    @property
+    def nbytes(self):
+        """Memory used by the vector codes of the published snapshot"""
+        return self._snapshot.codes.nbytes
+
+    @property
+    def two_stage(self):
+        """Whether first-stage scores are approximate and need a full-precision re-rank"""
+        return self.compact_format is not None or self.coarse_dimensions is not None
+
+    @property
+    def loaded(self):
+        """Whether the index has been populated at least once"""
+        return self._last_refresh is not None
+
+    @property
+    def in_use(self):
+        """Whether searches use the index, in this process or through the shared files"""
+        if self.loaded:
+            return True
+        return self.shared_dir is not None and shared_index.current_revision(self.shared_dir) is not None
+
+    @property
+    def _layout(self):
+        return [self.compact_format, self.coarse_dimensions, self.search_dimensions]
+
+    def _sync_shared(self, writable=False):
+        """Map the latest shared revision if it is newer than the buffers. Call with the lock held.
+
+        Args:
+            writable (bool, optional): Map the arrays writable for appending in place,
+                only in the builder. Defaults to False.
+        """
+        revision = shared_index.current_revision(self.shared_dir)
+        if revision is None or (revision == self._revision and (self._in_place or not writable)):
+            return
+        try:
+            meta = shared_index.read_meta(self.shared_dir, revision)
+            if meta.get('layout') != self._layout:
+                # Written with another compact or coarse setting; the next build replaces it
+                return
+            # A new revision of the mapped generation only publishes more of its rows
+            if meta['generation'] != self._generation or (writable and not self._in_place):
+                self._set_buffers(shared_index.map_arrays(self.shared_dir, meta, writable))
+                self._generation = meta['generation']
+                self._in_place = writable
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not map vector index revision {revision}: {str(e)}")
+            return
+
+        self._size = meta['size']
+        self._max_embedding_id = meta['max_embedding_id']
+        self._seen_rows = meta['seen_rows']
+        self._version_id = meta['version_id']
+        self._vocabulary = {
+            field: {value: code for code, value in enumerate(values)}
+            for field, values in meta['vocabulary'].items()
+        }
+        self._revision = revision
+        self._snapshot = self._publish()
+        self._last_refresh = time.monotonic()
+
+    def _shared_meta(self):
+        """Metadata published with the shared rows"""
+        # Codes are positions in these lists
+        vocabulary = {
+            field: sorted(values, key=values.get) for field, values in self._vocabulary.items()
+        }
+        return {
+            'layout': self._layout,
+            'size': self._size,
+            'max_embedding_id': self._max_embedding_id,
+            'seen_rows': self._seen_rows,
+            'version_id': self._version_id,
+            'vocabulary': vocabulary
+        }
+
+    def _write_shared(self):
+        """Publish the buffers as a new shared generation and map it. Call with the lock held."""
+        n = self._size
+        # Room for as many rows again, so refreshes append in place for a long time
+        capacity = max(INITIAL_CAPACITY, 2 * n)
+        shared_index.write_generation(
+            self.shared_dir, {name: buffer[:n] for name, buffer in self._buffers().items()},
+            self._shared_meta(), capacity
+        )
+        # Serve from the mapped files so this worker does not keep a private copy
+        self._sync_shared(writable=True)
+
+    @contextlib.contextmanager
+    def _exclusive(self, build=False):
+        """Hold the lock and, for a shared index, map the latest revision
+
+        Yields whether this process may change the index: always without a
+        shared_dir, otherwise only in the builder process. The builder role is
+        only taken with build, by the scheduler job.
+        """
+        with self._lock:
+            if self.shared_dir is None:
+                yield True
+                return
+            if build:
+                building = shared_index.hold_builder(self.shared_dir)
+            else:
+                building = shared_index.is_builder(self.shared_dir)
+            self._sync_shared(writable=building)
+            yield building
+
+    def _store(self, changed):
+        """Publish a shared index after a change. Call inside _exclusive."""
+        if self.shared_dir is None or not changed:
+            return
+        if self._in_place:
+            # Rows were appended past the published ones, only the row count changes
+            self._revision = shared_index.append_revision(self.shared_dir, self._revision, self._shared_meta())
+        else:
+            self._write_shared()
+
+    def _compact(self, tender_ids):
+        """Drop the rows of tender_ids into fresh buffers, so published snapshots stay valid
+
+        Returns:
+            int: Number of rows dropped
+        """
+        n = self._size
+        keep = ~np.isin(self._tender_ids[:n], list(tender_ids))
+        removed = n - int(keep.sum())
+        if removed:
+            self._set_buffers({name: buffer[:n][keep] for name, buffer in self._buffers().items()})
+            self._size = len(self._tender_ids)
+            self._in_place = False
+            self._snapshot = self._publish()
+        return removed
+
+    def _evict_deleted(self):
+        """Evict rows whose embedding was deleted, e.g. by another process,
+        which an append-only refresh cannot see
+
+        Returns:
+            int: Number of rows evicted
+        """
+        if self._count_loaded_rows() == self._seen_rows:
+            return 0
+        present = {tender_id for (tender_id,) in db.session.query(TenderEmbedding.tender_id).filter(
+            TenderEmbedding.id <= self._max_embedding_id
+        ).filter(embedding_versions.version_filter(self._version_id))}
+        deleted = [tender_id for tender_id in self._tender_ids[:self._size].tolist() if tender_id not in present]
+        removed = self._compact(deleted)
+        self._seen_rows = self._count_loaded_rows()
+        return removed
+
+    def category_code(self, field, value, add=False):
+        """Integer code of a filter value, -1 for values no row has (None included)"""
+        vocabulary = self._vocabulary[field]
+        code = vocabulary.get(value, -1)
+        if code == -1 and add and value is not None:
+            code = vocabulary[value] = len(vocabulary)
+        return code
+
+    def _count_loaded_rows(self):
+        """Rows of the loaded version up to the newest one seen by a refresh"""
+        return db.session.query(func.count(TenderEmbedding.id)).filter(
+            TenderEmbedding.id <= self._max_embedding_id
+        ).filter(embedding_versions.version_filter(self._version_id)).scalar()
+
+    def _encode(self, vector=None, blob=None, blob_format=None):
+        """Encode one embedding for the code matrix, decoding a stored compact blob when possible"""
+        if blob is not None and blob_format == self.compact_format and self.coarse_dimensions is None:
+            decoded = quantization.decode_compact(blob, blob_format, self.dimensions)
+            if decoded is not None:
+                return decoded
+        if vector is None or len(vector) < self.search_dimensions:
+            return None
+        return quantization.encode_row(vector[:self.search_dimensions], self.compact_format)
+
+    def _load_rows(self):
+        """Fetch embedding rows newer than the last refresh
+
+        In coarse or compact mode only the small embedding_coarse or
+        embedding_compact column is read; full vectors are fetched just for
+        rows that have no usable reduced copy yet.
+        """
+        if self.coarse_dimensions is not None:
+            payload = TenderEmbedding.embedding_coarse
+        elif self.compact_format is not None:
+            payload = TenderEmbedding.embedding_compact
+        else:
+            payload = TenderEmbedding.embedding
+        rows = db.session.query(
+            TenderEmbedding.id,
+            TenderEmbedding.tender_id,
+            payload,
+            TenderEmbedding.compact_format,
+            Tender.submission_deadline,
+            Tender.publication_date,
+            Tender.organization,
+            Tender.tender_type,
+            Tender.city,
+            Tender.price_value
+        ).join(
+            Tender,
+            embedding_versions.embedding_join(self._version_id)
+        ).filter(
+            TenderEmbedding.id > self._max_embedding_id
+        ).order_by(TenderEmbedding.id).all()
+
+        if self.compact_format is None and self.coarse_dimensions is None:
+            return [(r[0], r[1], r[2], None, None) + tuple(r[4:]) for r in rows]
+
+        loaded = []
+        missing = []
+        for row_id, tender_id, value, value_format, *attributes in rows:
+            if self.coarse_dimensions is not None:
+                # Coarse vectors are encoded like full ones, compact blobs do not apply
+                vector, blob, blob_format = value, None, None
+                usable = value is not None and len(value) == self.coarse_dimensions
+            else:
+                vector, blob, blob_format = None, value, value_format
+                usable = value is not None and value_format == self.compact_format
+            if not usable:
+                vector, blob, blob_format = None, None, None
+                missing.append(row_id)
+            loaded.append([row_id, tender_id, vector, blob, blob_format] + attributes)
+
+        full_vectors = {}
+        for start in range(0, len(missing), LOAD_CHUNK_ROWS):
+            chunk = missing[start:start + LOAD_CHUNK_ROWS]
+            full_vectors.update(db.session.query(
+                TenderEmbedding.id, TenderEmbedding.embedding
+            ).filter(TenderEmbedding.id.in_(chunk)).all())
+
+        for row in loaded:
+            if row[2] is None and row[3] is None:
+                row[2] = full_vectors.get(row[0])
+        return loaded
+
+    def refresh(self, full=False, build=False):
+        """Load embedding rows created since the last refresh
+
+        Args:
+            full (bool, optional): Rebuild the index from scratch. Defaults to False.
+            build (bool, optional): Take the builder role of a shared index if no process
+                holds it. Only the scheduler job passes it. Defaults to False.
+
+        Returns:
+            int: Number of rows added to the index
+        """
+        with self._exclusive(build) as building:
+            if not building:
+                # Another process builds the shared index, this one only maps what it publishes
+                return 0
+
+            # A newly activated embedding version replaces every row
+            version_id = embedding_versions.active_version_id()
+            rebuilt = full or version_id != self._version_id or not self.loaded
+            evicted = 0
+            if rebuilt:
+                self._reset()
+                self._version_id = version_id
+            else:
+                evicted = self._evict_deleted()
+
+            now_ts = to_saudi_timestamp(get_saudi_now(), 0.0)
+            rows = self._load_rows()
+
+            self._ensure_capacity(len(rows))
+            added = 0
+            for row_id, tender_id, vector, blob, blob_format, deadline, published, *attributes in rows:
+                self._max_embedding_id = max(self._max_embedding_id, row_id)
+                self._seen_rows += 1
+
+                deadline_ts = to_saudi_timestamp(deadline, np.inf)
+                if deadline_ts <= now_ts:
+                    # Expired tenders are never searchable, skip them up front
+                    continue
+
+                encoded = self._encode(vector, blob, blob_format)
+                if encoded is None:
+                    logger.warning(f"Skipping unusable embedding for tender {tender_id}")
+                    continue
+
+                if self._in_place and len(tender_id) > shared_index.string_width(self._tender_ids):
+                    # Too long for the mapped identifiers, so a new generation is written
+                    self._reallocate(len(self._codes))
+
+                i = self._size
+                self._codes[i], self._scales[i] = encoded
+                self._tender_ids[i] = tender_id
+                self._deadlines[i] = deadline_ts
+                self._published[i] = to_saudi_timestamp(published, -np.inf)
+                for field, value in zip(search_filters.CATEGORY_FIELDS, attributes):
+                    self._categories[field][i] = self.category_code(field, value, add=True)
+                price = attributes[-1]
+                self._prices[i] = price if price is not None else np.nan
+                self._size += 1
+                added += 1
+
+            self._snapshot = self._publish()
+            self._last_refresh = time.monotonic()
+            self._store(rebuilt or evicted > 0 or added > 0)
+
+            if added:
+                logger.info(f"Vector index loaded {added} embeddings ({self._size} total, {self.nbytes} bytes)")
+            return added
+
+    def refresh_if_stale(self, max_age=REFRESH_INTERVAL):
+        """Refresh the index if it was never loaded, is older than max_age seconds,
+        or another embedding version became active. A shared index only maps the
+        builder's newer revisions."""
+        if self.shared_dir is not None:
+            self._map_shared_if_newer()
+            return
+        if (not self.loaded or time.monotonic() - self._last_refresh > max_age
+                or embedding_versions.active_version_id() != self._version_id):
+            self.refresh()
+
+    def _map_shared_if_newer(self):
+        """Map a newer shared revision; the scheduler job keeps it current, so searches never build
+
+        A search does not wait while the lock is held by a refresh or an
+        eviction, it keeps the current snapshot and maps the revision next time.
+        """
+        if shared_index.current_revision(self.shared_dir) == self._revision:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._sync_shared(writable=self._in_place)
+        finally:
+            self._lock.release()
+
+    def refresh_if_loaded(self):
+        """Pick up new rows, but only in processes that actually use the index"""
+        if self.in_use:
+            self.refresh()
+
+    def remove(self, tender_ids):
+        """Evict tenders whose embeddings were deleted from the database
+
+        Rows are compacted into fresh buffers, so published snapshots stay
+        valid, and the row count used to detect deletions is re-read so the
+        next refresh does not scan for them again. Outside the builder of a
+        shared index nothing happens here; the builder evicts the rows at its
+        next refresh.
+
+        Returns:
+            int: Number of rows evicted
+        """
+        if not self.in_use:
+            return 0
+        with self._exclusive() as building:
+            if not building:
+                return 0
+            removed = self._compact(tender_ids)
+            self._seen_rows = self._count_loaded_rows()
+            if removed:
+                self._store(True)
+
+        if removed:
+            logger.info(f"Vector index evicted {removed} embeddings ({self._size} total)")
+        return removed
+
+    def active_mask(self, snapshot, today_only=False, filters=None):
+        """Boolean mask of rows passing the deadline, today_only and structured filters"""
+        now_ts = to_saudi_timestamp(get_saudi_now(), 0.0)
+        mask = snapshot.deadlines > now_ts
+        if today_only:
+            since_ts = to_saudi_timestamp(get_saudi_time_hours_ago(24), 0.0)
+            mask &= snapshot.published >= since_ts
+        if search_filters.is_empty(filters):
+            return mask
+
+        for field in search_filters.CATEGORY_FIELDS:
+            value = getattr(filters, field)
+            if value is not None:
+                mask &= snapshot.categories[field] == self.category_code(field, value)
+        # Comparisons with NaN are false, so tenders without a price never match a price range
+        if filters.min_price is not None:
+            mask &= snapshot.prices >= filters.min_price
+        if filters.max_price is not None:
+            mask &= snapshot.prices <= filters.max_price
+        if filters.deadline_from is not None:
+            mask &= snapshot.deadlines >= to_saudi_timestamp(filters.deadline_from, 0.0)
+        if filters.deadline_to is not None:
+            mask &= snapshot.deadlines <= to_saudi_timestamp(filters.deadline_to, 0.0)
+        return mask
+
+    def _rerank(self, candidates, queries, limits):
+        """Score candidates exactly using their full-precision vectors from the database
+
+        Args:
+            candidates (dict): Query position -> candidate tender IDs
+            queries (list): Normalized full-width query vectors
+            limits (list): Result limit per query
+
+        Returns:
+            dict: Query position -> (tender_id, similarity) tuples sorted by similarity
+        """
+        wanted = set()
+        for tender_ids in candidates.values():
+            wanted.update(tender_ids)
+
+        # One round-trip for the candidates of every query
+        vectors = {}
+        wanted = list(wanted)
+        for start in range(0, len(wanted), LOAD_CHUNK_ROWS):
+            rows = db.session.query(
+                TenderEmbedding.tender_id, TenderEmbedding.embedding
+            ).filter(TenderEmbedding.tender_id.in_(wanted[start:start + LOAD_CHUNK_ROWS])).filter(
+                embedding_versions.version_filter(self._version_id)
+            ).all()
+            for tender_id, embedding in rows:
+                vector = normalize_vector(embedding) if embedding is not None else None
+                if vector is not None and len(vector) == self.dimensions:
+                    vectors[tender_id] = vector
+
+        ranked = {}
+        for position, tender_ids in candidates.items():
+            scored = [
+                (tender_id, float(vectors[tender_id] @ queries[position]))
+                for tender_id in tender_ids if tender_id in vectors
+            ]
+            scored.sort(key=lambda item: item[1], reverse=True)
+            ranked[position] = scored[:limits[position]]
+        return ranked
+
+    def search(self, query_vector, limit=10, today_only=False, rerank_candidates=None, filters=None):
+        """Find the most similar active tenders
+
+        Args:
+            query_vector (list): Query embedding
+            limit (int, optional): Maximum number of results. Defaults to 10.
+            today_only (bool, optional): Only include tenders published in the last 24 hours.
+            rerank_candidates (int, optional): First-stage candidates to re-rank at full precision.
+            filters (SearchFilters, optional): Structured filters applied before scoring.
+
+        Returns:
+            list: (tender_id, similarity) tuples sorted by similarity
+        """
+        return self.search_batch(
+            [query_vector], [limit], [today_only], rerank_candidates=rerank_candidates, filters=[filters]
+        )[0]
+
+    def search_batch(self, query_vectors, limits, today_only=None, rerank_candidates=None, filters=None):
+        """Find the most similar active tenders for several queries with one matrix product
+
+        Queries sharing the same filters are scored together. When the filters
+        select only a small part of the index, just those rows are scored, so a
+        narrow filter is cheaper than an unfiltered search. With the topic
+        pre-filter enabled, only the rows of the topics nearest to each query
+        (and rows not assigned to a topic yet) are scored.
+
+        Args:
+            query_vectors (list): Query embeddings
+            limits (list): Maximum number of results per query
+            today_only (list, optional): Per-query flag to only include tenders published
+                in the last 24 hours. Defaults to False for every query.
+            rerank_candidates (int, optional): First-stage candidates to re-rank at full precision.
+            filters (list, optional): Per-query SearchFilters. Defaults to no filters.
+
+        Returns:
+            list: One list of (tender_id, similarity) tuples per query, sorted by similarity
+        """
+        self.refresh_if_stale()
+        snapshot = self._snapshot
+
+        results = [[] for _ in query_vectors]
+        if today_only is None:
+            today_only = [False] * len(query_vectors)
+        if filters is None:
+            filters = [None] * len(query_vectors)
+        if len(snapshot) == 0:
+            return results
+
+        queries = {}
+        stage_queries = {}
+        for position, query_vector in enumerate(query_vectors):
+            query = normalize_vector(query_vector)
+            if query is None or limits[position] <= 0:
+                continue
+            stage_query = query
+            if self.coarse_dimensions is not None:
+                stage_query = normalize_vector(query[:self.coarse_dimensions])
+                if stage_query is None:
+                    continue
+            queries[position] = query
+            stage_queries[position] = stage_query
+
+        if not queries:
+            return results
+
+        # Imported here because topics builds on this module
+        import topics
+        prefilter = topics.topic_model if topics.TOPIC_PREFILTER else None
+
+        # Masks only depend on the filters and nearest topics, so queries sharing them share one
+        groups = {}
+        for position in stage_queries:
+            nearest = prefilter.nearest_topics(queries[position]) if prefilter is not None else None
+            key = (bool(today_only[position]), filters[position] or search_filters.NO_FILTERS, nearest)
+            groups.setdefault(key, []).append(position)
+
+        candidates = {}
+        for (flag, group_filters, nearest), positions in groups.items():
+            mask = self.active_mask(snapshot, flag, group_filters)
+            if nearest is not None:
+                in_topics = mask & prefilter.row_mask(snapshot.tender_ids, nearest)
+                scanned = int(in_topics.sum())
+                # Fall back to every row when the nearest topics cannot fill the results
+                if scanned >= max(limits[p] for p in positions):
+                    prefilter.record(scanned, int(mask.sum()))
+                    mask = in_topics
+            rows = np.flatnonzero(mask)
+            if len(rows) == 0:
+                continue
+
+            stacked = np.stack([stage_queries[p] for p in positions])
+            if len(rows) > len(snapshot) * SUBSET_SCORING_FRACTION:
+                # Most rows pass: scoring the whole matrix avoids copying it
+                scores = quantization.score_codes_batch(
+                    self.compact_format, snapshot.codes, snapshot.scales, stacked, self.search_dimensions
+                )[rows]
+            else:
+                scores = quantization.score_codes_batch(
+                    self.compact_format, snapshot.codes[rows], snapshot.scales[rows], stacked,
+                    self.search_dimensions
+                )
+
+            for column, position in enumerate(positions):
+                column_scores = scores[:, column]
+                limit = limits[position]
+                k = min(limit, len(rows))
+                if self.two_stage:
+                    k = min(max(rerank_candidates or quantization.RERANK_CANDIDATES, limit), len(rows))
+
+                top = np.argpartition(-column_scores, k - 1)[:k]
+                top = top[np.argsort(-column_scores[top])]
+                # tolist() also turns IDs from mapped unicode arrays into str
+                tender_ids = snapshot.tender_ids[rows[top]].tolist()
+
+                if self.two_stage:
+                    candidates[position] = tender_ids
+                else:
+                    results[position] = [
+                        (tender_id, float(column_scores[i])) for tender_id, i in zip(tender_ids, top)
+                    ]
+
+        if candidates:
+            for position, ranked in self._rerank(candidates, queries, limits).items():
+                results[position] = ranked
+
+        return results
+
+
+# Shared index for this process
+vector_index = VectorIndex(
+    compact_format=quantization.COMPACT_FORMAT,
+    coarse_dimensions=COARSE_EMBEDDING_DIMENSIONS if quantization.COARSE_SEARCH else None,
+    shared_dir=shared_index.VECTOR_INDEX_DIR if shared_index.SHARED_VECTOR_INDEX else None
+)